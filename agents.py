@@ -3,19 +3,23 @@ Contains the implementation of all the agents of the system.
 """
 from __future__ import annotations
 from copy import copy
-from typing import List, Set, Optional
+from typing import TYPE_CHECKING, List, Optional
 
 from mesa import Agent, Model
 
+from dispatch import HANDSHAKE
 from enums import Directions, LightStatus
+from routing import Route, find_route, find_routes
 
 TICKS_TO_CHANGE = 2
 
+if TYPE_CHECKING:
+    from planning import PlannedSearch
+
 
 class Car(Agent):
+    stages = ["notify_passenger", "move_cars", "pick_drop_passengers"]
     capacity = 5
-    movements = 0
-    moving_cars = 0
 
     def __init__(self, unique_id, model: Model, start: (int, int), destination: (int, int)):
         """
@@ -28,78 +32,104 @@ class Car(Agent):
         super().__init__(unique_id, model)
         self.pos = start
         self.destination = destination
-        self.direction = self.model.grid.get_cell_list_contents([self.pos])[0].direction
-        self.route = []
+        self.direction = self.model.road_direction(self.pos)
+        self.route = Route()
         self.passengers = []
         self.drops = []
         self.pickup = None
         self.objective = None
         self.model.grid.place_agent(self, self.pos)
         self.real_movement = None
-        Car.moving_cars += 1
-        road_destination = self.model.grid.get_cell_list_contents([self.destination])
-        road = [agent for agent in road_destination if isinstance(agent, Road)][0]
-        road.text = f"{self.unique_id}"
-
-    def find_optimal_routes(self, passengers: List[Passenger]) -> List[str]:
+        self.distance = 0
+        if self.pos != self.destination:
+            self.model.blockers[self.pos] += 1
+        # Refresh of the congestion costs when the route was last repaired
+        self.route_epoch = 0
+        self.model.stats.moving_cars += 1
+        self.model.labels[self.destination] = f"{self.unique_id}"
+
+    def interest_points(self) -> List[Passenger]:
+        """Passengers that the car can go for next: the ones onboard, and its pickup if any"""
+        interest_points = copy(self.drops)
+        if self.pickup:
+            interest_points.append(self.pickup[0])
+        return interest_points
+
+    def find_optimal_routes(
+        self, passengers: List[Passenger], planned: Optional[PlannedSearch] = None
+    ) -> List[(Passenger, Route)]:
         """
-        Find the optimal routes to a set of points by using a BFS. Note that a single search is
-        used to find all the objectives, reducing the complexity. Objectives must be passengers
-        to be dropped.
+        Find the optimal routes to a set of points. The routes that were already found from the
+        current position are reused from the route cache of the model, and the rest are looked
+        up in the routing table or found by a single BFS. Objectives must be passengers to be
+        dropped.
         :param passengers: List of passengers to be dropped
-        :return: List of tuples (Passenger, ["UP", "DW", "LF"])
+        :param planned: Search of the routes made by the planning workers of the model, or None
+        :return: List of tuples (Passenger, Route)
         """
-        routes = []
-        q = [(self.pos, [])]
-        visited = set()
-        while q:
-            curr_tile, curr_route = q.pop(0)
-
-            for passenger in passengers:
-                for direction in Directions:
-                    disp = direction.value
-                    trial_cell = curr_tile[0] + disp[0], curr_tile[1] + disp[1]
-
-                    if passenger.is_traveling:
-                        if trial_cell == passenger.destination:
-                            routes.append((passenger, curr_route))
-
-                    elif passenger.is_waiting:
-                        if trial_cell == passenger.pos:
-                            routes.append((passenger, curr_route))
-                            passengers.remove(passenger)
-
-            if not passengers:
-                break
-
-            next_tiles = self.next_direction(curr_tile, curr_route, visited)
-            q += next_tiles
-
-        return routes
+        routes = find_routes(
+            self.model.graph,
+            self.model.routing,
+            self.model.route_cache,
+            self.pos,
+            [passenger.get_meeting_point() for passenger in passengers],
+            self.model.profiler,
+            self.model.congestion,
+            planned,
+        )
+        return [(passengers[index], route) for index, route in routes]
 
-    def shortest_route_home(self) -> List[str]:
+    def shortest_route_home(self) -> Route:
         """
         Find the optimal route to the destination from the current position.
-        :return: List of directions in the route
+        :return: The route
         """
-        q = [(self.pos, [])]
-        visited = set()
-        route = None
-        while q:
-            curr_tile, curr_route = q.pop(0)
-
-            if curr_tile == self.destination:
-                route = curr_route
-                break
-
-            next_tiles = self.next_direction(curr_tile, curr_route, visited)
-            q += next_tiles
+        return find_route(
+            self.model.graph,
+            self.model.routing,
+            self.model.route_cache,
+            self.pos,
+            self.destination,
+            self.model.profiler,
+            self.model.congestion,
+        )
 
-        return route
+    def repair_route(self):
+        """
+        Search the route to the current objective again if the congestion costs were refreshed
+        after the last search, e.g. when the car is stuck in a queue that the new costs avoid.
+        """
+        congestion = self.model.congestion
+        if self.route_epoch == congestion.epoch:
+            return
+
+        self.route_epoch = congestion.epoch
+        if self.objective is None:
+            return
+        elif self.objective is self:
+            route = self.shortest_route_home()
+        else:
+            routes = self.find_optimal_routes([self.objective])
+            route = routes[0][1] if routes else None
+        if route:
+            self.route = route
+
+    def wait(self):
+        """The car could not move along its route in this tick"""
+        self.real_movement = "NA"
+        if self.model.congestion:
+            self.model.congestion.wait(self.pos)
+            self.repair_route()
 
     def receive_passenger_confirmation(self, passenger: Passenger, route: List[str]):
-        """Receive a confirmation from a passenger. This sets the pickup objective and the route"""
+        """
+        Receive a confirmation from a passenger. This sets the pickup objective and the route. A
+        car that was heading to its destination chooses its objective again in move_cars.
+        """
         self.pickup = (passenger, route)
+        if self.objective is self:
+            self.objective = None
+            self.route = Route()
 
     def apply_movement(self, next_direction: str):
         """Apply a direction movement"""
@@ -111,146 +141,103 @@ class Car(Agent):
         """
         TURN PART 1
         In this fragment of the turn, if the car does not have a pickup and if it has capacity,
-        it will search for the nearest passenger.
+        it will search for the nearest passenger, or take the one assigned by the dispatcher of
+        the model.
         :return:
         """
         if not self.pickup and len(self.passengers) < self.capacity:
-            passenger, route = self.find_nearest_passenger()
+            if self.model.dispatcher == HANDSHAKE:
+                passenger, route = self.find_nearest_passenger()
+            else:
+                passenger, route = self.model.assignments.get(self, (None, []))
             if passenger:
                 passenger.receive_possible_ride(self, route)
 
     def find_nearest_passenger(self) -> Optional[(Passenger, List[str])]:
         """
-        Find the nearest passenger by using a BFS.
+        Find the nearest passenger. The model labels every cell with its nearest waiting
+        passenger at the beginning of the tick using a single reverse BFS, so this is a lookup.
         :return: Return the passenger and the list of movements to reach it
         """
-        potential_passenger, potential_route = None, []
-        q = [(self.pos, [])]
-        visited = set()
-        while q:
-            curr_tile, curr_route = q.pop(0)
-
-            adjacent_passenger = self.get_adjacent_passenger(curr_tile)
-            if adjacent_passenger:
-                potential_passenger, potential_route = adjacent_passenger, curr_route
-                break
-
-            next_tiles = self.next_direction(curr_tile, curr_route, visited)
-            q += next_tiles
-
-        return potential_passenger, potential_route
-
-    def get_adjacent_passenger(self, coords: (int, int)) -> Optional[Passenger]:
-        """
-        Utility function. Obtain a passenger that is in an adjacent cell to the specified position,
-        if any.
-        :return: Passenger adjacent to the position.
-        """
-        adjacent_passenger = None
-        adjacent_agents = self.model.grid.get_neighbors(
-            pos=coords, moore=False, include_center=False, radius=1
-        )
-        passengers = [
-            agent
-            for agent in adjacent_agents
-            if isinstance(agent, Passenger) and agent.needs_ride()
-        ]
-
-        if passengers:
-            adjacent_passenger = passengers[0]
-
-        return adjacent_passenger
+        field = self.model.passenger_field
+        nearest = field.nearest(self.pos)
+        if nearest is None:
+            return None, []
 
-    def confirm_car(self):
-        """TURN PART 2 Turn fragment not implemented for this agent"""
-        pass
-
-    def tick_traffic_lights(self):
-        """TURN PART 3 Turn fragment not implemented for this agent"""
-        pass
+        return self.model.waiting_passengers[nearest], field.route(self.pos)
 
     def move_cars(self):
         """
         Logic that controls the direction of the movement and if it is possible to move given the
         status of the traffic lights. This is the most complex method since it handles the whole
-        movement logic, including long term, temporary, and immediate decisions.
+        movement logic, including long term, temporary, and immediate decisions. The next cell is
+        only requested, and the model moves the car in resolve_moves if it gets it.
         """
         if not self.objective:
-            interest_points = copy(self.drops)
-            if self.pickup:
-                interest_points.append(self.pickup[0])
-
-            routes = self.find_optimal_routes(interest_points)
+            interest_points = self.interest_points()
+            routes = self.find_optimal_routes(
+                interest_points, self.model.planned.pop(self.unique_id, None)
+            )
             if routes:
                 optimal = min(routes, key=lambda x: len(x[1]))
                 self.route = optimal[1]
                 self.objective = optimal[0]
 
         if not self.route:
-            if isinstance(self.objective, Passenger):
+            if isinstance(self.objective, Passenger) or self.model.stats.passengers_without_ride:
+                # Next to the passenger that is the objective, or waiting for a passenger
+                self.real_movement = "NA"
                 return
 
-            elif Passenger.passengers_without_ride > 0:
-                cell = self.model.grid.get_cell_list_contents([self.pos])
-                cars = [agent for agent in cell if isinstance(agent, Car)]
-                intersection = [agent for agent in cell if isinstance(agent, Intersection)]
-                road = [agent for agent in cell if isinstance(agent, Road)]
-
-                if cars:
-                    for car in cars:
-                        if car.pos != car.destination:
-                            self.real_movement = "NA"
-                            return
-
-                elif intersection:
-                    if intersection[0].get_active_direction() == self.direction:
-                        direction_to_go = self.random.choice(intersection[0].directions_to_go)
-                        x, y = self.apply_movement(direction_to_go)
-                        self.model.grid.move_agent(self, (x, y))
-                        self.real_movement = "NA"
-                        return
-
-                elif road:
-                    x, y = self.apply_movement(road[0].direction)
-                    self.model.grid.move_agent(self, (x, y))
-                    self.real_movement = road[0].direction
-                    return
-
             elif self.pos == self.destination:
                 self.model.kill_list.append(self)
-                Car.moving_cars -= 1
+                self.model.stats.moving_cars -= 1
                 self.real_movement = "PA"
                 return
 
-            else:
-                self.route = self.shortest_route_home()
-                self.objective = self
-
-        next_direction = self.route.pop(0)
-        x_new, y_new = self.apply_movement(next_direction)
-
-        cell = self.model.grid.get_cell_list_contents([(x_new, y_new)])
-        intersection = [agent for agent in cell if isinstance(agent, Intersection)]
-        cars = [agent for agent in cell if isinstance(agent, Car)]
-
-        if intersection:
-            if intersection[0].get_active_direction() != self.direction:
-                self.route.insert(0, next_direction)
+            self.route = self.shortest_route_home()
+            self.objective = self
+            if not self.route:
                 self.real_movement = "NA"
                 return
 
-        elif cars:
-            for car in cars:
-                if car.pos != car.destination:
-                    self.route.insert(0, next_direction)
-                    self.real_movement = "NA"
-                    return
+        # Whether the next cell is free is decided for all the cars at once in resolve_moves, so
+        # the car only requests it
+        target = self.apply_movement(self.route.next_direction())
+        intersection = self.model.intersection_at.get(target)
+        if intersection and intersection.get_active_direction() != self.direction:
+            self.wait()
+            return
+
+        self.model.reservations.request(
+            self,
+            self.unique_id,
+            self.pos,
+            target,
+            reserve=intersection is None,
+            blocking=self.pos != self.destination,
+        )
 
+    def apply_move(self):
+        """
+        Move to the next cell of the route, once the model granted it. The route only advances
+        when the car moves, so a blocked car keeps it as it is.
+        """
+        next_direction = self.route.next_direction()
+        x_new, y_new = self.apply_movement(next_direction)
+        self.route.advance()
+        if self.model.congestion:
+            self.model.congestion.depart(self.pos)
+        if self.pos != self.destination:
+            self.model.blockers[self.pos] -= 1
+        if (x_new, y_new) != self.destination:
+            self.model.blockers[x_new, y_new] += 1
         self.model.grid.move_agent(self, (x_new, y_new))
         self.pos = (x_new, y_new)
         self.direction = next_direction
         self.real_movement = self.direction
-        Car.movements += 1
+        self.distance += 1
+        self.model.stats.movements += 1
 
         for i in range(len(self.passengers)):
             self.model.grid.move_agent(self.passengers[i], self.pos)
@@ -263,13 +250,12 @@ class Car(Agent):
         state.
         :return:
         """
-        adjacent_agents = self.model.grid.get_neighbors(
-            pos=self.pos, moore=False, include_center=False, radius=1
-        )
         if isinstance(self.objective, Passenger):
-            if self.objective.is_waiting and self.objective in adjacent_agents:
+            if self.objective.is_waiting and self.objective in self.model.waiting.next_to(self.pos):
+                self.model.waiting.pick_up(self.objective)
                 self.objective.is_waiting = False
                 self.objective.is_traveling = True
+                self.objective.pickup_tick = self.model.schedule.steps
                 self.drops.append(self.objective)
                 self.passengers.append(self.objective)
                 self.pickup = None
@@ -283,63 +269,17 @@ class Car(Agent):
                     if self.objective.destination == (trial_x, trial_y):
                         self.objective.is_traveling = False
                         self.objective.has_arrived = True
+                        self.objective.arrival_tick = self.model.schedule.steps
+                        self.model.stats.passengers_arrived += 1
                         self.passengers.remove(self.objective)
                         self.drops.remove(self.objective)
                         self.objective.drop()
                         self.objective = None
                         break
 
-    def get_possible_directions(self, coords: (int, int)) -> List[str]:
-        """
-        Utility function. Obtain the possible directions that a car can go to from a specified
-        position.
-        :return: List of directions
-        """
-        directions = []
-        cell = self.model.grid.get_cell_list_contents([coords])
-        road = [road for road in cell if isinstance(road, Road)]
-        intersection = [intersec for intersec in cell if isinstance(intersec, Intersection)]
-
-        if road:
-            directions.append(road[0].direction)
-
-        elif intersection:
-            directions += intersection[0].directions_to_go
-
-        return directions
-
-    def next_direction(
-        self, curr_tile: (int, int), curr_route: List[str], visited: Set[(int, int)]
-    ) -> List[((int, int), List[str])]:
-        """
-        Utility Function. Find the next possible directions given the current position, checking
-        that the resulting tiles have not been visited before. This is a utility function used to
-        avoid repetition in the BFS.
-        :param curr_tile: The current tile in the search
-        :param curr_route: The current route in the search
-        :param visited: The set of visited nodes
-        :return: List of tuples that include the position and route of the next tiles that should be
-        checked.
-        """
-        directions = []
-        possible_directions = self.get_possible_directions(curr_tile)
-        for direction in possible_directions:
-            displacement = Directions[direction].value
-            next_row = curr_tile[0] + displacement[0]
-            next_col = curr_tile[1] + displacement[1]
-            next_pos = (next_row, next_col)
-
-            if next_pos not in visited:
-                next_route = copy(curr_route)
-                next_route.append(direction)
-                directions.append((next_pos, next_route))
-                visited.add(next_pos)
-
-        return directions
-
 
 class Passenger(Agent):
-    passengers_without_ride = 0
+    stages = ["confirm_car"]
 
     def __init__(self, unique_id, model, start, destination):
         super().__init__(unique_id, model)
@@ -349,15 +289,39 @@ class Passenger(Agent):
         self.has_arrived = False
         self.is_waiting = False
         self.possible_rides = {}
+        self.spawn_tick = self.model.schedule.steps
+        self.pickup_tick = None
+        self.arrival_tick = None
         self.model.grid.place_agent(self, self.pos)
-        Passenger.passengers_without_ride += 1
-        sw_destination = self.model.grid.get_cell_list_contents([self.destination])
-        sidewalk = [agent for agent in sw_destination if isinstance(agent, Sidewalk)][0]
-        sidewalk.text = f"{self.unique_id}"
+        self.model.waiting.add(self)
+        self.model.stats.passengers_without_ride += 1
+        self.model.labels[self.destination] = f"{self.unique_id}"
+
+    @property
+    def wait_ticks(self) -> int:
+        """Ticks waited until the pickup, or until now if the passenger has not been picked up"""
+        end = self.model.schedule.steps if self.pickup_tick is None else self.pickup_tick
+        return end - self.spawn_tick
+
+    @property
+    def ride_ticks(self) -> int:
+        """Ticks spent in a car until the arrival, or until now if it is still traveling"""
+        if self.pickup_tick is None:
+            return 0
+        end = self.model.schedule.steps if self.arrival_tick is None else self.arrival_tick
+        return end - self.pickup_tick
 
     def needs_ride(self):
         return not (self.is_traveling or self.has_arrived or self.is_waiting)
 
+    def get_meeting_point(self) -> (int, int):
+        """
+        Obtain the cell next to which a car must stop: the destination while traveling, otherwise
+        the current position.
+        :return: (x, y) tuple
+        """
+        return self.destination if self.is_traveling else self.pos
+
     def receive_possible_ride(self, car: Car, route: list):
         self.possible_rides[car] = route
 
@@ -365,10 +329,6 @@ class Passenger(Agent):
         self.model.grid.move_agent(self, self.destination)
         self.pos = self.destination
 
-    def notify_passenger(self):
-        """Turn not implemented for this agent"""
-        pass
-
     def confirm_car(self):
         """
         In this fragment of the turns, the passenger will evaluate all the proposals from the
@@ -378,20 +338,14 @@ class Passenger(Agent):
         if self.possible_rides and self.needs_ride():
             nearest_car = min(self.possible_rides.keys(), key=lambda x: len(self.possible_rides[x]))
             self.is_waiting = True
-            Passenger.passengers_without_ride -= 1
+            self.model.waiting.confirm(self)
+            self.model.stats.passengers_without_ride -= 1
             nearest_car.receive_passenger_confirmation(self, self.possible_rides[nearest_car])
 
-    def tick_traffic_lights(self):
-        pass
-
-    def move_cars(self):
-        pass
-
-    def pick_drop_passengers(self):
-        pass
-
 
 class Intersection(Agent):
+    stages = ["tick_traffic_lights"]
+
     def __init__(
         self,
         unique_id: int,
@@ -426,14 +380,6 @@ class Intersection(Agent):
         self.traffic_lights[self.directions_to_stop[self.next_light]].toggle()
         self.active_light = self.next_light
 
-    def notify_passenger(self):
-        """Turn not implemented for this agent"""
-        pass
-
-    def confirm_car(self):
-        """Turn not implemented for this agent"""
-        pass
-
     def tick_traffic_lights(self):
         """
         In this turn, the intersection will determine which traffic light it should turn off
@@ -449,17 +395,13 @@ class Intersection(Agent):
             self.change_traffic_light_status()
             self.ticks_to_light_change = TICKS_TO_CHANGE
 
-    def move_cars(self):
-        pass
-
-    def pick_drop_passengers(self):
-        pass
-
     def get_active_direction(self):
         return self.directions_to_stop[self.active_light]
 
 
 class TrafficLight(Agent):
+    stages = []
+
     def __init__(self, unique_id: int, model: Model, x, y, direction):
         super().__init__(unique_id, model)
         self.pos = (x, y)
@@ -480,79 +422,21 @@ class TrafficLight(Agent):
         elif self.status == LightStatus.RED.value:
             self.status = LightStatus.GREEN.value
 
-    def notify_passenger(self):
-        """Turn not implemented for this agent"""
-        pass
-
-    def confirm_car(self):
-        """Turn not implemented for this agent"""
-        pass
-
-    def tick_traffic_lights(self):
-        """Turn not implemented for this agent"""
-        pass
-
-    def move_cars(self):
-        """Turn not implemented for this agent"""
-        pass
-
-    def pick_drop_passengers(self):
-        """Turn not implemented for this agent"""
-        pass
-
 
 class Road(Agent):
+    stages = []
+
     def __init__(self, unique_id: int, model: Model, x, y, direction):
         super().__init__(unique_id, model)
         self.pos = (x, y)
         self.direction = direction
         self.model.grid.place_agent(self, self.pos)
-        self.text = ""
-
-    def notify_passenger(self):
-        """Turn not implemented for this agent"""
-        pass
-
-    def confirm_car(self):
-        """Turn not implemented for this agent"""
-        pass
-
-    def tick_traffic_lights(self):
-        """Turn not implemented for this agent"""
-        pass
-
-    def move_cars(self):
-        """Turn not implemented for this agent"""
-        pass
-
-    def pick_drop_passengers(self):
-        """Turn not implemented for this agent"""
-        pass
 
 
 class Sidewalk(Agent):
+    stages = []
+
     def __init__(self, unique_id: int, model: Model, x, y):
         super().__init__(unique_id, model)
         self.pos = (x, y)
         self.model.grid.place_agent(self, self.pos)
-        self.text = ""
-
-    def notify_passenger(self):
-        """Turn not implemented for this agent"""
-        pass
-
-    def confirm_car(self):
-        """Turn not implemented for this agent"""
-        pass
-
-    def tick_traffic_lights(self):
-        """Turn not implemented for this agent"""
-        pass
-
-    def move_cars(self):
-        """Turn not implemented for this agent"""
-        pass
-
-    def pick_drop_passengers(self):
-        """Turn not implemented for this agent"""
-        pass
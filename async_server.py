@@ -0,0 +1,279 @@
+"""
+Asynchronous variant of the Flask server (see server), with the same routes and configuration,
+built on Tornado. In server.py a request that steps the model holds the session while the tick
+runs, so every request of the session waits for it, even the cheap reads like /traffic_lights.
+Here the model of each session lives in a ModelWorker, with a thread of its own that is the only
+one that touches the model, and the event loop never waits for it:
+
+- /prueba1 to /prueba3, /new_cars, /directions, /tick and POST /snapshot submit their work to the
+  worker of the session and await the result, so they still run one after another.
+- /traffic_lights and /passengers return the State that the worker published after its last
+  operation, an immutable object with the responses already serialized, so they answer in
+  milliseconds however long the tick in progress takes. They may return the state of the tick
+  before the one being computed, which is what the client has drawn anyway.
+
+Streaming is not available in this variant, since /tick already keeps the client close to the
+model. Run it with python async_server.py.
+"""
+import asyncio
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Optional
+
+import tornado.web
+
+from delta import FrameHistory
+from profiling import to_prometheus
+from scenarios import (
+    DEFAULT_SESSION,
+    MAX_SESSIONS,
+    SESSION_ID,
+    SESSION_TTL,
+    close_model,
+    create_model,
+    port,
+    snapshot_path,
+    start_session,
+    step_model,
+)
+from sessions import PoolFullError, Session, SessionPool
+from snapshot import save_snapshot
+
+
+class State:
+    __slots__ = ("traffic_lights", "passengers")
+
+    def __init__(self, model):
+        """
+        Responses of the read routes for the current tick of a model. Published by the worker
+        and never modified, so the event loop can read it while the model advances.
+        """
+        self.traffic_lights = json.dumps(model.get_traffic_lights_data())
+        self.passengers = json.dumps(model.get_passenger_data())
+
+
+class ModelWorker:
+    def __init__(self, session_id: str):
+        """
+        Thread that owns the model of a session. The model is created on the thread, so a new
+        session does not block the event loop either.
+        :param session_id: Id sent by the client
+        """
+        self.session = Session(session_id, close_model)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"model-{session_id}")
+        self.state: Optional[State] = None
+        self.ready = self.executor.submit(self.reset, partial(start_session, session_id))
+
+    async def run(self, function: Callable, *args):
+        """Run an operation on the thread of the worker, after the ones already submitted"""
+        return await asyncio.wrap_future(self.executor.submit(function, *args))
+
+    async def read(self) -> State:
+        """Latest state published, without waiting for the operation in progress"""
+        if self.state is None:
+            await asyncio.wrap_future(self.ready)
+        return self.state
+
+    def reset(self, factory: Callable):
+        self.session.reset(factory())
+        self.publish()
+
+    def publish(self):
+        self.state = State(self.session.model)
+
+    def close(self):
+        """
+        Cancel the operations submitted to the worker, and close its model once the operation in
+        progress finishes, without waiting for it
+        """
+        threading.Thread(target=self.shutdown, name=f"close-{self.session.id}").start()
+
+    def shutdown(self):
+        self.executor.shutdown(cancel_futures=True)
+        self.session.close()
+
+    # Operations, called on the thread of the worker
+
+    def restart(self, scenario: str):
+        self.reset(partial(create_model, scenario))
+
+    def new_cars(self) -> str:
+        model = self.session.model
+        model.instantiate_agents()
+        cars_data = model.get_new_car_data()
+        self.publish()
+        return json.dumps(cars_data)
+
+    def directions(self) -> str:
+        step_model(self.session)
+        self.publish()
+        return json.dumps(self.session.model.get_cars_data())
+
+    def tick(self, acknowledged: Optional[int], binary: bool):
+        model = self.session.model
+        step_model(self.session)
+        # The new cars are sent in the delta, so they are not kept for /new_cars
+        model.get_new_car_data()
+        frames = self.session.state.setdefault("frames", FrameHistory())
+        frames.add(model.get_frame())
+        delta = frames.delta(acknowledged)
+        self.publish()
+        if binary:
+            return delta.to_bytes()
+        return json.dumps(delta.to_dict(), separators=(",", ":"))
+
+    def snapshot(self, path: str) -> str:
+        save_snapshot(self.session.model, path)
+        return f"Saved tick {self.session.model.schedule.steps} in {path}"
+
+    def metrics(self) -> str:
+        profile = self.session.model.get_profile()
+        if profile is None:
+            return "# Profiling is disabled, set CARPOOL_PROFILE=1 to enable it\n"
+        return to_prometheus(profile, self.session.model.route_cache)
+
+
+pool = SessionPool(
+    ModelWorker, max_sessions=MAX_SESSIONS, idle_seconds=SESSION_TTL, close=ModelWorker.close
+)
+
+
+class SessionHandler(tornado.web.RequestHandler):
+    def session_id(self) -> str:
+        """Id of the session of the current request"""
+        session = self.get_query_argument("session", None) or self.request.headers.get(
+            "X-Session-Id", DEFAULT_SESSION
+        )
+        if not SESSION_ID.fullmatch(session):
+            message = "The session id must have 1 to 64 letters, digits, dashes or underscores"
+            self.send_message(message, 400)
+            raise tornado.web.Finish()
+        return session
+
+    def worker(self) -> ModelWorker:
+        """
+        Worker of the session of the current request. The session is only held to look up the
+        worker, which is created without waiting for its model.
+        """
+        try:
+            with pool.use(self.session_id()) as session:
+                return session.model
+        except PoolFullError as error:
+            self.send_message(str(error), 503)
+            raise tornado.web.Finish()
+
+    def send_json(self, text: str):
+        self.set_header("Content-Type", "application/json")
+        self.finish(text)
+
+    def send_message(self, message: str, status: int = 200):
+        self.set_status(status)
+        self.send_json(json.dumps([{"message": message}]))
+
+
+class ScenarioHandler(SessionHandler):
+    def initialize(self, scenario: str, message: str):
+        self.scenario = scenario
+        self.message = message
+
+    async def get(self):
+        worker = self.worker()
+        await worker.run(worker.restart, self.scenario)
+        self.send_message(self.message)
+
+
+class NewCarsHandler(SessionHandler):
+    async def get(self):
+        worker = self.worker()
+        self.send_json(await worker.run(worker.new_cars))
+
+
+class TrafficLightsHandler(SessionHandler):
+    async def get(self):
+        state = await self.worker().read()
+        self.send_json(state.traffic_lights)
+
+
+class DirectionsHandler(SessionHandler):
+    async def get(self):
+        worker = self.worker()
+        self.send_json(await worker.run(worker.directions))
+
+
+class TickHandler(SessionHandler):
+    async def get(self):
+        acknowledged = self.get_query_argument("ack", None)
+        try:
+            acknowledged = int(acknowledged) if acknowledged is not None else None
+        except ValueError:
+            acknowledged = None
+        binary = self.get_query_argument("format", None) == "binary"
+
+        worker = self.worker()
+        data = await worker.run(worker.tick, acknowledged, binary)
+        if binary:
+            self.set_header("Content-Type", "application/octet-stream")
+            self.finish(data)
+        else:
+            self.send_json(data)
+
+
+class PassengersHandler(SessionHandler):
+    async def get(self):
+        state = await self.worker().read()
+        self.send_json(state.passengers)
+
+
+class SnapshotHandler(SessionHandler):
+    async def post(self):
+        worker = self.worker()
+        path = snapshot_path(worker.session.id)
+        if not path:
+            self.send_message("Snapshots require CARPOOL_SNAPSHOT and the mesa engine", 400)
+            return
+        self.send_message(await worker.run(worker.snapshot, path))
+
+
+class SessionCloseHandler(SessionHandler):
+    def delete(self):
+        if not pool.remove(self.session_id()):
+            self.send_message("Unknown session", 404)
+            return
+        self.send_message("Session closed")
+
+
+class MetricsHandler(SessionHandler):
+    async def get(self):
+        worker = self.worker()
+        text = await worker.run(worker.metrics)
+        self.set_header("Content-Type", "text/plain; version=0.0.4")
+        self.finish(text)
+
+
+def make_app() -> tornado.web.Application:
+    return tornado.web.Application(
+        [
+            (r"/prueba1", ScenarioHandler, dict(scenario="prueba1", message="Prueba 1")),
+            (r"/prueba2", ScenarioHandler, dict(scenario="prueba2", message="Prueba 2")),
+            (r"/prueba3", ScenarioHandler, dict(scenario="prueba3", message="Prueba 3")),
+            (r"/new_cars", NewCarsHandler),
+            (r"/traffic_lights", TrafficLightsHandler),
+            (r"/directions", DirectionsHandler),
+            (r"/tick", TickHandler),
+            (r"/passengers", PassengersHandler),
+            (r"/snapshot", SnapshotHandler),
+            (r"/session", SessionCloseHandler),
+            (r"/metrics", MetricsHandler),
+        ]
+    )
+
+
+async def main():
+    make_app().listen(port)
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
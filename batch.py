@@ -0,0 +1,286 @@
+"""
+Headless batch runner. Runs CarpoolModel without visualization until every car and passenger
+reaches their destination, for every combination of the swept parameters and seeds, across a
+process pool. The result of each run is streamed to a CSV file, or to a directory of Parquet
+files, and a sweep that was interrupted is resumed by skipping the runs already in the output.
+With --checkpoint-every, each run also saves a snapshot of its model periodically, so a long run
+that was interrupted continues from its last checkpoint instead of from the first tick. A run
+that raises an exception is stored with the error status and message, so the rest of the sweep
+completes, and it is not run again when the sweep is resumed.
+
+Example, from the root of the repo:
+python batch.py --passenger-limit 0 50 100 --car-limit 100 50 20 --seeds 10 --output runs.csv
+"""
+import argparse
+import csv
+import itertools
+import os
+import time
+from multiprocessing import Pool
+from statistics import mean
+
+from dispatch import DISPATCHERS, HANDSHAKE
+from environment import ENVIRONMENT
+from model import CarpoolModel
+from routing import ROUTERS, SHORTEST
+from snapshot import load_snapshot, save_snapshot
+
+PARAMETERS = [
+    "passenger_limit",
+    "passenger_inst_limit",
+    "passenger_delay",
+    "car_limit",
+    "car_inst_limit",
+    "car_delay",
+    "dispatcher",
+    "router",
+    "seed",
+]
+RESULTS = [
+    "status",
+    "error",
+    "finished",
+    "ticks",
+    "movements",
+    "passengers_arrived",
+    "mean_wait",
+    "max_wait",
+    "mean_trip",
+    "seconds",
+]
+COLUMNS = PARAMETERS + RESULTS
+OK = "ok"
+ERROR = "error"
+PARQUET_ROWS = 100
+
+
+def run_simulation(run: dict) -> dict:
+    """
+    Run a single simulation until it finishes or reaches its tick limit. A run that raises an
+    exception is reported with the error status instead of stopping the sweep, and its checkpoint
+    is kept to reproduce the error.
+    :param run: Dictionary with the PARAMETERS of the model, max_ticks, and checkpoint_every
+    and checkpoint_dir
+    :return: Dictionary with the PARAMETERS and the RESULTS of the run
+    """
+    start = time.perf_counter()
+    result = {name: run[name] for name in PARAMETERS}
+    try:
+        result.update(simulate(run), status=OK)
+    except Exception as error:
+        result.update(status=ERROR, error=f"{type(error).__name__}: {error}")
+    result["seconds"] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def simulate(run: dict) -> dict:
+    """
+    Step the model of a run, from its checkpoint if there is one.
+    :return: Dictionary with the RESULTS of the model
+    """
+    checkpoint = checkpoint_path(run)
+    if checkpoint and os.path.exists(checkpoint):
+        model = load_snapshot(checkpoint)
+    else:
+        model = CarpoolModel(environment=ENVIRONMENT, **{name: run[name] for name in PARAMETERS})
+    while model.running and model.schedule.steps < run["max_ticks"]:
+        model.step()
+        if checkpoint and model.schedule.steps % run["checkpoint_every"] == 0:
+            save_snapshot(model, checkpoint)
+
+    arrived = [passenger for passenger in model.passengers if passenger.has_arrived]
+    waits = [passenger.wait_ticks for passenger in arrived]
+    trips = [passenger.wait_ticks + passenger.ride_ticks for passenger in arrived]
+    if checkpoint and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    return dict(
+        finished=not model.running,
+        ticks=model.schedule.steps,
+        movements=model.stats.movements,
+        passengers_arrived=len(arrived),
+        mean_wait=mean(waits) if waits else None,
+        max_wait=max(waits) if waits else None,
+        mean_trip=mean(trips) if trips else None,
+    )
+
+
+def checkpoint_path(run: dict) -> str:
+    """Path of the checkpoint file of a run, or None if checkpoints are disabled"""
+    if not run["checkpoint_every"]:
+        return None
+
+    return os.path.join(run["checkpoint_dir"], "-".join(run_key(run)) + ".npz")
+
+
+def build_sweep(args: argparse.Namespace) -> list:
+    """
+    Build the list of runs of the sweep: the cartesian product of all the parameter values and
+    the seeds.
+    :param args: Parsed command line arguments
+    :return: List of dictionaries with the PARAMETERS of each run, max_ticks, and the
+    checkpoint options
+    """
+    values = [getattr(args, name) for name in PARAMETERS if name != "seed"]
+    seeds = args.seed if args.seed else range(args.seeds)
+    return [
+        dict(
+            zip(PARAMETERS, combination),
+            max_ticks=args.max_ticks,
+            checkpoint_every=args.checkpoint_every,
+            checkpoint_dir=args.checkpoint_dir,
+        )
+        for combination in itertools.product(*values, seeds)
+    ]
+
+
+def run_key(run: dict) -> tuple:
+    """Identify a run by its parameters, as strings so that they compare with the stored rows"""
+    return tuple(str(run[name]) for name in PARAMETERS)
+
+
+class CsvOutput:
+    def __init__(self, path: str):
+        """
+        Output that appends a row to a CSV file as soon as each run finishes.
+        :param path: Path of the CSV file. It is created with a header if it does not exist.
+        """
+        self.path = path
+
+    def completed(self) -> set:
+        """Keys of the runs already stored in the file"""
+        if not os.path.exists(self.path):
+            return set()
+
+        with open(self.path, newline="") as file:
+            return {run_key(row) for row in csv.DictReader(file)}
+
+    def __enter__(self):
+        new_file = not os.path.exists(self.path) or not os.path.getsize(self.path)
+        if not new_file:
+            with open(self.path, newline="") as file:
+                if next(csv.reader(file)) != COLUMNS:
+                    raise SystemExit(f"{self.path} has other columns, use a new output file")
+        self.file = open(self.path, "a", newline="")
+        self.writer = csv.DictWriter(self.file, fieldnames=COLUMNS)
+        if new_file:
+            self.writer.writeheader()
+        return self
+
+    def write(self, row: dict):
+        self.writer.writerow(row)
+        self.file.flush()
+
+    def __exit__(self, *exc_info):
+        self.file.close()
+
+
+class ParquetOutput:
+    def __init__(self, path: str):
+        """
+        Output that writes the rows to a directory of Parquet files, one file each PARQUET_ROWS
+        runs, so that an interrupted sweep only loses the runs that were not written yet.
+        Requires pyarrow.
+        :param path: Path of the directory
+        """
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise SystemExit("Parquet output requires pyarrow, install it with pip install pyarrow")
+
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.path = path
+        self.rows = []
+
+    def parts(self) -> list:
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(name for name in os.listdir(self.path) if name.endswith(".parquet"))
+
+    def completed(self) -> set:
+        """Keys of the runs already stored in the directory"""
+        completed = set()
+        for part in self.parts():
+            table = self.pq.read_table(os.path.join(self.path, part), columns=PARAMETERS)
+            completed.update(run_key(row) for row in table.to_pylist())
+        return completed
+
+    def __enter__(self):
+        os.makedirs(self.path, exist_ok=True)
+        return self
+
+    def write(self, row: dict):
+        self.rows.append(row)
+        if len(self.rows) >= PARQUET_ROWS:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+
+        parts = self.parts()
+        index = int(parts[-1].split("-")[1].split(".")[0]) + 1 if parts else 0
+        table = self.pa.Table.from_pylist(self.rows)
+        self.pq.write_table(table, os.path.join(self.path, f"part-{index:05d}.parquet"))
+        self.rows = []
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--passenger-limit", type=int, nargs="+", default=[20])
+    parser.add_argument("--passenger-inst-limit", type=int, nargs="+", default=[1])
+    parser.add_argument("--passenger-delay", type=int, nargs="+", default=[1])
+    parser.add_argument("--car-limit", type=int, nargs="+", default=[10])
+    parser.add_argument("--car-inst-limit", type=int, nargs="+", default=[1])
+    parser.add_argument("--car-delay", type=int, nargs="+", default=[1])
+    parser.add_argument("--dispatcher", nargs="+", choices=DISPATCHERS, default=[HANDSHAKE])
+    parser.add_argument("--router", nargs="+", choices=ROUTERS, default=[SHORTEST])
+    parser.add_argument("--seeds", type=int, default=1, help="Run the seeds 0 to SEEDS - 1")
+    parser.add_argument("--seed", type=int, nargs="+", help="Run these seeds instead")
+    parser.add_argument(
+        "--max-ticks",
+        type=int,
+        default=5000,
+        help="Stop a run that has not finished after this many ticks",
+    )
+    parser.add_argument(
+        "--checkpoint-every",
+        type=int,
+        default=0,
+        help="Save a snapshot of each run every this many ticks, and resume the runs from them",
+    )
+    parser.add_argument("--checkpoint-dir", default="checkpoints")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument(
+        "--output",
+        default="runs.csv",
+        help="CSV file, or directory of Parquet files if it ends in .parquet",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.output.endswith(".parquet"):
+        output = ParquetOutput(args.output)
+    else:
+        output = CsvOutput(args.output)
+    completed = output.completed()
+    if args.checkpoint_every:
+        os.makedirs(args.checkpoint_dir, exist_ok=True)
+    runs = [run for run in build_sweep(args) if run_key(run) not in completed]
+    print(f"{len(completed)} runs already completed, {len(runs)} left")
+
+    # Every run is sent to the pool on its own, so the workers stay busy until the end of the sweep
+    with output, Pool(args.workers) as pool:
+        for done, row in enumerate(pool.imap_unordered(run_simulation, runs), 1):
+            output.write(row)
+            print(f"[{done}/{len(runs)}] {row}")
+
+
+if __name__ == "__main__":
+    main()
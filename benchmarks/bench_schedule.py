@@ -0,0 +1,50 @@
+"""
+Benchmark of the tick loop of CarpoolModel. Measures the ticks per second on the bundled
+ENVIRONMENT and on larger maps that repeat its street pattern. Run it from the root of the repo
+with python -m benchmarks.bench_schedule
+"""
+import time
+
+from mapgen import generate_city
+from model import CarpoolModel
+
+MAP_SIZES = [26, 56, 106]
+TICKS = 200
+
+
+def tile_environment(size: int) -> list:
+    """
+    Build a size x size map that repeats the 10 x 10 street pattern of ENVIRONMENT. The size must
+    end in 6, so that the outer streets go around the map and the road network stays connected.
+    :param size: Number of rows and columns
+    :return: Matrix of cells, like ENVIRONMENT
+    """
+    blocks = (size - 1) // 5
+    return generate_city(blocks, blocks)
+
+
+def ticks_per_second(environment: list, ticks: int = TICKS) -> float:
+    """
+    Run a model with agents proportional to the size of the map, and measure its speed.
+    :return: Ticks per second
+    """
+    n_cells = len(environment) * len(environment[0])
+    model = CarpoolModel(
+        environment=environment,
+        passenger_limit=n_cells // 10,
+        passenger_inst_limit=n_cells // 100,
+        passenger_delay=1,
+        car_limit=n_cells // 50,
+        car_inst_limit=n_cells // 500 + 1,
+        car_delay=2,
+    )
+    model.random.seed(0)
+    start = time.perf_counter()
+    for _ in range(ticks):
+        model.step()
+    return ticks / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    for size in MAP_SIZES:
+        print(f"{size}x{size}: {ticks_per_second(tile_environment(size)):.1f} ticks/s")
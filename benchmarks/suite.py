@@ -0,0 +1,275 @@
+"""
+Reproducible benchmark suite of CarpoolModel. For each scenario it measures the whole tick
+(ticks per second and the p50/p99 latency of model.step), the time spent in each section of the
+tick, the serializers used by the Flask server, and the routing routines of the cars on the same
+map. Every scenario runs with a fixed seed in a fresh process, so its peak RSS is its own. Run it
+from the root of the repo:
+
+python -m benchmarks.suite --output results.json
+python -m benchmarks.suite --compare before.json after.json
+"""
+import argparse
+import json
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+from multiprocessing import get_context
+
+from benchmarks.bench_schedule import tile_environment
+from environment import ENVIRONMENT
+from citymap import CityMap
+from model import CarpoolModel
+from routing import (
+    NearestTargets,
+    RoadGraph,
+    build_routing_table,
+    lookup_routes,
+    search_routes,
+)
+
+SEED = 0
+ROUTE_QUERIES = 200
+
+# The /prueba1 to /prueba3 configurations of the Flask server, and maps tiled from ENVIRONMENT
+SCENARIOS = {
+    "prueba1": dict(
+        size=None,
+        ticks=200,
+        passenger_limit=0,
+        passenger_inst_limit=0,
+        passenger_delay=1,
+        car_limit=100,
+        car_inst_limit=25,
+        car_delay=2,
+    ),
+    "prueba2": dict(
+        size=None,
+        ticks=200,
+        passenger_limit=10,
+        passenger_inst_limit=10,
+        passenger_delay=1,
+        car_limit=5,
+        car_inst_limit=5,
+        car_delay=2,
+    ),
+    "prueba3": dict(
+        size=None,
+        ticks=200,
+        passenger_limit=85,
+        passenger_inst_limit=86,
+        passenger_delay=1,
+        car_limit=15,
+        car_inst_limit=16,
+        car_delay=2,
+    ),
+    "map_106": dict(
+        size=106,
+        ticks=100,
+        passenger_limit=1000,
+        passenger_inst_limit=100,
+        passenger_delay=1,
+        car_limit=200,
+        car_inst_limit=20,
+        car_delay=2,
+    ),
+    "map_506": dict(
+        size=506,
+        ticks=10,
+        passenger_limit=5000,
+        passenger_inst_limit=500,
+        passenger_delay=1,
+        car_limit=1000,
+        car_inst_limit=100,
+        car_delay=2,
+    ),
+}
+SERIALIZERS = [
+    "get_cars_data",
+    "get_traffic_lights_data",
+    "get_new_car_data",
+    "get_passenger_data",
+]
+
+
+def percentiles(samples: list) -> dict:
+    """
+    Summarize a list of durations.
+    :param samples: Durations in seconds
+    :return: Dictionary with the p50, p99 and mean in milliseconds
+    """
+    samples = sorted(samples)
+    if not samples:
+        return {"p50_ms": None, "p99_ms": None, "mean_ms": None}
+
+    return {
+        "p50_ms": samples[len(samples) // 2] * 1000,
+        "p99_ms": samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000,
+        "mean_ms": sum(samples) / len(samples) * 1000,
+    }
+
+
+def benchmark_ticks(environment: list, ticks: int, params: dict) -> dict:
+    """
+    Run the model for a number of ticks, timing each step and the serializers. The time of
+    each section of the tick and the searches of the cars come from the profiler of the model.
+    :return: Dictionary with the results
+    """
+    start = time.perf_counter()
+    model = CarpoolModel(environment=environment, profile=True, **params)
+    init_seconds = time.perf_counter() - start
+    model.random.seed(SEED)
+
+    step_samples = []
+    serializer_samples = {name: [] for name in SERIALIZERS}
+    for _ in range(ticks):
+        start = time.perf_counter()
+        model.step()
+        step_samples.append(time.perf_counter() - start)
+
+        for name in SERIALIZERS:
+            start = time.perf_counter()
+            json.dumps(getattr(model, name)())
+            serializer_samples[name].append(time.perf_counter() - start)
+
+    step_seconds = sum(step_samples)
+    profile = model.get_profile()
+    return {
+        "init_seconds": init_seconds,
+        "ticks_per_second": ticks / step_seconds,
+        "step": percentiles(step_samples),
+        "sections_ms_per_tick": {
+            section: data["seconds"] / ticks * 1000 for section, data in profile["sections"].items()
+        },
+        "searches": profile["searches"],
+        "serializers": {name: percentiles(samples) for name, samples in serializer_samples.items()},
+    }
+
+
+def benchmark_routing(environment: list) -> dict:
+    """
+    Time the routines used by the cars to find their routes, between random road cells and
+    sidewalks of the map: the BFS, the routing table lookup (if the map is small enough to build
+    the table), and the reverse BFS that labels the cells with their nearest passenger.
+    :return: Dictionary with the results
+    """
+    rng = random.Random(SEED)
+    city = CityMap.from_environment(environment)
+    graph = RoadGraph(city)
+    sources = rng.sample(city.road_cells(), ROUTE_QUERIES)
+    points = rng.sample(city.sidewalk_cells(), ROUTE_QUERIES)
+
+    search_samples = []
+    for source, point in zip(sources, points):
+        start = time.perf_counter()
+        search_routes(graph, source, [point], [0])
+        search_samples.append(time.perf_counter() - start)
+    results = {"search_routes": percentiles(search_samples)}
+
+    start = time.perf_counter()
+    table = build_routing_table(graph)
+    if table:
+        results["routing_table_seconds"] = time.perf_counter() - start
+        lookup_samples = []
+        for source, point in zip(sources, points):
+            start = time.perf_counter()
+            lookup_routes(graph, table, source, [point], [0])
+            lookup_samples.append(time.perf_counter() - start)
+        results["lookup_routes"] = percentiles(lookup_samples)
+
+    targets = [graph.adjacent_cells(point) for point in points]
+    start = time.perf_counter()
+    NearestTargets(graph, targets)
+    results["nearest_targets_ms"] = (time.perf_counter() - start) * 1000
+    return results
+
+
+def run_scenario(name: str) -> dict:
+    """
+    Run all the benchmarks of a scenario. It is meant to run in its own process, so the peak
+    RSS is not affected by the other scenarios.
+    :return: Dictionary with the results
+    """
+    params = dict(SCENARIOS[name])
+    size = params.pop("size")
+    ticks = params.pop("ticks")
+    environment = tile_environment(size) if size else ENVIRONMENT
+    results = {
+        "map": f"{len(environment[0])}x{len(environment)}",
+        "ticks": ticks,
+        **benchmark_ticks(environment, ticks, params),
+        "routing": benchmark_routing(environment),
+    }
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results["peak_rss_mb"] = max_rss / (2 ** 20 if sys.platform == "darwin" else 2 ** 10)
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(names: list) -> dict:
+    """
+    Run the specified scenarios, each one in a new process.
+    :return: Dictionary with the metadata of the run and the results of each scenario
+    """
+    results = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": SEED,
+        "scenarios": {},
+    }
+    context = get_context("spawn")
+    for name in names:
+        with context.Pool(1) as pool:
+            results["scenarios"][name] = pool.apply(run_scenario, (name,))
+        scenario = results["scenarios"][name]
+        print(
+            f"{name}: {scenario['ticks_per_second']:.1f} ticks/s, "
+            f"p99 {scenario['step']['p99_ms']:.2f} ms, {scenario['peak_rss_mb']:.0f} MB"
+        )
+    return results
+
+
+def compare(before: dict, after: dict):
+    """Print the change of the main metrics of each scenario between two result files"""
+    for name, new in after["scenarios"].items():
+        old = before["scenarios"].get(name)
+        if not old:
+            continue
+
+        speedup = new["ticks_per_second"] / old["ticks_per_second"]
+        print(
+            f"{name}: {old['ticks_per_second']:.1f} -> {new['ticks_per_second']:.1f} ticks/s "
+            f"(x{speedup:.2f}), p99 {old['step']['p99_ms']:.2f} -> {new['step']['p99_ms']:.2f} ms, "
+            f"peak RSS {old['peak_rss_mb']:.0f} -> {new['peak_rss_mb']:.0f} MB"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark suite of CarpoolModel")
+    parser.add_argument("--output", default="benchmark.json", help="JSON file for the results")
+    parser.add_argument(
+        "--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS)
+    )
+    parser.add_argument(
+        "--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="Compare two result files"
+    )
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as before, open(args.compare[1]) as after:
+            compare(json.load(before), json.load(after))
+    else:
+        with open(args.output, "w") as file:
+            json.dump(run_suite(args.scenarios), file, indent=2)
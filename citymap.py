@@ -0,0 +1,160 @@
+"""
+Compact representation of the city map. The cells are stored as a matrix of one byte codes (see
+mapgen.CELL_TYPES), and the roads, sidewalks and intersections are extracted from it with
+vectorized operations into typed arrays, instead of walking a list of lists of strings. Maps can
+be saved in a binary file, a small header followed by the codes, and loaded with mmap, so big
+maps are neither parsed nor copied into memory as Python objects.
+"""
+import struct
+
+import numpy as np
+
+from enums import RawDirections
+from mapgen import CELL_CODES, CELL_TYPES, to_compact
+from routing import DIRECTION_NAMES
+
+MAGIC = b"CARPOOL\x00"
+VERSION = 1
+# Magic, version, number of rows and number of columns, followed by the rows of cell codes
+HEADER = struct.Struct("<8sIII")
+
+SORTED_DIRECTIONS = sorted(DIRECTION_NAMES)
+# Index in DIRECTION_NAMES of the direction of each cell code, -1 for the other cells
+CODE_DIRECTIONS = np.array(
+    [DIRECTION_NAMES.index(cell) if cell in DIRECTION_NAMES else -1 for cell in CELL_TYPES],
+    dtype=np.int8,
+)
+# Bit of each cell code in the direction masks of the intersections, 0 for the other cells
+CODE_BITS = np.array(
+    [1 << SORTED_DIRECTIONS.index(cell) if cell in DIRECTION_NAMES else 0 for cell in CELL_TYPES],
+    dtype=np.uint8,
+)
+# Sorted direction names of each mask
+MASK_DIRECTIONS = [
+    [direction for bit, direction in enumerate(SORTED_DIRECTIONS) if mask & (1 << bit)]
+    for mask in range(1 << len(SORTED_DIRECTIONS))
+]
+
+
+class CityMap:
+    def __init__(self, cells: np.ndarray):
+        """
+        Extract the roads, sidewalks and intersections of a map, each one in the order of the rows
+        of the map from the top, like the environment matrices. Positions use the coordinates of
+        the grid, with y = 0 at the bottom row.
+        :param cells: Array of shape (number of rows, number of columns) with the cell codes
+        """
+        self.cells = cells
+        self.height, self.width = cells.shape
+
+        rows, cols = np.nonzero(cells >= CELL_CODES["UP"])
+        self.road_xs, self.road_ys = cols, self.height - 1 - rows
+        self.road_directions = CODE_DIRECTIONS[cells[rows, cols]]
+
+        rows, cols = np.nonzero(cells == CELL_CODES["SW"])
+        self.sidewalk_xs, self.sidewalk_ys = cols, self.height - 1 - rows
+
+        rows, cols = np.nonzero(cells == CELL_CODES["IN"])
+        self.intersection_xs, self.intersection_ys = cols, self.height - 1 - rows
+        self.go_masks, self.stop_masks = self.intersection_masks(rows, cols)
+
+    @classmethod
+    def from_environment(cls, environment) -> "CityMap":
+        """
+        Build the map of an environment, which may already be a CityMap.
+        :param environment: Matrix of cells like ENVIRONMENT, or array of cell codes
+        """
+        if isinstance(environment, CityMap):
+            return environment
+
+        if isinstance(environment, np.ndarray):
+            return cls(environment)
+
+        return cls(to_compact(environment))
+
+    def intersection_masks(self, rows: np.ndarray, cols: np.ndarray) -> (np.ndarray, np.ndarray):
+        """
+        Find the directions involved in each intersection. Given that the streets are one way
+        only, a car can leave the intersection through the roads next to it that go away from it
+        (the directions to go), and must stop at the traffic light of the roads that arrive to
+        it (the directions to stop).
+        :param rows: Row of each intersection
+        :param cols: Column of each intersection
+        :return: Bit masks of the directions to go and of the directions to stop, with one bit
+        per direction of SORTED_DIRECTIONS
+        """
+        padded = np.pad(self.cells, 1)
+        go_masks = np.zeros(len(rows), dtype=np.uint8)
+        stop_masks = np.zeros(len(rows), dtype=np.uint8)
+        for direction in RawDirections:
+            displacement = direction.value
+            neighbors = padded[rows + 1 + displacement[0], cols + 1 + displacement[1]]
+            goes_away = neighbors == CELL_CODES[direction.name]
+            go_masks[goes_away] |= CODE_BITS[CELL_CODES[direction.name]]
+            stop_masks[~goes_away] |= CODE_BITS[neighbors[~goes_away]]
+
+        return go_masks, stop_masks
+
+    def road_cells(self) -> list:
+        """List of the (x, y) positions of the roads"""
+        return list(zip(self.road_xs.tolist(), self.road_ys.tolist()))
+
+    def sidewalk_cells(self) -> list:
+        """List of the (x, y) positions of the sidewalks"""
+        return list(zip(self.sidewalk_xs.tolist(), self.sidewalk_ys.tolist()))
+
+    def intersection_data(self) -> list:
+        """
+        Obtain the data to initialize each Intersection agent.
+        :return: List of dictionaries with the position, and the sorted lists of directions to go
+        and directions to stop
+        """
+        return [
+            {
+                "x": x,
+                "y": y,
+                "directions_to_go": MASK_DIRECTIONS[go_mask],
+                "directions_to_stop": MASK_DIRECTIONS[stop_mask],
+            }
+            for x, y, go_mask, stop_mask in zip(
+                self.intersection_xs.tolist(),
+                self.intersection_ys.tolist(),
+                self.go_masks.tolist(),
+                self.stop_masks.tolist(),
+            )
+        ]
+
+
+def save_map(path: str, environment):
+    """
+    Write a map in the binary format.
+    :param path: Path of the file
+    :param environment: Matrix of cells like ENVIRONMENT, or array of cell codes
+    """
+    cells = CityMap.from_environment(environment).cells
+    with open(path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, *cells.shape))
+        file.write(np.ascontiguousarray(cells, dtype=np.uint8).tobytes())
+
+
+def load_cells(path: str) -> np.ndarray:
+    """
+    Map the cell codes of a binary map file into memory, without reading the whole file.
+    :param path: Path of the file
+    :return: Read only array of shape (number of rows, number of columns)
+    """
+    with open(path, "rb") as file:
+        magic, version, n_rows, n_cols = HEADER.unpack(file.read(HEADER.size))
+
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a map file")
+
+    if version != VERSION:
+        raise ValueError(f"Unsupported map version {version} in {path}, expected {VERSION}")
+
+    return np.memmap(path, dtype=np.uint8, mode="r", offset=HEADER.size, shape=(n_rows, n_cols))
+
+
+def load_map(path: str) -> CityMap:
+    """Load a binary map file"""
+    return CityMap(load_cells(path))
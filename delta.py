@@ -0,0 +1,215 @@
+"""
+State of the simulation sent by the /tick endpoint of the Flask server. After every tick the model
+captures a Frame with the cars, traffic lights and passengers as arrays, and the client receives a
+Delta with only what changed since the last tick it acknowledged: the new and moved cars, the
+removed cars, the traffic lights that changed and the passengers whose position or state
+changed. The position of the traveling passengers is not sent, since they are inside a car. When
+the acknowledged tick is unknown (e.g. on the first request) the delta contains the whole state,
+with the ids of the traffic lights, which are referenced by their index in the other deltas.
+Deltas can be encoded as JSON, with a list per attribute of each kind of agent, or in a compact
+binary format:
+
+header: magic b"CPTK", version (uint8), flags (uint8, 1 for a whole state), tick (uint32),
+base tick (int32, -1 for a whole state)
+cars: count (uint32), ids (int32), x (int32), y (int32), movements (int8, index in MOVEMENT_NAMES)
+removed cars: count (uint32), ids (int32)
+traffic lights: count (uint32), indexes (uint32), status (int8)
+passengers: count (uint32), ids (int32), x (int32), y (int32), states (int8, index in
+PASSENGER_STATES)
+traffic light ids, only in a whole state: length (uint32) and UTF-8 text of the ids separated by
+newlines, in the order of the indexes
+
+All the numbers are little endian, and each array is stored after the previous one.
+"""
+import struct
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+
+from routing import DIRECTION_NAMES
+
+# Codes of the movements of the cars and of the states of the passengers, also used by engine
+NO_MOVEMENT = -1
+MOVEMENT_NAMES = DIRECTION_NAMES + ["NA", "PA"]
+NEEDS_RIDE, WAITING, TRAVELING, ARRIVED = range(4)
+PASSENGER_STATES = ["needs_ride", "waiting", "traveling", "arrived"]
+# Position of the traveling passengers in the frames
+HIDDEN = -1
+MOVEMENT_CODES = {name: code for code, name in enumerate(MOVEMENT_NAMES)}
+HISTORY_SIZE = 64
+MAGIC = b"CPTK"
+VERSION = 1
+HEADER = struct.Struct("<4sBBIi")
+COUNT = struct.Struct("<I")
+FULL = 1
+
+
+def movement_code(movement: Optional[str]) -> int:
+    """Encode a movement like Car.real_movement, which is None before the first movement"""
+    return MOVEMENT_CODES.get(movement, NO_MOVEMENT)
+
+
+class Frame:
+    def __init__(
+        self,
+        tick: int,
+        car_ids: np.ndarray,
+        cars: np.ndarray,
+        light_ids: List[str],
+        light_status: np.ndarray,
+        passenger_ids: np.ndarray,
+        passengers: np.ndarray,
+    ):
+        """
+        State of the simulation after a tick.
+        :param tick: Number of ticks executed
+        :param car_ids: Sorted ids of the cars
+        :param cars: Array of shape (number of cars, 3) with the x, y and movement code of each car
+        :param light_ids: Ids of the traffic lights, like get_traffic_lights_data
+        :param light_status: Status of each traffic light
+        :param passenger_ids: Sorted ids of the passengers
+        :param passengers: Array of shape (number of passengers, 3) with the x, y (HIDDEN while
+        traveling) and the index in PASSENGER_STATES of the state of each passenger
+        """
+        self.tick = tick
+        self.car_ids = car_ids
+        self.cars = cars
+        self.light_ids = light_ids
+        self.light_status = light_status
+        self.passenger_ids = passenger_ids
+        self.passengers = passengers
+
+
+def changed_rows(
+    old_ids: np.ndarray, old_values: np.ndarray, new_ids: np.ndarray, new_values: np.ndarray
+) -> np.ndarray:
+    """
+    Compare two versions of a table of agents.
+    :return: Rows of the new table whose id is not in the old one or whose values changed
+    """
+    slots = np.searchsorted(old_ids, new_ids)
+    found = slots < len(old_ids)
+    found[found] = old_ids[slots[found]] == new_ids[found]
+    changed = ~found
+    changed[found] = np.any(old_values[slots[found]] != new_values[found], axis=1)
+    return np.flatnonzero(changed)
+
+
+class Delta:
+    def __init__(self, old: Optional[Frame], new: Frame):
+        """
+        Find the changes between two frames.
+        :param old: Frame that the client already has, or None to send the whole state
+        :param new: Current frame
+        """
+        self.frame = new
+        self.full = old is None
+        self.base = -1 if self.full else old.tick
+        if self.full:
+            self.car_rows = np.arange(len(new.car_ids))
+            self.removed_car_ids = np.zeros(0, dtype=np.int64)
+            self.light_indexes = np.arange(len(new.light_status))
+            self.passenger_rows = np.arange(len(new.passenger_ids))
+            return
+
+        self.car_rows = changed_rows(old.car_ids, old.cars, new.car_ids, new.cars)
+        self.removed_car_ids = np.setdiff1d(old.car_ids, new.car_ids, assume_unique=True)
+        self.light_indexes = np.flatnonzero(old.light_status != new.light_status)
+        self.passenger_rows = changed_rows(
+            old.passenger_ids, old.passengers, new.passenger_ids, new.passengers
+        )
+
+    def to_dict(self) -> dict:
+        """
+        Encode the delta as a dictionary that can be serialized to JSON. The x and z coordinates
+        are the x and y of the grid, like in the other endpoints of the server.
+        """
+        frame = self.frame
+        cars = frame.cars[self.car_rows]
+        passengers = frame.passengers[self.passenger_rows]
+        data = {
+            "tick": frame.tick,
+            "base": None if self.full else self.base,
+            "full": self.full,
+            "cars": {
+                "id": frame.car_ids[self.car_rows].tolist(),
+                "x": cars[:, 0].tolist(),
+                "z": cars[:, 1].tolist(),
+                "direction": [
+                    None if movement == NO_MOVEMENT else MOVEMENT_NAMES[movement]
+                    for movement in cars[:, 2].tolist()
+                ],
+            },
+            "removed_cars": self.removed_car_ids.tolist(),
+            "traffic_lights": {
+                "index": self.light_indexes.tolist(),
+                "state": frame.light_status[self.light_indexes].tolist(),
+            },
+            "passengers": {
+                "id": frame.passenger_ids[self.passenger_rows].tolist(),
+                "x": passengers[:, 0].tolist(),
+                "z": passengers[:, 1].tolist(),
+                "state": [PASSENGER_STATES[state] for state in passengers[:, 2].tolist()],
+            },
+        }
+        if self.full:
+            data["traffic_light_ids"] = frame.light_ids
+        return data
+
+    def to_bytes(self) -> bytes:
+        """Encode the delta in the binary format described in the module"""
+        frame = self.frame
+        cars = frame.cars[self.car_rows]
+        passengers = frame.passengers[self.passenger_rows]
+        parts = [
+            HEADER.pack(MAGIC, VERSION, FULL if self.full else 0, frame.tick, self.base),
+            COUNT.pack(len(self.car_rows)),
+            frame.car_ids[self.car_rows].astype("<i4").tobytes(),
+            cars[:, 0].astype("<i4").tobytes(),
+            cars[:, 1].astype("<i4").tobytes(),
+            cars[:, 2].astype("i1").tobytes(),
+            COUNT.pack(len(self.removed_car_ids)),
+            self.removed_car_ids.astype("<i4").tobytes(),
+            COUNT.pack(len(self.light_indexes)),
+            self.light_indexes.astype("<u4").tobytes(),
+            frame.light_status[self.light_indexes].astype("i1").tobytes(),
+            COUNT.pack(len(self.passenger_rows)),
+            frame.passenger_ids[self.passenger_rows].astype("<i4").tobytes(),
+            passengers[:, 0].astype("<i4").tobytes(),
+            passengers[:, 1].astype("<i4").tobytes(),
+            passengers[:, 2].astype("i1").tobytes(),
+        ]
+        if self.full:
+            light_ids = "\n".join(frame.light_ids).encode()
+            parts += [COUNT.pack(len(light_ids)), light_ids]
+        return b"".join(parts)
+
+
+class FrameHistory:
+    def __init__(self, size: int = HISTORY_SIZE):
+        """
+        Last frames of a model, to find the changes since the tick acknowledged by a client.
+        :param size: Maximum number of frames kept
+        """
+        self.size = size
+        self.frames = OrderedDict()
+
+    def add(self, frame: Frame):
+        self.frames[frame.tick] = frame
+        while len(self.frames) > self.size:
+            self.frames.popitem(last=False)
+
+    def delta(self, acknowledged: Optional[int]) -> Delta:
+        """
+        Find the changes of the last frame since the frame of a tick. The older frames are
+        discarded, since the client already has a newer state.
+        :param acknowledged: Last tick received by the client, or None if it has no state
+        :return: The delta, with the whole state if the tick is not in the history
+        """
+        base = self.frames.get(acknowledged) if acknowledged is not None else None
+        if base is not None:
+            while next(iter(self.frames)) != acknowledged:
+                self.frames.popitem(last=False)
+
+        return Delta(base, next(reversed(self.frames.values())))
@@ -0,0 +1,148 @@
+"""
+Dispatchers that assign cars to the passengers that need a ride for the whole tick at once. They are
+an alternative to the notify_passenger/confirm_car handshake, in which every car proposes itself to
+its nearest passenger, and the cars that are not confirmed stay idle for the rest of the tick.
+
+Each car is only considered for its DISPATCH_CANDIDATES nearest passengers, so the solvers work on
+a sparse set of (car, passenger) pairs that grows linearly with the number of cars, instead of the
+full matrix of distances between every car and every passenger.
+"""
+import heapq
+import itertools
+from typing import Dict, List
+
+from routing import UNREACHABLE
+
+HANDSHAKE = "handshake"
+GREEDY = "greedy"
+HUNGARIAN = "hungarian"
+DISPATCHERS = [HANDSHAKE, GREEDY, HUNGARIAN]
+# Number of nearest passengers that each car is considered for
+DISPATCH_CANDIDATES = 8
+
+
+def nearest_candidates(distances: List[int], limit: int = DISPATCH_CANDIDATES) -> Dict[int, int]:
+    """
+    Keep the nearest passengers of a car.
+    :param distances: Distance from the car to each passenger, UNREACHABLE if it can not reach it
+    :param limit: Number of passengers to keep. Ties are broken by the index of the passenger.
+    :return: Dictionary that maps the index of each kept passenger to its distance
+    """
+    reachable = ((distance, passenger) for passenger, distance in enumerate(distances))
+    nearest = heapq.nsmallest(limit, (pair for pair in reachable if pair[0] != UNREACHABLE))
+    return {passenger: distance for distance, passenger in nearest}
+
+
+def assign_passengers(dispatcher: str, candidates: List[Dict[int, int]]) -> Dict[int, int]:
+    """
+    Compute the assignment of cars to passengers with the specified dispatcher.
+    :param dispatcher: GREEDY or HUNGARIAN
+    :param candidates: For each car, dictionary that maps the index of each passenger it can be
+    assigned to, e.g. its nearest ones, to the distance between them
+    :return: Dictionary that maps the index of a car to the index of its passenger
+    """
+    if dispatcher == GREEDY:
+        return greedy_assignment(candidates)
+
+    elif dispatcher == HUNGARIAN:
+        return hungarian_assignment(candidates)
+
+    raise ValueError(f"Unknown dispatcher {dispatcher}")
+
+
+def greedy_assignment(candidates: List[Dict[int, int]]) -> Dict[int, int]:
+    """
+    Batched greedy assignment. All the pairs are sorted by distance, and each pair is taken if
+    neither the car nor the passenger have been assigned yet.
+    :param candidates: For each car, distance to each of its candidate passengers
+    :return: Dictionary that maps the index of a car to the index of its passenger
+    """
+    pairs = sorted(
+        (distance, car, passenger)
+        for car, row in enumerate(candidates)
+        for passenger, distance in row.items()
+    )
+    assignment = {}
+    assigned_passengers = set()
+    for _, car, passenger in pairs:
+        if car not in assignment and passenger not in assigned_passengers:
+            assignment[car] = passenger
+            assigned_passengers.add(passenger)
+
+    return assignment
+
+
+def hungarian_assignment(candidates: List[Dict[int, int]]) -> Dict[int, int]:
+    """
+    Assignment that minimizes the total distance among the ones that assign as many cars as
+    possible, with the Hungarian algorithm in its successive shortest paths form. Each car is
+    added with a Dijkstra search that only follows the candidate pairs of the cars already
+    assigned, using potentials that keep the reduced distances non negative, so its cost depends
+    on the number of candidate pairs instead of the number of passengers. Every car can also stay
+    unassigned at a cost of UNREACHABLE, which is how the search tells that a car must give its
+    passenger to the new car.
+    :param candidates: For each car, distance to each of its candidate passengers
+    :return: Dictionary that maps the index of a car to the index of its passenger
+    """
+
+    def options(car: int):
+        # The candidate passengers, and the car unassigned, as the negative passenger -car - 1
+        yield from candidates[car].items()
+        yield -car - 1, UNREACHABLE
+
+    car_potentials = [0] * len(candidates)
+    passenger_potentials = {}
+    assigned_cars = {}
+
+    for car in range(len(candidates)):
+        # Dijkstra over the passengers, where a passenger that is already assigned leads to the
+        # options of its car
+        # Entries (distance, passenger, order of the push, previous passenger on the path)
+        potential = car_potentials[car]
+        pushes = itertools.count()
+        heap = [
+            (distance - potential - passenger_potentials.get(passenger, 0), passenger, order, None)
+            for (passenger, distance), order in zip(options(car), pushes)
+        ]
+        heapq.heapify(heap)
+        settled = {}
+        previous = {}
+        while True:
+            distance, passenger, _, previous_passenger = heapq.heappop(heap)
+            if passenger in settled:
+                continue
+            settled[passenger] = distance
+            previous[passenger] = previous_passenger
+            if passenger not in assigned_cars:
+                break
+
+            other_car = assigned_cars[passenger]
+            for next_passenger, next_distance in options(other_car):
+                if next_passenger not in settled:
+                    reduced = (
+                        next_distance
+                        - car_potentials[other_car]
+                        - passenger_potentials.get(next_passenger, 0)
+                    )
+                    heapq.heappush(
+                        heap, (distance + reduced, next_passenger, next(pushes), passenger)
+                    )
+
+        # Update the potentials so the reduced distances stay non negative, and the ones of the
+        # assigned pairs zero
+        total = distance
+        car_potentials[car] += total
+        for settled_passenger, settled_distance in settled.items():
+            passenger_potentials[settled_passenger] = passenger_potentials.get(
+                settled_passenger, 0
+            ) - (total - settled_distance)
+            if settled_passenger in assigned_cars:
+                car_potentials[assigned_cars[settled_passenger]] += total - settled_distance
+
+        # Swap the pairs along the shortest path
+        while previous[passenger] is not None:
+            assigned_cars[passenger] = assigned_cars[previous[passenger]]
+            passenger = previous[passenger]
+        assigned_cars[passenger] = car
+
+    return {car: passenger for passenger, car in assigned_cars.items() if passenger >= 0}
@@ -0,0 +1,795 @@
+"""
+Array backed engine of the carpool model. Instead of calling the five stage methods of every agent,
+including the passive Road, Sidewalk and Intersection agents, it keeps the positions, directions and
+loads of the cars, the states of the passengers and the phases of the traffic lights in NumPy
+arrays, and runs each stage as a batch operation. It shares the routing layer with CarpoolModel,
+so both produce the same metrics for the same seed, and it has the same step()/get_*_data() API so
+that it can be used by the Flask server.
+"""
+import random
+from typing import Optional
+
+import numpy as np
+
+from agents import Car, TICKS_TO_CHANGE
+from dispatch import (
+    DISPATCH_CANDIDATES,
+    DISPATCHERS,
+    HANDSHAKE,
+    assign_passengers,
+    nearest_candidates,
+)
+from enums import Directions, LightStatus
+from citymap import CityMap
+from delta import (
+    ARRIVED,
+    HIDDEN,
+    MOVEMENT_NAMES,
+    NEEDS_RIDE,
+    NO_MOVEMENT,
+    TRAVELING,
+    WAITING,
+    Frame,
+)
+from planning import RoutePlanner
+from profiling import NULL_SECTION, StepProfiler
+from reservations import ReservationTable
+from spawn import FreeCellIndex
+from stats import SimulationStats
+from routing import (
+    CONGESTION,
+    DIRECTION_NAMES,
+    NO_CELL,
+    ROUTERS,
+    SHORTEST,
+    CongestionCosts,
+    NearestTargets,
+    RoadGraph,
+    Route,
+    RouteCache,
+    build_routing_table,
+    find_route,
+    find_routes,
+    index_targets,
+    search_nearest_targets,
+)
+
+SIDEWALK, ROAD = range(2)
+NO_OBJECTIVE = -1
+HOME = -2
+NO_PICKUP = -1
+NA_MOVEMENT = MOVEMENT_NAMES.index("NA")
+PA_MOVEMENT = MOVEMENT_NAMES.index("PA")
+
+
+class ArrayCarpoolModel:
+    def __init__(
+        self,
+        environment,
+        passenger_limit,
+        passenger_inst_limit,
+        passenger_delay,
+        car_limit,
+        car_inst_limit,
+        car_delay,
+        dispatcher=HANDSHAKE,
+        seed=None,
+        profile=False,
+        router=SHORTEST,
+        planning_workers=0,
+    ):
+        """
+        Initialize the arrays of the model. The parameters are the same as CarpoolModel, plus the
+        seed of the random number generator.
+        """
+        if dispatcher not in DISPATCHERS:
+            raise ValueError(f"Unknown dispatcher {dispatcher}, expected one of {DISPATCHERS}")
+        if router not in ROUTERS:
+            raise ValueError(f"Unknown router {router}, expected one of {ROUTERS}")
+
+        self.random = random.Random(seed)
+        city = CityMap.from_environment(environment)
+        self.width = city.width
+        self.height = city.height
+        self.passenger_limit = passenger_limit
+        self.inst_pass_limit = passenger_inst_limit
+        self.passenger_count = 0
+        self.passenger_creation_delay = passenger_delay
+        self.passenger_tick = self.passenger_creation_delay
+        self.car_limit = car_limit
+        self.inst_car_limit = car_inst_limit
+        self.car_count = 0
+        self.car_creation_delay = car_delay
+        self.car_tick = self.car_creation_delay
+        self.dispatcher = dispatcher
+        self.profiler = StepProfiler() if profile else None
+        self.steps = 0
+        self.running = True
+
+        self.graph = RoadGraph(city)
+        self.routing = build_routing_table(self.graph)
+        self.route_cache = RouteCache()
+        self.router = router
+        self.congestion = CongestionCosts(self.graph) if router == CONGESTION else None
+        self.cell_ids = np.frombuffer(self.graph.cell_ids, dtype="l")
+        self.planner = (
+            RoutePlanner(self.graph, self.routing, planning_workers) if planning_workers else None
+        )
+        self.planned = {}
+
+        self.road_directions = np.full((self.width, self.height), -1, dtype=np.int8)
+        self.road_directions[city.road_xs, city.road_ys] = city.road_directions
+
+        self.init_traffic_lights(city.intersection_data())
+
+        # Free cells to instantiate agents, updated in the same order as the SpawnGrid of
+        # CarpoolModel, and number of cars that are not in their destination in each cell, which
+        # are the ones that block it.
+        self.free_cells = {
+            SIDEWALK: FreeCellIndex(city.sidewalk_cells()),
+            ROAD: FreeCellIndex(city.road_cells()),
+        }
+        self.blockers = np.zeros((self.width, self.height), dtype=np.int32)
+        self.reservations = ReservationTable(self.height)
+
+        self.car_x = np.zeros(car_limit, dtype=np.int32)
+        self.car_y = np.zeros(car_limit, dtype=np.int32)
+        self.car_destination_x = np.zeros(car_limit, dtype=np.int32)
+        self.car_destination_y = np.zeros(car_limit, dtype=np.int32)
+        self.car_directions = np.zeros(car_limit, dtype=np.int8)
+        self.car_movements = np.full(car_limit, NO_MOVEMENT, dtype=np.int8)
+        self.car_pickups = np.full(car_limit, NO_PICKUP, dtype=np.int32)
+        self.car_objectives = np.full(car_limit, NO_OBJECTIVE, dtype=np.int32)
+        self.car_loads = np.zeros(car_limit, dtype=np.int32)
+        self.car_active = np.zeros(car_limit, dtype=bool)
+        self.car_distances = np.zeros(car_limit, dtype=np.int32)
+        self.car_routes = [Route() for _ in range(car_limit)]
+        self.car_route_epochs = np.zeros(car_limit, dtype=np.int64)
+        self.car_passengers = [[] for _ in range(car_limit)]
+
+        self.passenger_x = np.zeros(passenger_limit, dtype=np.int32)
+        self.passenger_y = np.zeros(passenger_limit, dtype=np.int32)
+        self.passenger_destination_x = np.zeros(passenger_limit, dtype=np.int32)
+        self.passenger_destination_y = np.zeros(passenger_limit, dtype=np.int32)
+        self.passenger_states = np.full(passenger_limit, NEEDS_RIDE, dtype=np.int8)
+        # Tick of the spawn, pickup and arrival of each passenger, -1 until it happens
+        self.passenger_spawn_ticks = np.full(passenger_limit, -1, dtype=np.int32)
+        self.passenger_pickup_ticks = np.full(passenger_limit, -1, dtype=np.int32)
+        self.passenger_arrival_ticks = np.full(passenger_limit, -1, dtype=np.int32)
+        # Road cells next to the sidewalk where each passenger spawned, like WaitingIndex
+        self.passenger_cells = []
+
+        self.kill_list = []
+        self.new_cars = []
+        self.waiting_passengers = np.zeros(0, dtype=np.int64)
+        self.passenger_field = None
+        self.offers = None
+        self.stats = SimulationStats()
+
+    def init_traffic_lights(self, intersections: list):
+        """
+        Store the traffic lights of every intersection in flat arrays. The lights of intersection i
+        are the positions light_offsets[i]:light_offsets[i + 1], one per direction to stop, and the
+        first of them starts in green.
+        :param intersections: Intersection data, as returned by CityMap.intersection_data
+        """
+        n_intersections = len(intersections)
+        self.intersection_at = np.full((self.width, self.height), -1, dtype=np.int32)
+        self.light_offsets = np.zeros(n_intersections + 1, dtype=np.int32)
+        stop_directions = []
+        self.light_ids = []
+        for index, intersection in enumerate(intersections):
+            x, y = intersection["x"], intersection["y"]
+            self.intersection_at[x, y] = index
+            for direction in intersection["directions_to_stop"]:
+                stop_directions.append(DIRECTION_NAMES.index(direction))
+                self.light_ids.append(f"{str(x).zfill(2)}{str(y).zfill(2)}{direction}")
+            self.light_offsets[index + 1] = len(stop_directions)
+
+        self.stop_directions = np.array(stop_directions, dtype=np.int8)
+        self.light_counts = np.diff(self.light_offsets)
+        self.light_status = np.full(len(stop_directions), LightStatus.RED.value, dtype=np.int8)
+        self.light_status[self.light_offsets[:-1]] = LightStatus.GREEN.value
+        self.active_lights = np.zeros(n_intersections, dtype=np.int32)
+        self.next_lights = np.zeros(n_intersections, dtype=np.int32)
+        self.ticks_to_light_change = np.full(n_intersections, TICKS_TO_CHANGE, dtype=np.int32)
+        self.active_directions = self.stop_directions[self.light_offsets[:-1]]
+
+    def step(self):
+        """
+        Same turn as CarpoolModel.step. First instantiate the new agents, then run the five
+        stages over the arrays, and finally remove the cars that reached their destination.
+        :return:
+        """
+        sections = [
+            self.instantiate_agents,
+            self.match_passengers,
+            self.notify_passenger,
+            self.confirm_car,
+            self.tick_traffic_lights,
+            self.move_cars,
+            self.resolve_moves,
+            self.pick_drop_passengers,
+        ]
+        if self.planner:
+            sections.insert(sections.index(self.move_cars), self.plan_routes)
+        for section in sections:
+            with self.profile_section(section.__name__):
+                section()
+        self.steps += 1
+
+        if self.congestion:
+            with self.profile_section("refresh_costs"):
+                if self.congestion.tick():
+                    self.route_cache.clear()
+
+        with self.profile_section("remove_agents", len(self.kill_list)):
+            for car in self.kill_list:
+                self.release((int(self.car_x[car]), int(self.car_y[car])))
+                self.car_active[car] = False
+            self.kill_list = []
+        self.running = not self.is_finished()
+        if self.profiler:
+            self.profiler.ticks += 1
+
+    def is_finished(self) -> bool:
+        """Same as CarpoolModel.is_finished"""
+        return (
+            self.passenger_count == self.passenger_limit
+            and self.car_count == self.car_limit
+            and not self.car_active.any()
+            and bool(np.all(self.passenger_states[: self.passenger_count] == ARRIVED))
+        )
+
+    def profile_section(self, name: str, calls: int = 1):
+        """Same as CarpoolModel.profile_section"""
+        return self.profiler.section(name, calls) if self.profiler else NULL_SECTION
+
+    def enable_profiling(self):
+        """Same as CarpoolModel.enable_profiling"""
+        if not self.profiler:
+            self.profiler = StepProfiler()
+
+    def disable_profiling(self):
+        """Same as CarpoolModel.disable_profiling"""
+        self.profiler = None
+
+    def get_profile(self):
+        """Same as CarpoolModel.get_profile"""
+        return self.profiler.to_dict() if self.profiler else None
+
+    def instantiate_agents(self):
+        """
+        Create the cars and passengers depending on the current number of agents, the set limits,
+        and the delays.
+        :return:
+        """
+        self.passenger_tick -= 1
+        self.car_tick -= 1
+        inst_car = 0
+        inst_pass = 0
+
+        if not self.passenger_tick:
+            while self.passenger_count < self.passenger_limit and inst_pass < self.inst_pass_limit:
+                if self.create_passenger() is None:
+                    break
+                inst_pass += 1
+            self.passenger_tick = self.passenger_creation_delay
+
+        if not self.car_tick:
+            while self.car_count < self.car_limit and inst_car < self.inst_car_limit:
+                car = self.create_car()
+                if car is None:
+                    break
+                self.new_cars.append(car)
+                inst_car += 1
+            self.car_tick = self.car_creation_delay
+
+    def create_passenger(self) -> Optional[int]:
+        """
+        Instantiate a passenger in a random sidewalk.
+        :return: The index of the passenger, or None if there are no free sidewalks
+        """
+        passenger = self.passenger_count
+        start = self.find_rand_cell(SIDEWALK)
+        dest = self.find_rand_cell(SIDEWALK, start)
+        if start is None or dest is None:
+            return None
+
+        (start_x, start_y), (dest_x, dest_y) = start, dest
+        self.passenger_x[passenger], self.passenger_y[passenger] = start_x, start_y
+        self.passenger_destination_x[passenger] = dest_x
+        self.passenger_destination_y[passenger] = dest_y
+        self.occupy(start)
+        self.passenger_cells.append(self.graph.adjacent_cells(start))
+        self.passenger_spawn_ticks[passenger] = self.steps
+        self.passenger_count += 1
+        self.stats.passengers_without_ride += 1
+        return passenger
+
+    def create_car(self) -> Optional[int]:
+        """
+        Instantiate a car in a random road.
+        :return: The index of the car, or None if there are no free roads
+        """
+        car = self.car_count
+        start = self.find_rand_cell(ROAD)
+        dest = self.find_rand_cell(ROAD, start)
+        if start is None or dest is None:
+            return None
+
+        (start_x, start_y), (dest_x, dest_y) = start, dest
+        self.car_x[car], self.car_y[car] = start_x, start_y
+        self.car_destination_x[car], self.car_destination_y[car] = dest_x, dest_y
+        self.car_directions[car] = self.road_directions[start_x, start_y]
+        self.car_active[car] = True
+        self.occupy(start)
+        if start != dest:
+            self.blockers[start_x, start_y] += 1
+        self.car_count += 1
+        self.stats.moving_cars += 1
+        return car
+
+    def find_rand_cell(self, cell_type: int, exclude_cell=None) -> (int, int):
+        """
+        Same as CarpoolModel.find_rand_cell: draw a random cell of the specified type without
+        any car or passenger.
+        :param cell_type: SIDEWALK or ROAD
+        :param exclude_cell: A cell that should be excluded for the search.
+        :return: The cell that can be used to instantiate, or None if there is no free cell
+        """
+        return self.free_cells[cell_type].sample(self.random, exclude_cell)
+
+    def occupy(self, pos: (int, int)):
+        """Register a car or passenger in a cell, like SpawnGrid"""
+        for index in self.free_cells.values():
+            index.occupy(pos)
+
+    def release(self, pos: (int, int)):
+        """Unregister a car or passenger from a cell, like SpawnGrid"""
+        for index in self.free_cells.values():
+            index.release(pos)
+
+    def match_passengers(self):
+        """
+        Same as CarpoolModel.match_passengers: prepare the nearest passenger of every cell, or the
+        assignment of the dispatcher, for the notify_passenger stage.
+        :return:
+        """
+        self.waiting_passengers = np.flatnonzero(
+            self.passenger_states[: self.passenger_count] == NEEDS_RIDE
+        )
+        if self.dispatcher == HANDSHAKE:
+            self.passenger_field = NearestTargets(
+                self.graph, [self.passenger_cells[p] for p in self.waiting_passengers]
+            )
+            if self.profiler:
+                self.profiler.count_search("nearest_passenger", self.passenger_field.expanded)
+        else:
+            self.dispatch_passengers()
+
+    def dispatch_passengers(self):
+        """
+        Same as CarpoolModel.dispatch_passengers. The offers of the assigned cars are stored as
+        arrays of cars, passengers and distances.
+        :return:
+        """
+        self.offers = None
+        cars = np.flatnonzero(self.idle_cars())
+        if not len(cars) or not len(self.waiting_passengers):
+            return
+
+        targets = [self.passenger_cells[p] for p in self.waiting_passengers]
+        positions = [(self.car_x[car], self.car_y[car]) for car in cars]
+        if self.routing:
+            candidates = [
+                nearest_candidates([self.routing.nearest_distance(pos, cells) for cells in targets])
+                for pos in positions
+            ]
+        else:
+            targets_at = index_targets(targets)
+            limit = min(DISPATCH_CANDIDATES, len(targets))
+            candidates = [
+                {
+                    passenger: len(route)
+                    for passenger, route in search_nearest_targets(
+                        self.graph, pos, targets_at, limit, self.profiler
+                    ).items()
+                }
+                for pos in positions
+            ]
+
+        assignment = sorted(assign_passengers(self.dispatcher, candidates).items())
+        self.offers = (
+            np.array([cars[car] for car, _ in assignment], dtype=np.int64),
+            np.array([self.waiting_passengers[p] for _, p in assignment], dtype=np.int64),
+            np.array([candidates[car][p] for car, p in assignment], dtype=np.int64),
+        )
+
+    def idle_cars(self) -> np.ndarray:
+        """Mask of the cars without pickup objective and with capacity for more passengers"""
+        return (
+            self.car_active
+            & (self.car_pickups == NO_PICKUP)
+            & (self.car_loads < Car.capacity)
+        )
+
+    def notify_passenger(self):
+        """
+        TURN PART 1
+        Every idle car reads the nearest passenger of its cell from the passenger field, all at
+        once. The offers are kept as arrays of cars, passengers and distances.
+        :return:
+        """
+        if self.dispatcher != HANDSHAKE:
+            return
+
+        cars = np.flatnonzero(self.idle_cars())
+        cells = self.cell_ids[self.car_x[cars] * self.height + self.car_y[cars]]
+        nearest = np.frombuffer(self.passenger_field.nearest_targets, dtype="l")[cells]
+        distances = np.frombuffer(self.passenger_field.distances, dtype="I")[cells]
+        found = (cells != NO_CELL) & (nearest != NO_CELL)
+        self.offers = (
+            cars[found],
+            self.waiting_passengers[nearest[found]],
+            distances[found].astype(np.int64),
+        )
+
+    def confirm_car(self):
+        """
+        TURN PART 2
+        Every passenger with offers confirms the nearest car. Ties are won by the car that
+        notified first, like the dictionary of possible rides of Passenger.
+        :return:
+        """
+        if self.offers is None or not len(self.offers[0]):
+            return
+
+        cars, passengers, distances = self.offers
+        order = np.lexsort((cars, distances, passengers))
+        passengers, first = np.unique(passengers[order], return_index=True)
+        self.passenger_states[passengers] = WAITING
+        cars = cars[order][first]
+        self.car_pickups[cars] = passengers
+        # Like Car.receive_passenger_confirmation, the cars heading home choose a new objective
+        for car in cars[self.car_objectives[cars] == HOME]:
+            self.car_objectives[car] = NO_OBJECTIVE
+            self.car_routes[car] = Route()
+        self.stats.passengers_without_ride -= len(passengers)
+        self.offers = None
+
+    def tick_traffic_lights(self):
+        """
+        TURN PART 3
+        Advance the light cycle of all the intersections at once, with the same transitions as
+        Intersection.tick_traffic_lights.
+        :return:
+        """
+        self.ticks_to_light_change -= 1
+        starts = self.light_offsets[:-1]
+
+        prepare = self.ticks_to_light_change == 1
+        self.next_lights[prepare] = (self.active_lights[prepare] + 1) % self.light_counts[prepare]
+        self.light_status[starts[prepare] + self.active_lights[prepare]] = LightStatus.YELLOW.value
+
+        change = self.ticks_to_light_change == 0
+        self.toggle_lights(starts[change] + self.active_lights[change])
+        self.toggle_lights(starts[change] + self.next_lights[change])
+        self.active_lights[change] = self.next_lights[change]
+        self.ticks_to_light_change[change] = TICKS_TO_CHANGE
+        self.active_directions = self.stop_directions[starts + self.active_lights]
+
+    def toggle_lights(self, lights: np.ndarray):
+        """Same transitions as TrafficLight.toggle, for an array of lights"""
+        status = self.light_status[lights]
+        status = np.where(status == LightStatus.RED.value, LightStatus.GREEN.value, status)
+        status = np.where(
+            self.light_status[lights] == LightStatus.YELLOW.value, LightStatus.RED.value, status
+        )
+        self.light_status[lights] = status
+
+    def interest_points(self, car: int) -> list:
+        """Same as Car.interest_points"""
+        interest_points = list(self.car_passengers[car])
+        if self.car_pickups[car] != NO_PICKUP:
+            interest_points.append(self.car_pickups[car])
+        return interest_points
+
+    def plan_routes(self):
+        """Same as CarpoolModel.plan_routes"""
+        cars = []
+        requests = []
+        for car in np.flatnonzero(self.car_active & (self.car_objectives == NO_OBJECTIVE)):
+            pos = (int(self.car_x[car]), int(self.car_y[car]))
+            points = [self.get_meeting_point(passenger) for passenger in self.interest_points(car)]
+            missing = [
+                index
+                for index, point in enumerate(points)
+                if (pos, point) not in self.route_cache
+            ]
+            if missing:
+                cars.append(car)
+                requests.append((pos, points, missing))
+
+        costs = self.congestion.costs if self.congestion else None
+        self.planned = dict(zip(cars, self.planner.plan(requests, costs)))
+
+    def close(self):
+        """Same as CarpoolModel.close"""
+        if self.planner:
+            self.planner.close()
+
+    def move_cars(self):
+        """
+        TURN PART 4
+        Plan the movement of every car, in the order they were created, and request the next
+        cell of the cars that can move. The cars are moved in resolve_moves.
+        :return:
+        """
+        for car in np.flatnonzero(self.car_active):
+            self.move_car(car)
+
+    def move_car(self, car: int):
+        """Same logic as Car.move_cars for a single car"""
+        pos = (int(self.car_x[car]), int(self.car_y[car]))
+        destination = (int(self.car_destination_x[car]), int(self.car_destination_y[car]))
+        if self.car_objectives[car] == NO_OBJECTIVE:
+            interest_points = self.interest_points(car)
+            routes = find_routes(
+                self.graph,
+                self.routing,
+                self.route_cache,
+                pos,
+                [self.get_meeting_point(passenger) for passenger in interest_points],
+                self.profiler,
+                self.congestion,
+                self.planned.pop(car, None),
+            )
+            if routes:
+                optimal = min(routes, key=lambda x: len(x[1]))
+                self.car_routes[car] = optimal[1]
+                self.car_objectives[car] = interest_points[optimal[0]]
+
+        route = self.car_routes[car]
+        if not route:
+            if self.car_objectives[car] >= 0 or self.stats.passengers_without_ride:
+                self.car_movements[car] = NA_MOVEMENT
+                return
+
+            elif pos == destination:
+                self.kill_list.append(car)
+                self.stats.moving_cars -= 1
+                self.car_movements[car] = PA_MOVEMENT
+                return
+
+            route = find_route(
+                self.graph,
+                self.routing,
+                self.route_cache,
+                pos,
+                destination,
+                self.profiler,
+                self.congestion,
+            )
+            self.car_routes[car] = route
+            self.car_objectives[car] = HOME
+            if not route:
+                self.car_movements[car] = NA_MOVEMENT
+                return
+
+        disp = Directions[route.next_direction()].value
+        target = pos[0] + disp[0], pos[1] + disp[1]
+        intersection = self.intersection_at[target]
+        if intersection >= 0 and self.active_directions[intersection] != self.car_directions[car]:
+            self.wait(car, pos, destination)
+            return
+
+        self.reservations.request(
+            car, car, pos, target, reserve=intersection < 0, blocking=pos != destination
+        )
+
+    def resolve_moves(self):
+        """Same as CarpoolModel.resolve_moves"""
+        for car, moves in self.reservations.resolve(self.blockers):
+            pos = (int(self.car_x[car]), int(self.car_y[car]))
+            destination = (int(self.car_destination_x[car]), int(self.car_destination_y[car]))
+            if moves:
+                self.apply_move(car, pos, destination)
+            else:
+                self.wait(car, pos, destination)
+
+    def apply_move(self, car: int, pos: (int, int), destination: (int, int)):
+        """Same as Car.apply_move"""
+        route = self.car_routes[car]
+        next_direction = route.next_direction()
+        direction = DIRECTION_NAMES.index(next_direction)
+        disp = Directions[next_direction].value
+        x_new, y_new = pos[0] + disp[0], pos[1] + disp[1]
+        route.advance()
+        if self.congestion:
+            self.congestion.depart(pos)
+
+        self.release(pos)
+        self.occupy((x_new, y_new))
+        if pos != destination:
+            self.blockers[pos] -= 1
+        if (x_new, y_new) != destination:
+            self.blockers[x_new, y_new] += 1
+        self.car_x[car], self.car_y[car] = x_new, y_new
+        self.car_directions[car] = direction
+        self.car_movements[car] = direction
+        self.car_distances[car] += 1
+        self.stats.movements += 1
+
+        for passenger in self.car_passengers[car]:
+            self.move_passenger(passenger, x_new, y_new)
+
+    def wait(self, car: int, pos: (int, int), destination: (int, int)):
+        """Same as Car.wait, with Car.repair_route"""
+        self.car_movements[car] = NA_MOVEMENT
+        if not self.congestion:
+            return
+
+        self.congestion.wait(pos)
+        if self.car_route_epochs[car] == self.congestion.epoch:
+            return
+        self.car_route_epochs[car] = self.congestion.epoch
+        objective = self.car_objectives[car]
+        if objective == NO_OBJECTIVE:
+            return
+        elif objective == HOME:
+            route = find_route(
+                self.graph,
+                self.routing,
+                self.route_cache,
+                pos,
+                destination,
+                self.profiler,
+                self.congestion,
+            )
+        else:
+            routes = find_routes(
+                self.graph,
+                self.routing,
+                self.route_cache,
+                pos,
+                [self.get_meeting_point(objective)],
+                self.profiler,
+                self.congestion,
+            )
+            route = routes[0][1] if routes else None
+        if route:
+            self.car_routes[car] = route
+
+    def pick_drop_passengers(self):
+        """
+        TURN PART 5
+        Pick up the waiting passengers and drop the traveling passengers that are the objective
+        of a car next to them.
+        :return:
+        """
+        cars = np.flatnonzero(self.car_active & (self.car_objectives >= 0))
+        passengers = self.car_objectives[cars]
+        states = self.passenger_states[passengers]
+        pickup_distances = np.abs(self.car_x[cars] - self.passenger_x[passengers]) + np.abs(
+            self.car_y[cars] - self.passenger_y[passengers]
+        )
+        drop_distances = np.abs(
+            self.car_x[cars] - self.passenger_destination_x[passengers]
+        ) + np.abs(self.car_y[cars] - self.passenger_destination_y[passengers])
+
+        pickups = (states == WAITING) & (pickup_distances == 1)
+        for car, passenger in zip(cars[pickups], passengers[pickups]):
+            self.passenger_states[passenger] = TRAVELING
+            self.passenger_pickup_ticks[passenger] = self.steps
+            self.car_passengers[car].append(passenger)
+            self.car_loads[car] += 1
+            self.car_pickups[car] = NO_PICKUP
+            self.car_objectives[car] = NO_OBJECTIVE
+
+        drops = (states == TRAVELING) & (drop_distances == 1)
+        for car, passenger in zip(cars[drops], passengers[drops]):
+            self.passenger_states[passenger] = ARRIVED
+            self.passenger_arrival_ticks[passenger] = self.steps
+            self.stats.passengers_arrived += 1
+            self.car_passengers[car].remove(passenger)
+            self.car_loads[car] -= 1
+            self.move_passenger(
+                passenger,
+                self.passenger_destination_x[passenger],
+                self.passenger_destination_y[passenger],
+            )
+            self.car_objectives[car] = NO_OBJECTIVE
+
+    def move_passenger(self, passenger: int, x: int, y: int):
+        """Move a passenger to a cell, updating the free cells"""
+        self.release((int(self.passenger_x[passenger]), int(self.passenger_y[passenger])))
+        self.occupy((int(x), int(y)))
+        self.passenger_x[passenger], self.passenger_y[passenger] = x, y
+
+    def get_meeting_point(self, passenger: int) -> (int, int):
+        """Same as Passenger.get_meeting_point"""
+        if self.passenger_states[passenger] == TRAVELING:
+            return self.passenger_destination_x[passenger], self.passenger_destination_y[passenger]
+        return self.passenger_x[passenger], self.passenger_y[passenger]
+
+    def get_cars_data(self):
+        """
+        Serialize the movements of the cars, sending the direction in which it moved.
+        :return:
+        """
+        new_cars = set(self.new_cars)
+        return [
+            {"next_direction": self.movement_name(car)}
+            for car in np.flatnonzero(self.car_active)
+            if car not in new_cars
+        ]
+
+    def movement_name(self, car: int):
+        """Decode the last movement of a car, as stored in Car.real_movement"""
+        movement = self.car_movements[car]
+        return None if movement == NO_MOVEMENT else MOVEMENT_NAMES[movement]
+
+    def get_traffic_lights_data(self):
+        """
+        Serialize the status of the traffic lights, sending the id and the state.
+        :return:
+        """
+        return [
+            {"state": int(status), "id": light_id}
+            for status, light_id in zip(self.light_status, self.light_ids)
+        ]
+
+    def get_new_car_data(self):
+        """
+        Serialize the data of the new cars, sending the position in which they instantiated in
+        the map.
+        :return:
+        """
+        new_cars_data = [
+            {"x": int(self.car_x[car]), "y": 0, "z": int(self.car_y[car])} for car in self.new_cars
+        ]
+        self.new_cars = []
+        return new_cars_data
+
+    def get_passenger_data(self):
+        """
+        Serialize the information about the passengers, sending their position and their status
+        in case they are not travelling.
+        :return:
+        """
+        states = self.passenger_states[: self.passenger_count]
+        return [
+            {
+                "x": int(self.passenger_x[passenger]),
+                "y": 0,
+                "z": int(self.passenger_y[passenger]),
+                "arrived": bool(states[passenger] == ARRIVED),
+            }
+            for passenger in np.flatnonzero(states != TRAVELING)
+        ]
+
+    def get_frame(self):
+        """Same as CarpoolModel.get_frame"""
+        cars = np.flatnonzero(self.car_active)
+        passengers = np.arange(self.passenger_count)
+        states = self.passenger_states[passengers]
+        traveling = states == TRAVELING
+        return Frame(
+            tick=self.steps,
+            car_ids=cars,
+            cars=np.stack(
+                [self.car_x[cars], self.car_y[cars], self.car_movements[cars]], axis=1
+            ).astype(np.int32),
+            light_ids=self.light_ids,
+            light_status=self.light_status.copy(),
+            passenger_ids=passengers,
+            passengers=np.stack(
+                [
+                    np.where(traveling, HIDDEN, self.passenger_x[passengers]),
+                    np.where(traveling, HIDDEN, self.passenger_y[passengers]),
+                    states,
+                ],
+                axis=1,
+            ).astype(np.int32),
+        )
@@ -5,8 +5,10 @@ from mesa.visualization.modules import CanvasGrid
 from mesa.visualization.ModularVisualization import ModularServer
 from mesa.visualization.UserParam import UserSettableParameter
 
+from dispatch import DISPATCHERS, HANDSHAKE
 from environment import ENVIRONMENT
 from model import agent_portrayal, CarpoolModel
+from routing import ROUTERS, SHORTEST
 
 if __name__ == "__main__":
     height = len(ENVIRONMENT)
@@ -27,6 +29,11 @@ if __name__ == "__main__":
         "car_delay": UserSettableParameter(
             "slider", "Delay between car instantitation batch", 1, 0, 20
         ),
+        "dispatcher": UserSettableParameter(
+            "choice", "Passenger dispatcher", value=HANDSHAKE, choices=DISPATCHERS
+        ),
+        "router": UserSettableParameter("choice", "Car routing", value=SHORTEST, choices=ROUTERS),
+        "static_agents": True,
     }
     grid = CanvasGrid(agent_portrayal, width, height, 900, 900)
     server = ModularServer(CarpoolModel, [grid], "CarpoolModel", model_params)
@@ -0,0 +1,160 @@
+"""
+Procedural generator of city maps with the same pattern as ENVIRONMENT: a grid of one-way
+streets that meet at intersections (IN), and blocks between them with sidewalks (SW) around empty
+cells (00). The size of the blocks and the direction of each street are configurable, and the
+street layout is validated so that every road can be reached from every other road.
+
+Small maps are returned as nested lists of strings, like ENVIRONMENT. Big maps (e.g. 10k x 10k
+cells) are generated as a compact NumPy array with one byte per cell, which can be converted
+with to_environment.
+"""
+import random
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+# Code of each cell type in the compact arrays
+CELL_TYPES = ["00", "SW", "IN", "UP", "LF", "RH", "DW"]
+CELL_CODES = {cell: code for code, cell in enumerate(CELL_TYPES)}
+
+HORIZONTAL = ["LF", "RH"]
+VERTICAL = ["DW", "UP"]
+
+
+def generate_city(
+    blocks_x: int,
+    blocks_y: int,
+    block_size: int = 4,
+    horizontal: Sequence[str] = ("LF", "RH"),
+    vertical: Sequence[str] = ("DW", "UP"),
+    seed: Optional[int] = None,
+    compact: bool = False,
+):
+    """
+    Generate a city map. The streets go around the whole map and between every pair of blocks,
+    so the map has blocks * (block_size + 1) + 1 cells on each side. By default the streets
+    alternate their direction like in ENVIRONMENT, which is generate_city(5, 5). In that case the
+    number of blocks on each side must be odd, so that the border streets form a cycle.
+    :param blocks_x: Number of blocks on each row
+    :param blocks_y: Number of blocks on each column
+    :param block_size: Number of cells on each side of a block
+    :param horizontal: Directions (LF or RH) of the horizontal streets from top to bottom,
+    repeated as many times as needed
+    :param vertical: Directions (DW or UP) of the vertical streets from left to right,
+    repeated as many times as needed
+    :param seed: If specified, the direction of every street is chosen at random instead, with
+    this seed, until the layout is strongly connected
+    :param compact: Return the compact array instead of nested lists
+    :return: The map, as a matrix of cells like ENVIRONMENT or as an array of CELL_CODES
+    """
+    if blocks_x < 1 or blocks_y < 1 or block_size < 1:
+        raise ValueError("The map must have at least one block, of at least one cell")
+
+    if seed is None:
+        rows = [horizontal[index % len(horizontal)] for index in range(blocks_y + 1)]
+        cols = [vertical[index % len(vertical)] for index in range(blocks_x + 1)]
+    else:
+        rows, cols = random_streets(blocks_x, blocks_y, random.Random(seed))
+
+    validate_streets(rows, cols)
+    cells = build_cells(rows, cols, block_size)
+    return cells if compact else to_environment(cells)
+
+
+def random_streets(blocks_x: int, blocks_y: int, rng: random.Random) -> (list, list):
+    """
+    Choose a random direction for every street, until the layout is strongly connected.
+    :return: Directions of the horizontal streets and of the vertical streets
+    """
+    while True:
+        rows = [rng.choice(HORIZONTAL) for _ in range(blocks_y + 1)]
+        cols = [rng.choice(VERTICAL) for _ in range(blocks_x + 1)]
+        if not corner_errors(rows, cols):
+            return rows, cols
+
+
+def corner_errors(rows: List[str], cols: List[str]) -> List[str]:
+    """
+    Find the corners of the map that break the strong connectivity of a street layout. Every
+    street goes across the whole map, so every intersection can reach the end of its streets on
+    the border, and can be reached from their start. Therefore, the layout is strongly connected
+    if and only if the four border streets form a cycle, i.e. a car can enter and leave each
+    corner.
+    :param rows: Directions of the horizontal streets from top to bottom
+    :param cols: Directions of the vertical streets from left to right
+    :return: Description of each wrong corner, empty if the layout is strongly connected
+    """
+    top, bottom, left, right = rows[0], rows[-1], cols[0], cols[-1]
+    corners = {
+        # Name: (direction that enters the corner, direction that leaves it) for each street
+        "top left": ((top == "LF"), (left == "DW")),
+        "top right": ((right == "UP"), (top == "LF")),
+        "bottom left": ((left == "DW"), (bottom == "RH")),
+        "bottom right": ((bottom == "RH"), (right == "UP")),
+    }
+    errors = []
+    for name, (first_enters, second_leaves) in corners.items():
+        if first_enters != second_leaves:
+            problem = "can not be left" if first_enters else "can not be reached"
+            errors.append(f"the {name} corner {problem}")
+    return errors
+
+
+def validate_streets(rows: List[str], cols: List[str]):
+    """
+    Check that a street layout is valid and strongly connected, and raise a ValueError otherwise.
+    :param rows: Directions of the horizontal streets from top to bottom
+    :param cols: Directions of the vertical streets from left to right
+    """
+    if any(direction not in HORIZONTAL for direction in rows):
+        raise ValueError(f"Horizontal streets must go {HORIZONTAL}, got {rows}")
+
+    if any(direction not in VERTICAL for direction in cols):
+        raise ValueError(f"Vertical streets must go {VERTICAL}, got {cols}")
+
+    errors = corner_errors(rows, cols)
+    if errors:
+        raise ValueError(f"The streets are not strongly connected: {', '.join(errors)}")
+
+
+def build_cells(rows: List[str], cols: List[str], block_size: int) -> np.ndarray:
+    """
+    Fill the compact array of a map from the directions of its streets.
+    :return: Array of shape (number of rows, number of columns) with the CELL_CODES
+    """
+    period = block_size + 1
+    n_rows = (len(rows) - 1) * period + 1
+    n_cols = (len(cols) - 1) * period + 1
+
+    # Position of each cell inside its block, where 0 is the street
+    row_offsets = np.arange(n_rows) % period
+    col_offsets = np.arange(n_cols) % period
+    cells = np.full((n_rows, n_cols), CELL_CODES["00"], dtype=np.uint8)
+
+    on_ring = (
+        (row_offsets[:, None] == 1)
+        | (row_offsets[:, None] == block_size)
+        | (col_offsets[None, :] == 1)
+        | (col_offsets[None, :] == block_size)
+    )
+    cells[on_ring] = CELL_CODES["SW"]
+
+    row_codes = np.array([CELL_CODES[direction] for direction in rows], dtype=np.uint8)
+    col_codes = np.array([CELL_CODES[direction] for direction in cols], dtype=np.uint8)
+    cells[::period, :] = row_codes[:, None]
+    cells[:, ::period] = col_codes[None, :]
+    cells[::period, ::period] = CELL_CODES["IN"]
+    return cells
+
+
+def to_environment(cells: np.ndarray) -> List[List[str]]:
+    """Convert a compact array to a matrix of cells like ENVIRONMENT"""
+    names = np.array(CELL_TYPES)
+    return names[cells].tolist()
+
+
+def to_compact(environment: List[List[str]]) -> np.ndarray:
+    """Convert a matrix of cells like ENVIRONMENT to a compact array"""
+    return np.array(
+        [[CELL_CODES[cell] for cell in row] for row in environment], dtype=np.uint8
+    )
@@ -4,14 +4,43 @@ the agents, and their turns along the ticks of the system. Also includes methods
 state of the system (to work with the Flask server) and to customize the visualization of the agents
 (to work with the Mesa embedded server).
 """
-from typing import Type, Union
+import random
+from typing import Optional, Type, Union
 
+import numpy as np
 from mesa import Model
-from mesa.space import MultiGrid
-from mesa.time import StagedActivation
 
-from enums import Directions, RawDirections
+from enums import Directions
 from agents import Passenger, Car, Road, Intersection, Sidewalk
+from citymap import CityMap
+from delta import ARRIVED, HIDDEN, NEEDS_RIDE, TRAVELING, WAITING, Frame, movement_code
+from dispatch import (
+    DISPATCH_CANDIDATES,
+    DISPATCHERS,
+    HANDSHAKE,
+    assign_passengers,
+    nearest_candidates,
+)
+from planning import RoutePlanner
+from profiling import NULL_SECTION, StepProfiler
+from reservations import ReservationTable
+from routing import (
+    CONGESTION,
+    DIRECTION_NAMES,
+    ROUTERS,
+    SHORTEST,
+    CongestionCosts,
+    NearestTargets,
+    RoadGraph,
+    RouteCache,
+    build_routing_table,
+    index_targets,
+    search_nearest_targets,
+)
+from scheduler import StageDispatcher
+from spawn import FreeCellIndex, SpawnGrid
+from stats import SimulationStats
+from waiting import WaitingIndex
 
 
 class CarpoolModel(Model):
@@ -24,22 +53,59 @@ class CarpoolModel(Model):
         car_limit,
         car_inst_limit,
         car_delay,
+        dispatcher=HANDSHAKE,
+        profile=False,
+        static_agents=False,
+        router=SHORTEST,
+        planning_workers=0,
+        seed=None,
     ):
+        """
+        Initialize the model. The environment may be a matrix of cells like ENVIRONMENT, an array
+        of cell codes (see mapgen and citymap), or a CityMap.
+        :param static_agents: Create a Road or Sidewalk agent on every cell of the grid. They are
+        only needed to draw the map in the Mesa server.
+        :param router: SHORTEST to route the cars by number of movements, or CONGESTION to route
+        them by the travel times observed in the last ticks (see routing.CongestionCosts)
+        :param planning_workers: Number of worker processes that search the routes of the cars
+        in each tick (see planning), or 0 to search them in the turn of each car
+        :param seed: Seed of the random number generator of the model, or None
+        """
         super().__init__()
-        self.width = len(environment[0])
-        self.height = len(environment)
-        self.grid = MultiGrid(self.width, self.height, torus=False)
-
-        self.schedule = StagedActivation(
-            self,
-            [
-                "notify_passenger",
-                "confirm_car",
-                "tick_traffic_lights",
-                "move_cars",
-                "pick_drop_passengers",
-            ],
+        # Mesa stores the random number generator in the class, which would share it between all
+        # the models of the process
+        self.random = random.Random(seed)
+        if dispatcher not in DISPATCHERS:
+            raise ValueError(f"Unknown dispatcher {dispatcher}, expected one of {DISPATCHERS}")
+        if router not in ROUTERS:
+            raise ValueError(f"Unknown router {router}, expected one of {ROUTERS}")
+
+        self.city = CityMap.from_environment(environment)
+        self.width = self.city.width
+        self.height = self.city.height
+        self.free_cells = {
+            Sidewalk: FreeCellIndex(self.city.sidewalk_cells()),
+            Road: FreeCellIndex(self.city.road_cells()),
+        }
+        self.grid = SpawnGrid(
+            self.width,
+            self.height,
+            torus=False,
+            indexes=list(self.free_cells.values()),
+            tracked=(Car, Passenger),
         )
+
+        stages = [
+            "notify_passenger",
+            "confirm_car",
+            "tick_traffic_lights",
+            "move_cars",
+            "resolve_moves",
+            "pick_drop_passengers",
+        ]
+        if planning_workers:
+            stages.insert(stages.index("move_cars"), "plan_routes")
+        self.schedule = StageDispatcher(self, stages, model_stages=["plan_routes", "resolve_moves"])
         self.passenger_limit = passenger_limit
         self.inst_pass_limit = passenger_inst_limit
         self.passenger_count = 0
@@ -50,41 +116,231 @@ class CarpoolModel(Model):
         self.car_count = 0
         self.car_creation_delay = car_delay
         self.car_tick = self.car_creation_delay
+        self.dispatcher = dispatcher
+        self.profiler = StepProfiler() if profile else None
+        self.stats = SimulationStats()
+
+        self.graph = RoadGraph(self.city)
+        self.routing = build_routing_table(self.graph)
+        self.route_cache = RouteCache()
+        self.router = router
+        self.congestion = CongestionCosts(self.graph) if router == CONGESTION else None
+        self.waiting = WaitingIndex(self.graph)
+        self.planner = (
+            RoutePlanner(self.graph, self.routing, planning_workers) if planning_workers else None
+        )
+        # Searches of the plan_routes stage for the move_cars stage, by car id
+        self.planned = {}
 
-        intersections, roads, sidewalks = parse_environment(environment)
-
-        for intersection in intersections:
+        self.intersections = []
+        for intersection in self.city.intersection_data():
             a = Intersection(self.next_id(), self, **intersection)
             self.schedule.add(a)
-
-        for road in roads:
-            a = Road(self.next_id(), self, **road)
-            self.schedule.add(a)
-
-        for sidewalk in sidewalks:
-            a = Sidewalk(self.next_id(), self, **sidewalk)
-            self.schedule.add(a)
+            self.intersections.append(a)
+        self.intersection_at = {
+            intersection.pos: intersection for intersection in self.intersections
+        }
+
+        # Number of cars that block each cell, i.e. that are not parked at their destination, and
+        # the cells requested by the cars in the move_cars stage
+        self.blockers = np.zeros((self.width, self.height), dtype=np.int32)
+        self.reservations = ReservationTable(self.height)
+
+        # Direction of each road cell, -1 for the other cells, and the text shown on the cells
+        self.road_directions = np.full((self.width, self.height), -1, dtype=np.int8)
+        self.road_directions[self.city.road_xs, self.city.road_ys] = self.city.road_directions
+        self.labels = {}
+        if static_agents:
+            for x, y in self.city.road_cells():
+                Road(self.next_id(), self, x, y, self.road_direction((x, y)))
+            for x, y in self.city.sidewalk_cells():
+                Sidewalk(self.next_id(), self, x, y)
 
         self.kill_list = []
-        self.new_cars = []
-        Car.movements = 0
-        Passenger.passengers_without_ride = 0
+        self.new_cars = {}
+        self.cars = {}
+        self.passengers = []
+        self.waiting_passengers = []
+        self.passenger_field = None
+        self.assignments = {}
 
     def step(self):
         """
         In each turn, first verify it is possible to instantiate a new agent. Then, execute the
-        step in each of them. As the schedule is StagedActivation, the turn of each agent will be in
-        several middle steps
+        step in each of them. The turn is divided in several stages, and each stage is only
+        executed by the agents that implement it. Roads and sidewalks are not scheduled.
         :return:
         """
-        self.instantiate_agents()
+        with self.profile_section("instantiate_agents"):
+            self.instantiate_agents()
+        with self.profile_section("match_passengers"):
+            self.match_passengers()
 
         self.schedule.step()
 
-        for agent in self.kill_list:
-            self.grid.remove_agent(agent)
-            self.schedule.remove(agent)
-        self.kill_list = []
+        if self.congestion:
+            with self.profile_section("refresh_costs"):
+                # The cached routes were found with the old costs
+                if self.congestion.tick():
+                    self.route_cache.clear()
+
+        with self.profile_section("remove_agents", len(self.kill_list)):
+            for agent in self.kill_list:
+                self.grid.remove_agent(agent)
+                self.schedule.remove(agent)
+                del self.cars[agent.unique_id]
+            self.kill_list = []
+        self.running = not self.is_finished()
+        if self.profiler:
+            self.profiler.ticks += 1
+
+    def profile_section(self, name: str, calls: int = 1):
+        """
+        Context manager that records the time of a section of the tick if profiling is enabled,
+        and does nothing otherwise.
+        """
+        return self.profiler.section(name, calls) if self.profiler else NULL_SECTION
+
+    def enable_profiling(self):
+        """Start recording the time of each section of the tick and the searches of the cars"""
+        if not self.profiler:
+            self.profiler = StepProfiler()
+
+    def disable_profiling(self):
+        """Stop profiling and discard the recorded data"""
+        self.profiler = None
+
+    def get_profile(self):
+        """
+        Obtain the data recorded since profiling was enabled.
+        :return: Dictionary returned by StepProfiler.to_dict, or None if profiling is disabled
+        """
+        return self.profiler.to_dict() if self.profiler else None
+
+    def is_finished(self) -> bool:
+        """
+        Check if the simulation is over: every car and passenger was instantiated, and all of
+        the cars left after every passenger reached their destination.
+        :return: True if there is nothing left to simulate
+        """
+        return (
+            self.passenger_count == self.passenger_limit
+            and self.car_count == self.car_limit
+            and not self.cars
+            and all(passenger.has_arrived for passenger in self.passengers)
+        )
+
+    def match_passengers(self):
+        """
+        Prepare the candidate passenger of each car for the notify_passenger stage. With the
+        handshake dispatcher, every road cell is labeled with its nearest passenger that needs a
+        ride, using a single BFS over the reversed road graph from the cells next to all of the
+        passengers. Otherwise, the idle cars are assigned to the passengers for the whole tick.
+        :return:
+        """
+        self.waiting_passengers = self.waiting.needing_ride()
+        if self.dispatcher == HANDSHAKE:
+            self.passenger_field = NearestTargets(self.graph, self.waiting.targets())
+            if self.profiler:
+                self.profiler.count_search("nearest_passenger", self.passenger_field.expanded)
+        else:
+            self.dispatch_passengers()
+
+    def dispatch_passengers(self):
+        """
+        Assign the cars without pickup objective to the passengers that need a ride, with a global
+        solver over the routing distances from each car to its DISPATCH_CANDIDATES nearest
+        passengers. Without a routing table, they are found with a BFS from each car that stops
+        at the last of them. Each passenger is then notified by a single car, so no car loses the
+        confirmation and stays idle for the tick.
+        :return:
+        """
+        self.assignments = {}
+        cars = [
+            car
+            for car in self.cars.values()
+            if not car.pickup and len(car.passengers) < car.capacity
+        ]
+        if not cars or not self.waiting_passengers:
+            return
+
+        targets = self.waiting.targets()
+        if self.routing:
+            candidates = [
+                nearest_candidates(
+                    [self.routing.nearest_distance(car.pos, cells) for cells in targets]
+                )
+                for car in cars
+            ]
+        else:
+            targets_at = index_targets(targets)
+            limit = min(DISPATCH_CANDIDATES, len(targets))
+            routes = [
+                search_nearest_targets(
+                    self.graph, car.pos, targets_at, limit, self.profiler
+                )
+                for car in cars
+            ]
+            candidates = [
+                {passenger: len(route) for passenger, route in car_routes.items()}
+                for car_routes in routes
+            ]
+
+        for car_index, passenger_index in assign_passengers(self.dispatcher, candidates).items():
+            car = cars[car_index]
+            if self.routing:
+                route = self.routing.route(
+                    car.pos, self.routing.nearest(car.pos, targets[passenger_index])
+                )
+            else:
+                route = routes[car_index][passenger_index]
+            self.assignments[car] = (self.waiting_passengers[passenger_index], route)
+
+    def plan_routes(self):
+        """
+        TURN PART 4, first half, only with planning workers
+        Search at once, in the worker processes, the routes that the cars without objective will
+        look for in move_cars. Nothing moves between this stage and the turn of each car, so the
+        searches are the same that the car would make, except for the points whose routes are
+        already cached.
+        :return:
+        """
+        cars = []
+        requests = []
+        for car in self.schedule.stage_agents["move_cars"].values():
+            if car.objective:
+                continue
+            points = [passenger.get_meeting_point() for passenger in car.interest_points()]
+            missing = [
+                index
+                for index, point in enumerate(points)
+                if (car.pos, point) not in self.route_cache
+            ]
+            if missing:
+                cars.append(car.unique_id)
+                requests.append((car.pos, points, missing))
+
+        costs = self.congestion.costs if self.congestion else None
+        self.planned = dict(zip(cars, self.planner.plan(requests, costs)))
+
+    def close(self):
+        """Shut down the planning workers of the model, if any. The model can not step after it."""
+        if self.planner:
+            self.planner.close()
+
+    def resolve_moves(self):
+        """
+        TURN PART 4, second half
+        Resolve the cells requested by the cars in move_cars against the cells occupied at the
+        beginning of the stage, so the result does not depend on the order of the cars, and move
+        the cars that got their cell.
+        :return:
+        """
+        for car, moves in self.reservations.resolve(self.blockers):
+            if moves:
+                car.apply_move()
+            else:
+                car.wait()
 
     def instantiate_agents(self):
         """
@@ -99,7 +355,8 @@ class CarpoolModel(Model):
 
         if not self.passenger_tick:
             while self.passenger_count < self.passenger_limit and inst_pass < self.inst_pass_limit:
-                self.create_agent(Passenger)
+                if not self.create_agent(Passenger):
+                    break
                 self.passenger_count += 1
                 inst_pass += 1
             self.passenger_tick = self.passenger_creation_delay
@@ -107,53 +364,54 @@ class CarpoolModel(Model):
         if not self.car_tick:
             while self.car_count < self.car_limit and inst_car < self.inst_car_limit:
                 car = self.create_agent(Car)
+                if not car:
+                    break
                 self.car_count += 1
-                self.new_cars.append(car)
+                self.new_cars[car.unique_id] = car
                 inst_car += 1
             self.car_tick = self.car_creation_delay
         
     def create_agent(self, agent_class: Union[Type[Passenger], Type[Car]]):
         """
-        Instanciate an agent of the specified class, and add it to the schedule
+        Instanciate an agent of the specified class, and add it to the schedule and to the
+        registry of its class
         :param agent_class: The agent class to be created, either Passenger or Car
-        :return: None
+        :return: The agent, or None if there are no free cells to instantiate it
         """
         lookup_class = Sidewalk if agent_class == Passenger else Road
         start_pos = self.find_rand_cell(lookup_class)
         dest_pos = self.find_rand_cell(lookup_class, start_pos)
+        if start_pos is None or dest_pos is None:
+            return None
+
         a = agent_class(self.next_id(), self, start_pos, dest_pos)
         self.schedule.add(a)
+        if agent_class == Car:
+            self.cars[a.unique_id] = a
+        else:
+            self.passengers.append(a)
         return a
 
     def find_rand_cell(
-        self, lookup_class: Union[Type[Sidewalk], Type[Road]], exclude_cells=None
+        self, lookup_class: Union[Type[Sidewalk], Type[Road]], exclude_cell=None
     ) -> (int, int):
         """
         Obtain a random cell that can be used to instantiate either a Car or a Passenger. In
-        order to do this, there must be exactly one agent of type Sidewalk or Road depending on
-        the objective.
+        order to do this, the cell must be a Sidewalk or Road depending on the objective, without
+        any other agent. The cell is drawn directly from the index of free cells of that type.
         :param lookup_class: The class to be looked for (Sidewalk or Road)
-        :param exclude_cells: The cells that should be excluded for the search.
-        :return: The cell that can be used to instantiate
-        """
-        pos_x, pos_y = None, None
-        found_useful_cell = False
-        if exclude_cells is None:
-            exclude_cells = []
-
-        while not found_useful_cell:
-            pos_x = self.random.randint(0, self.width - 1)
-            pos_y = self.random.randint(0, self.height - 1)
-            cell = self.grid.get_cell_list_contents([(pos_x, pos_y)])
-            if (
-                cell
-                and len(cell) == 1
-                and isinstance(cell[0], lookup_class)
-                and not (pos_x, pos_y) in exclude_cells
-            ):
-                found_useful_cell = True
-
-        return pos_x, pos_y
+        :param exclude_cell: A cell that should be excluded for the search.
+        :return: The cell that can be used to instantiate, or None if there is no free cell
+        """
+        return self.free_cells[lookup_class].sample(self.random, exclude_cell)
+
+    def road_direction(self, pos: (int, int)) -> Optional[str]:
+        """
+        Obtain the direction of a road cell.
+        :return: The name of the direction, or None if the cell is not a road
+        """
+        direction = self.road_directions[pos]
+        return DIRECTION_NAMES[direction] if direction >= 0 else None
 
     def get_cars_data(self):
         """
@@ -161,9 +419,9 @@ class CarpoolModel(Model):
         :return:
         """
         cars_data = []
-        for agent in self.schedule.agents:
-            if isinstance(agent, Car) and agent not in self.new_cars:
-                cars_data.append({"next_direction": agent.real_movement})
+        for car_id, car in self.cars.items():
+            if car_id not in self.new_cars:
+                cars_data.append({"next_direction": car.real_movement})
         return cars_data
 
     def get_traffic_lights_data(self):
@@ -172,14 +430,13 @@ class CarpoolModel(Model):
         :return:
         """
         traffic_data = []
-        for agent in self.schedule.agents:
-            if isinstance(agent, Intersection):
-                for traffic_light in agent.traffic_lights.values():
-                    data = {
-                        "state": traffic_light.status,
-                        "id": traffic_light.id
-                    }
-                    traffic_data.append(data)
+        for intersection in self.intersections:
+            for traffic_light in intersection.traffic_lights.values():
+                data = {
+                    "state": traffic_light.status,
+                    "id": traffic_light.id
+                }
+                traffic_data.append(data)
         return traffic_data
 
     def get_new_car_data(self):
@@ -189,13 +446,13 @@ class CarpoolModel(Model):
         :return:
         """
         new_cars_data = []
-        for car in self.new_cars:
+        for car in self.new_cars.values():
             new_cars_data.append({
                 "x": car.pos[0],
                 "y": 0,
                 "z": car.pos[1]
             })
-        self.new_cars = []
+        self.new_cars = {}
         return new_cars_data
 
     def get_passenger_data(self):
@@ -205,84 +462,50 @@ class CarpoolModel(Model):
         :return:
         """
         passengers = []
-        for agent in self.schedule.agents:
-            if isinstance(agent, Passenger) and not agent.is_traveling:
+        for passenger in self.passengers:
+            if not passenger.is_traveling:
                 passengers.append({
-                    "x": agent.pos[0],
+                    "x": passenger.pos[0],
                     "y": 0,
-                    "z": agent.pos[1],
-                    "arrived": agent.has_arrived
+                    "z": passenger.pos[1],
+                    "arrived": passenger.has_arrived
                 })
         return passengers
 
+    def get_frame(self) -> Frame:
+        """Capture the state of the cars, traffic lights and passengers, see delta"""
+        cars = list(self.cars.values())
+        lights = [
+            light
+            for intersection in self.intersections
+            for light in intersection.traffic_lights.values()
+        ]
+        return Frame(
+            tick=self.schedule.steps,
+            car_ids=np.array([car.unique_id for car in cars], dtype=np.int64),
+            cars=np.array(
+                [(*car.pos, movement_code(car.real_movement)) for car in cars], dtype=np.int32
+            ).reshape(-1, 3),
+            light_ids=[light.id for light in lights],
+            light_status=np.array([light.status for light in lights], dtype=np.int8),
+            passenger_ids=np.array([p.unique_id for p in self.passengers], dtype=np.int64),
+            passengers=np.array(
+                [
+                    (HIDDEN, HIDDEN, TRAVELING) if p.is_traveling else (*p.pos, passenger_state(p))
+                    for p in self.passengers
+                ],
+                dtype=np.int32,
+            ).reshape(-1, 3),
+        )
 
-def parse_environment(environment: list) -> (list, list, list):
-    """
-    This function check on all the board which columns are intersections, and then for each
-    intersection determines which directions are involved in it. Given that the streets are
-    one way only, we have two directions involved in an intersection. After this, it initializes
-    the intersection model and returns a dictionary of the intersection objects. The key is
-    the number of the cell, starting at [0, 0] and counting leftwards and then downwards.
-    :return: The dictionary of intersections.
-    """
-    intersections_data = []
-    road_data = []
-    sidewalk_data = []
-    n_rows = len(environment)
-    n_cols = len(environment[0])
-
-    for row_index in range(n_rows):
-        for col_index in range(n_cols):
-            cell = environment[row_index][col_index]
-            data = {"x": col_index, "y": n_rows - row_index - 1}
-
-            if cell == "IN":
-                directions_to_go, directions_to_stop = find_intersection_directions(
-                    row_index, col_index, environment
-                )
-                data["directions_to_go"] = directions_to_go
-                data["directions_to_stop"] = directions_to_stop
-                intersections_data.append(data)
-
-            elif cell in [direction.name for direction in Directions]:
-                data["direction"] = cell
-                road_data.append(data)
-
-            elif cell == "SW":
-                sidewalk_data.append(data)
-
-    return intersections_data, road_data, sidewalk_data
-
-
-def find_intersection_directions(row: int, col: int, environment: list) -> (list, list):
-    """
-    Function that finds the directions involved in an intersection and returns a list of them
-    :param environment:
-    :param row: The row index of the intersection
-    :param col: The column index of the intersection
-    :return: List of the directions involved in the intersection
-    """
-    possible_directions = [direction.name for direction in RawDirections]
-    directions_to_stop = set()
-    directions_to_go = set()
-
-    for direction_name in possible_directions:
-        displacement = RawDirections[direction_name].value
-        test_row = row + displacement[0]
-        test_col = col + displacement[1]
-
-        try:
-            coming_direction = environment[test_row][test_col]
-            if coming_direction == direction_name:
-                directions_to_go.add(direction_name)
-
-            elif coming_direction in possible_directions:
-                directions_to_stop.add(coming_direction)
-
-        except IndexError:
-            continue
 
-    return list(directions_to_go), list(directions_to_stop)
+def passenger_state(passenger: Passenger) -> int:
+    """Index of the state of a passenger in PASSENGER_STATES"""
+    if passenger.has_arrived:
+        return ARRIVED
+    if passenger.is_traveling:
+        return TRAVELING
+    return WAITING if passenger.is_waiting else NEEDS_RIDE
 
 
 def agent_portrayal(agent):
@@ -315,7 +538,7 @@ def agent_portrayal(agent):
         portrayal["w"] = 0.7
         portrayal["h"] = 0.7
         portrayal["Layer"] = "1"
-        portrayal["text"] = agent.text
+        portrayal["text"] = agent.model.labels.get(agent.pos, "")
         portrayal["text_color"] = "black"
 
     elif isinstance(agent, Road):
@@ -325,7 +548,7 @@ def agent_portrayal(agent):
         portrayal["heading_y"] = Directions[agent.direction].value[1]
         portrayal["Layer"] = "1"
         portrayal["Color"] = "lightgray"
-        portrayal["text"] = agent.text
+        portrayal["text"] = agent.model.labels.get(agent.pos, "")
         portrayal["text_color"] = "black"
 
     elif isinstance(agent, Passenger):
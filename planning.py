@@ -0,0 +1,134 @@
+"""
+Planning of the routes of the cars on worker processes. Before a car commits to an objective in
+move_cars, it searches the routes from its cell to the meeting points of its passengers, which only
+reads the road network, the congestion costs and the position of the car. On large maps, where the
+routing table is not built and every search is a BFS, those searches are most of the tick, so
+with planning workers the model sends the searches of all the cars of a tick to a process pool in
+chunks before the move_cars stage, and each car takes the result of its own search in its turn.
+
+The workers receive a frozen copy of the road graph and the routing table once, when the pool
+starts, and for each tick only the cell of each car, its points and the congestion costs. A car
+still checks the route cache of the model in its turn, exactly as it would without workers, and
+only uses the planned routes for the points that were not cached, so the simulation is the same
+with any number of workers. A few searches are not worth the round trip to the pool, so they run
+in the main process.
+"""
+from __future__ import annotations
+import weakref
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import List, Optional
+
+from routing import RoadGraph, RoutingTable, lookup_routes, search_routes
+
+MIN_PARALLEL_REQUESTS = 16
+CHUNKS_PER_WORKER = 4
+
+# Road graph and routing table of the model, in each worker process
+worker_graph: Optional[RoadGraph] = None
+worker_table: Optional[RoutingTable] = None
+
+
+class PlannedSearch:
+    __slots__ = ("indexes", "routes", "expanded")
+
+    def __init__(self, indexes: frozenset, routes: List[(int, tuple)], expanded: Optional[int]):
+        """
+        Routes to some of the points of a find_routes call, found before the call.
+        :param indexes: Indexes of the points that were searched
+        :param routes: List of tuples (index of the point, directions), in the order that
+        search_routes finds them. Unreachable points have no route.
+        :param expanded: Cells expanded by the search, or None if the routes were looked up in
+        the routing table
+        """
+        self.indexes = indexes
+        self.routes = routes
+        self.expanded = expanded
+
+
+class SearchCounter:
+    """Stands in for the StepProfiler of the model, keeping the cells expanded by a search"""
+
+    def __init__(self):
+        self.expanded = None
+
+    def count_search(self, kind: str, expanded: int):
+        self.expanded = expanded
+
+
+def plan_search(
+    graph: RoadGraph,
+    table: Optional[RoutingTable],
+    source: (int, int),
+    points: List[(int, int)],
+    indexes: List[int],
+    costs: Optional[array] = None,
+) -> PlannedSearch:
+    """
+    Find the routes to some points in the same way as find_routes does for the points that are
+    not in the route cache.
+    :param source: Cell where the routes start
+    :param points: Positions that the routes must reach
+    :param indexes: Indexes of the points to search
+    :param costs: Congestion costs, or None to find the shortest routes
+    """
+    counter = SearchCounter()
+    if costs is not None:
+        routes = search_routes(graph, source, points, indexes, counter, costs)
+    elif table:
+        routes = lookup_routes(graph, table, source, points, indexes)
+    else:
+        routes = search_routes(graph, source, points, indexes, counter)
+    return PlannedSearch(
+        frozenset(indexes), [(index, tuple(route)) for index, route in routes], counter.expanded
+    )
+
+
+def init_worker(graph: RoadGraph, table: Optional[RoutingTable]):
+    global worker_graph, worker_table
+    worker_graph, worker_table = graph, table
+
+
+def plan_chunk(requests: list, costs: Optional[array]) -> List[PlannedSearch]:
+    """Run plan_search for each (source, points, indexes) request, in a worker process"""
+    return [plan_search(worker_graph, worker_table, *request, costs) for request in requests]
+
+
+class RoutePlanner:
+    def __init__(self, graph: RoadGraph, table: Optional[RoutingTable], workers: int):
+        """
+        Pool of worker processes that search the routes of the cars of a model.
+        :param graph: The road graph of the model
+        :param table: The routing table of the model, or None
+        :param workers: Number of worker processes
+        """
+        self.graph = graph
+        self.table = table
+        self.workers = workers
+        self.executor = ProcessPoolExecutor(
+            workers, initializer=init_worker, initargs=(graph, table)
+        )
+        # The pool is shut down when the model is discarded, or with close
+        self.finalizer = weakref.finalize(
+            self, self.executor.shutdown, wait=False, cancel_futures=True
+        )
+
+    def plan(self, requests: list, costs: Optional[array] = None) -> List[PlannedSearch]:
+        """
+        Search the routes of several cars.
+        :param requests: List of tuples (source, points, indexes), as in plan_search
+        :param costs: Congestion costs, or None to find the shortest routes
+        :return: List with the PlannedSearch of each request, in the same order
+        """
+        if len(requests) < MIN_PARALLEL_REQUESTS:
+            return [plan_search(self.graph, self.table, *request, costs) for request in requests]
+
+        size = -(-len(requests) // (self.workers * CHUNKS_PER_WORKER))
+        chunks = [requests[start : start + size] for start in range(0, len(requests), size)]
+        results = self.executor.map(plan_chunk, chunks, repeat(costs))
+        return [planned for chunk in results for planned in chunk]
+
+    def close(self):
+        """Shut down the worker processes"""
+        self.finalizer()
@@ -0,0 +1,128 @@
+"""
+Opt-in profiling of the ticks of the models. When it is enabled, the model records the wall time
+and the number of calls of each section of the tick (the stages, and the work done by the model
+before and after them), and how many breadth first searches the cars run and how many cells they
+expand. When it is disabled the model only checks that its profiler is None.
+"""
+import time
+from collections import defaultdict
+from contextlib import nullcontext
+
+NULL_SECTION = nullcontext()
+
+
+class StepProfiler:
+    def __init__(self):
+        """Create a profiler with all of its counters in zero"""
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.searches = defaultdict(int)
+        self.expanded_cells = defaultdict(int)
+        self.ticks = 0
+
+    def record(self, section: str, seconds: float, calls: int = 1):
+        """
+        Add the time spent in a section of the tick.
+        :param section: Name of the stage or method
+        :param seconds: Wall time
+        :param calls: Number of calls done in that time, e.g. one per agent in a stage
+        """
+        self.seconds[section] += seconds
+        self.calls[section] += calls
+
+    def section(self, name: str, calls: int = 1) -> "Section":
+        """Context manager that records the time spent in its block"""
+        return Section(self, name, calls)
+
+    def count_search(self, kind: str, expanded_cells: int):
+        """
+        Count a breadth first search.
+        :param kind: What the search was used for, e.g. "route" or "nearest_passenger"
+        :param expanded_cells: Number of cells that the search expanded
+        """
+        self.searches[kind] += 1
+        self.expanded_cells[kind] += expanded_cells
+
+    def reset(self):
+        self.__init__()
+
+    def to_dict(self) -> dict:
+        """
+        Obtain the recorded data.
+        :return: Dictionary with the ticks, the time and calls of each section, and the searches
+        and expanded cells of each kind of search
+        """
+        return {
+            "ticks": self.ticks,
+            "sections": {
+                section: {"seconds": self.seconds[section], "calls": self.calls[section]}
+                for section in self.seconds
+            },
+            "searches": {
+                kind: {"count": self.searches[kind], "expanded_cells": self.expanded_cells[kind]}
+                for kind in self.searches
+            },
+        }
+
+
+class Section:
+    def __init__(self, profiler: StepProfiler, name: str, calls: int = 1):
+        self.profiler = profiler
+        self.name = name
+        self.calls = calls
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.record(self.name, time.perf_counter() - self.start, self.calls)
+
+
+def to_prometheus(profile: dict, route_cache=None) -> str:
+    """
+    Format the data of a profiler in the Prometheus text exposition format.
+    :param profile: Dictionary returned by StepProfiler.to_dict
+    :param route_cache: RouteCache of the model, to include its hits and misses
+    :return: Text of the metrics
+    """
+    lines = [
+        "# HELP carpool_ticks_total Ticks executed while profiling",
+        "# TYPE carpool_ticks_total counter",
+        f"carpool_ticks_total {profile['ticks']}",
+        "# HELP carpool_section_seconds_total Wall time spent in each section of the tick",
+        "# TYPE carpool_section_seconds_total counter",
+    ]
+    for section, data in profile["sections"].items():
+        lines.append(f'carpool_section_seconds_total{{section="{section}"}} {data["seconds"]}')
+
+    lines += [
+        "# HELP carpool_section_calls_total Calls of each section of the tick",
+        "# TYPE carpool_section_calls_total counter",
+    ]
+    for section, data in profile["sections"].items():
+        lines.append(f'carpool_section_calls_total{{section="{section}"}} {data["calls"]}')
+
+    lines += [
+        "# HELP carpool_bfs_searches_total Breadth first searches over the road graph",
+        "# TYPE carpool_bfs_searches_total counter",
+    ]
+    for kind, data in profile["searches"].items():
+        lines.append(f'carpool_bfs_searches_total{{kind="{kind}"}} {data["count"]}')
+
+    lines += [
+        "# HELP carpool_bfs_expanded_cells_total Cells expanded by the breadth first searches",
+        "# TYPE carpool_bfs_expanded_cells_total counter",
+    ]
+    for kind, data in profile["searches"].items():
+        lines.append(f'carpool_bfs_expanded_cells_total{{kind="{kind}"}} {data["expanded_cells"]}')
+
+    if route_cache is not None:
+        lines += [
+            "# HELP carpool_route_cache_requests_total Lookups in the route cache",
+            "# TYPE carpool_route_cache_requests_total counter",
+            f'carpool_route_cache_requests_total{{result="hit"}} {route_cache.hits}',
+            f'carpool_route_cache_requests_total{{result="miss"}} {route_cache.misses}',
+        ]
+
+    return "\n".join(lines) + "\n"
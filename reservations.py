@@ -0,0 +1,103 @@
+"""
+Reservations of the cells that the cars move to in a tick. Instead of moving one after another,
+where a car sees the cells left by the cars that moved before it, every car requests the cell it
+wants to move to, and all the requests are resolved at once against the occupancy of the cells at
+the beginning of the tick, so the result does not depend on the order of the cars:
+
+- The car with the lowest priority number (the oldest car) gets a cell that several cars request.
+- A car moves to a cell that is occupied if the car that blocks it moves out in the same tick, so
+  a queue advances as a whole, and a car waits if the car ahead of it waits.
+- Cells that do not need a reservation, such as intersections, can always be entered.
+
+The cars that block a cell are the ones that are not parked at their destination, counted in an
+array of the size of the map like CityMap.
+"""
+from __future__ import annotations
+from typing import List
+
+import numpy as np
+
+
+class ReservationTable:
+    def __init__(self, height: int):
+        """
+        :param height: Height of the map, to number the cells like a (width, height) array
+        """
+        self.height = height
+        self.clear()
+
+    def clear(self):
+        self.agents = []
+        self.priorities = []
+        self.sources = []
+        self.targets = []
+        self.reserved = []
+        self.blocking = []
+
+    def __len__(self):
+        return len(self.agents)
+
+    def request(
+        self,
+        agent,
+        priority: int,
+        source: (int, int),
+        target: (int, int),
+        reserve: bool = True,
+        blocking: bool = True,
+    ):
+        """
+        Register the movement that a car wants to make in this tick.
+        :param agent: The car, returned by resolve
+        :param priority: Number that decides who gets a cell, lower first, e.g. the id of the car
+        :param source: Cell where the car is
+        :param target: Cell where the car wants to move
+        :param reserve: Whether the target must be free or freed, False for intersections
+        :param blocking: Whether the car blocks its source cell, i.e. it is not parked
+        """
+        self.agents.append(agent)
+        self.priorities.append(priority)
+        self.sources.append(source[0] * self.height + source[1])
+        self.targets.append(target[0] * self.height + target[1])
+        self.reserved.append(reserve)
+        self.blocking.append(blocking)
+
+    def resolve(self, blockers: np.ndarray) -> List[(object, bool)]:
+        """
+        Decide which of the requested movements happen, and clear the table.
+        :param blockers: Number of cars that block each cell at the beginning of the tick, with
+        shape (width, height)
+        :return: List of tuples (agent, whether it moves), in the order of the priorities
+        """
+        if not self.agents:
+            return []
+
+        order = np.argsort(self.priorities, kind="stable")
+        agents = [self.agents[index] for index in order]
+        sources = np.array(self.sources, dtype=np.int64)[order]
+        targets = np.array(self.targets, dtype=np.int64)[order]
+        reserved = np.array(self.reserved, dtype=bool)[order]
+        blocking = np.array(self.blocking, dtype=bool)[order]
+        self.clear()
+
+        # Only the first request of each reserved cell gets it
+        requests = np.flatnonzero(reserved)
+        _, first = np.unique(targets[requests], return_index=True)
+        waits = reserved.copy()
+        waits[requests[first]] = False
+
+        # A cell is freed if every car that blocks it requested to leave it
+        leaving = np.sort(sources[blocking])
+        n_leaving = np.searchsorted(leaving, targets, "right") - np.searchsorted(
+            leaving, targets, "left"
+        )
+        waits |= reserved & (blockers.ravel()[targets] > n_leaving)
+
+        # A car can not follow a car that waits, until no more cars have to wait
+        while True:
+            stuck = np.isin(targets, sources[blocking & waits]) & reserved & ~waits
+            if not stuck.any():
+                break
+            waits |= stuck
+
+        return list(zip(agents, (~waits).tolist()))
@@ -0,0 +1,793 @@
+"""
+Routing utilities for the cars. The road network does not change during a simulation, so it is
+compiled once per model into a graph of Road/Intersection cells with flat integer arrays, and into a
+table with the distance and the first direction of a shortest route between every pair of cells.
+Route queries become table lookups instead of a BFS. The routes followed by the cars are views of
+tuples shared through the route cache, so following or repairing a route does not copy it.
+
+With the congestion router, the cost of leaving a cell is its travel time observed in the last
+ticks (see CongestionCosts) instead of a single movement, and the routes are found with Dijkstra's
+algorithm, or A* towards a single cell, over those costs. The table is not used, since it only
+holds the shortest routes.
+"""
+from __future__ import annotations
+import heapq
+from array import array
+from collections import OrderedDict, deque
+from itertools import islice
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from enums import Directions
+
+DIRECTION_NAMES = [direction.name for direction in Directions]
+DISPLACEMENTS = [direction.value for direction in Directions]
+# Distance to a cell that can not be reached, the largest value of the unsigned 32 bit distances
+UNREACHABLE = 0xFFFFFFFF
+# Same in the unsigned 16 bit distances of the routing table, which is only built for maps of up to
+# MAX_TABLE_CELLS cells, so no route is that long
+TABLE_UNREACHABLE = 0xFFFF
+NO_DIRECTION = -1
+NO_CELL = -1
+MAX_TABLE_CELLS = 2048
+ROUTE_CACHE_SIZE = 65536
+SHORTEST = "shortest"
+CONGESTION = "congestion"
+ROUTERS = [SHORTEST, CONGESTION]
+CONGESTION_REFRESH_TICKS = 20
+CONGESTION_SMOOTHING = 0.5
+
+if TYPE_CHECKING:
+    from citymap import CityMap
+    from planning import PlannedSearch
+
+
+def to_array(typecode: str, values: np.ndarray) -> array:
+    """Copy a NumPy array into an array of the standard library, which is faster to index"""
+    result = array(typecode)
+    result.frombytes(values.astype(np.dtype(typecode)).tobytes())
+    return result
+
+
+class RoadGraph:
+    def __init__(self, city: CityMap):
+        """
+        Compile the road network. Every Intersection/Road cell gets an id, in that order, and the
+        outgoing edges of cell i are stored in targets[offsets[i]:offsets[i + 1]], with the index
+        of the direction in Directions at the same position of the directions array. The incoming
+        edges are stored in the same way in the reverse arrays, to search the one-way streets
+        backwards. The arrays are built with vectorized operations over the typed arrays of the
+        map.
+        :param city: The map
+        """
+        self.width = city.width
+        self.height = city.height
+        xs = np.concatenate([city.intersection_xs, city.road_xs]).astype(np.int64)
+        ys = np.concatenate([city.intersection_ys, city.road_ys]).astype(np.int64)
+        self.n_cells = len(xs)
+        cell_ids = np.full(self.width * self.height, NO_CELL, dtype=np.int64)
+        cell_ids[xs * self.height + ys] = np.arange(self.n_cells)
+
+        # Candidate edges: every direction to go of the intersections, in sorted order like
+        # their directions_to_go, and the direction of every road
+        n_intersections = len(city.intersection_xs)
+        sources, directions, ranks = [], [], []
+        for rank, direction in enumerate(sorted(DIRECTION_NAMES)):
+            bit = 1 << rank
+            cells = np.flatnonzero(city.go_masks & bit)
+            sources.append(cells)
+            directions.append(np.full(len(cells), DIRECTION_NAMES.index(direction)))
+            ranks.append(np.full(len(cells), rank))
+        sources.append(np.arange(n_intersections, self.n_cells))
+        directions.append(city.road_directions.astype(np.int64))
+        ranks.append(np.zeros(len(city.road_xs), dtype=np.int64))
+        sources = np.concatenate(sources)
+        directions = np.concatenate(directions)
+        order = np.lexsort((np.concatenate(ranks), sources))
+        sources, directions = sources[order], directions[order]
+
+        displacements = np.array(DISPLACEMENTS, dtype=np.int64)
+        next_xs = xs[sources] + displacements[directions, 0]
+        next_ys = ys[sources] + displacements[directions, 1]
+        inside = (next_xs >= 0) & (next_xs < self.width) & (next_ys >= 0) & (next_ys < self.height)
+        targets = np.full(len(sources), NO_CELL, dtype=np.int64)
+        targets[inside] = cell_ids[next_xs[inside] * self.height + next_ys[inside]]
+        valid = targets != NO_CELL
+        sources, directions, targets = sources[valid], directions[valid], targets[valid]
+
+        offsets = np.zeros(self.n_cells + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=self.n_cells), out=offsets[1:])
+        reverse_offsets = np.zeros(self.n_cells + 1, dtype=np.int64)
+        np.cumsum(np.bincount(targets, minlength=self.n_cells), out=reverse_offsets[1:])
+        reverse_order = np.argsort(targets, kind="stable")
+
+        self.cell_ids = to_array("l", cell_ids)
+        self.xs = to_array("l", xs)
+        self.ys = to_array("l", ys)
+        self.offsets = to_array("l", offsets)
+        self.targets = to_array("l", targets)
+        self.directions = to_array("b", directions)
+        self.reverse_offsets = to_array("l", reverse_offsets)
+        self.reverse_sources = to_array("l", sources[reverse_order])
+        self.reverse_directions = to_array("b", directions[reverse_order])
+
+    def cell_id(self, coords: (int, int)) -> int:
+        """
+        Obtain the id of a cell of the graph.
+        :return: The id, or NO_CELL if the position is not a Road/Intersection cell
+        """
+        x, y = coords
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return self.cell_ids[x * self.height + y]
+        return NO_CELL
+
+    def position(self, cell: int) -> (int, int):
+        """Obtain the (x, y) position of a cell id"""
+        return self.xs[cell], self.ys[cell]
+
+    def successors(self, cell: int) -> Iterator[(int, int)]:
+        """Iterate over the (next cell, direction index) pairs that can be reached from a cell"""
+        for edge in range(self.offsets[cell], self.offsets[cell + 1]):
+            yield self.targets[edge], self.directions[edge]
+
+    def predecessors(self, cell: int) -> Iterator[(int, int)]:
+        """Iterate over the (previous cell, direction index) pairs that lead to a cell"""
+        for edge in range(self.reverse_offsets[cell], self.reverse_offsets[cell + 1]):
+            yield self.reverse_sources[edge], self.reverse_directions[edge]
+
+    def adjacent_cells(self, coords: (int, int)) -> List[int]:
+        """
+        Utility function. Obtain the Road/Intersection cells next to a position, such as the
+        sidewalk of a passenger.
+        :return: List of cell ids adjacent to the position
+        """
+        cells = []
+        for disp in DISPLACEMENTS:
+            cell = self.cell_id((coords[0] + disp[0], coords[1] + disp[1]))
+            if cell != NO_CELL:
+                cells.append(cell)
+
+        return cells
+
+
+class GraphSearch:
+    def __init__(self, graph: RoadGraph, source: int):
+        """
+        Breadth first search over the road graph, that can be stopped at any cell. The route to a
+        visited cell is rebuilt from parent pointers, so it is not copied at every node.
+        :param graph: The road graph
+        :param source: Id of the cell where the search starts
+        """
+        self.graph = graph
+        self.parents = {source: (NO_CELL, NO_DIRECTION)}
+        self.q = deque([source])
+
+    def __iter__(self) -> Iterator[int]:
+        while self.q:
+            cell = self.q.popleft()
+            yield cell
+
+            for next_cell, direction in self.graph.successors(cell):
+                if next_cell not in self.parents:
+                    self.parents[next_cell] = (cell, direction)
+                    self.q.append(next_cell)
+
+    def route(self, cell: int) -> List[str]:
+        """
+        Rebuild the route from the source to a visited cell.
+        :return: List of directions in the route
+        """
+        route = []
+        parent, direction = self.parents[cell]
+        while parent != NO_CELL:
+            route.append(DIRECTION_NAMES[direction])
+            parent, direction = self.parents[parent]
+
+        route.reverse()
+        return route
+
+    @property
+    def expanded(self) -> int:
+        """Number of cells expanded so far: the visited ones that are not in the queue"""
+        return len(self.parents) - len(self.q)
+
+
+class WeightedSearch(GraphSearch):
+    def __init__(
+        self, graph: RoadGraph, costs: array, source: int, target: Optional[(int, int)] = None
+    ):
+        """
+        Dijkstra's algorithm over the road graph with a cost for leaving each cell, that can be
+        stopped at any cell. Cells are yielded in the order of their cost from the source, so the
+        first visited cell of a set of objectives is the cheapest one. With a target, it becomes
+        A* with the Manhattan distance as the heuristic, which never overestimates since every
+        cost is at least one.
+        :param graph: The road graph
+        :param costs: Cost of leaving each cell, of at least 1
+        :param source: Id of the cell where the search starts
+        :param target: Position that guides the search, or None
+        """
+        self.graph = graph
+        self.costs = costs
+        self.target = target
+        self.parents = {source: (NO_CELL, NO_DIRECTION)}
+        self.distances = {source: 0.0}
+        self.settled = set()
+        self.heap = [(self.heuristic(source), source)]
+
+    def heuristic(self, cell: int) -> float:
+        """
+        Lower bound of the cost from a cell to the target.
+        :return: The Manhattan distance to the target, or 0 without a target
+        """
+        if self.target is None:
+            return 0.0
+        x, y = self.graph.position(cell)
+        return abs(x - self.target[0]) + abs(y - self.target[1])
+
+    def __iter__(self) -> Iterator[int]:
+        while self.heap:
+            _, cell = heapq.heappop(self.heap)
+            if cell in self.settled:
+                continue
+            self.settled.add(cell)
+            yield cell
+
+            distance = self.distances[cell] + self.costs[cell]
+            for next_cell, direction in self.graph.successors(cell):
+                if distance < self.distances.get(next_cell, float("inf")):
+                    self.distances[next_cell] = distance
+                    self.parents[next_cell] = (cell, direction)
+                    heapq.heappush(self.heap, (distance + self.heuristic(next_cell), next_cell))
+
+    @property
+    def expanded(self) -> int:
+        return len(self.settled)
+
+
+class CongestionCosts:
+    def __init__(
+        self,
+        graph: RoadGraph,
+        refresh_ticks: int = CONGESTION_REFRESH_TICKS,
+        smoothing: float = CONGESTION_SMOOTHING,
+    ):
+        """
+        Travel time of leaving each cell of the road graph: one tick for the movement, plus the
+        ticks that the cars waited in the cell for a red light or for the car ahead, per car that
+        left it. The waits and departures are only counted as the cars move, and they are folded
+        into the costs once every refresh_ticks as an exponential moving average, so the costs,
+        and the routes found with them, stay fixed between refreshes.
+        :param graph: The road graph
+        :param refresh_ticks: Number of ticks between refreshes
+        :param smoothing: Weight of the last window of ticks in the average
+        """
+        self.graph = graph
+        self.refresh_ticks = refresh_ticks
+        self.smoothing = smoothing
+        self.costs = array("d", [1.0]) * graph.n_cells
+        self.delays = np.zeros(graph.n_cells)
+        self.waits = np.zeros(graph.n_cells, dtype=np.int64)
+        self.departures = np.zeros(graph.n_cells, dtype=np.int64)
+        self.ticks = 0
+        # Number of refreshes, so the cars know whether their route used the current costs
+        self.epoch = 0
+
+    def wait(self, coords: (int, int)):
+        """A car could not leave a cell in this tick"""
+        self.waits[self.graph.cell_id(coords)] += 1
+
+    def depart(self, coords: (int, int)):
+        """A car left a cell"""
+        self.departures[self.graph.cell_id(coords)] += 1
+
+    def tick(self) -> bool:
+        """
+        Count a tick, and refresh the costs if the window is over.
+        :return: Whether the costs changed, so the routes found with the old ones are stale
+        """
+        self.ticks += 1
+        if self.ticks < self.refresh_ticks:
+            return False
+
+        observed = self.waits / np.maximum(self.departures, 1)
+        # Cells without traffic in the window drift back to their free flow cost
+        observed[(self.waits == 0) & (self.departures == 0)] = 0
+        self.delays += self.smoothing * (observed - self.delays)
+        self.costs = to_array("d", 1 + self.delays)
+        self.waits[:] = 0
+        self.departures[:] = 0
+        self.ticks = 0
+        self.epoch += 1
+        return True
+
+
+class NearestTargets:
+    def __init__(self, graph: RoadGraph, targets: List[List[int]]):
+        """
+        Label every cell of the road graph with its nearest target, the distance to it and the
+        first direction of the route, with a single multi-source BFS over the reversed graph.
+        Each target may be reached at several cells, e.g. the cells next to a sidewalk. Distances
+        are stored as unsigned 32 bit integers, since the map may be of any size.
+        :param graph: The road graph
+        :param targets: For each target, the list of cell ids where it is reached
+        """
+        self.graph = graph
+        self.distances = array("I", [UNREACHABLE]) * graph.n_cells
+        self.nearest_targets = array("l", [NO_CELL]) * graph.n_cells
+        self.next_hops = array("b", [NO_DIRECTION]) * graph.n_cells
+
+        q = deque()
+        for target, cells in enumerate(targets):
+            for cell in cells:
+                if self.distances[cell] == UNREACHABLE:
+                    self.distances[cell] = 0
+                    self.nearest_targets[cell] = target
+                    q.append(cell)
+
+        offsets, sources = graph.reverse_offsets, graph.reverse_sources
+        while q:
+            cell = q.popleft()
+            distance = self.distances[cell] + 1
+            for edge in range(offsets[cell], offsets[cell + 1]):
+                prev_cell = sources[edge]
+                if self.distances[prev_cell] == UNREACHABLE:
+                    self.distances[prev_cell] = distance
+                    self.nearest_targets[prev_cell] = self.nearest_targets[cell]
+                    self.next_hops[prev_cell] = graph.reverse_directions[edge]
+                    q.append(prev_cell)
+
+    def nearest(self, coords: (int, int)) -> Optional[int]:
+        """
+        Obtain the nearest target to a position.
+        :return: The index of the target, or None if no target can be reached
+        """
+        cell = self.graph.cell_id(coords)
+        if cell == NO_CELL or self.nearest_targets[cell] == NO_CELL:
+            return None
+
+        return self.nearest_targets[cell]
+
+    @property
+    def expanded(self) -> int:
+        """Number of cells expanded by the search, i.e. the cells that reach a target"""
+        return self.graph.n_cells - self.distances.count(UNREACHABLE)
+
+    def distance(self, coords: (int, int)) -> int:
+        """
+        Obtain the distance from a position to its nearest target.
+        :return: The distance, or UNREACHABLE if no target can be reached
+        """
+        cell = self.graph.cell_id(coords)
+        return UNREACHABLE if cell == NO_CELL else self.distances[cell]
+
+    def route(self, coords: (int, int)) -> List[str]:
+        """
+        Rebuild the route from a position to its nearest target by following the next hops.
+        :return: List of directions in the route
+        """
+        route = []
+        cell = self.graph.cell_id(coords)
+        while self.distances[cell]:
+            hop = self.next_hops[cell]
+            disp = DISPLACEMENTS[hop]
+            x, y = self.graph.position(cell)
+            cell = self.graph.cell_id((x + disp[0], y + disp[1]))
+            route.append(DIRECTION_NAMES[hop])
+
+        return route
+
+
+def index_targets(targets: List[List[int]]) -> Dict[int, List[int]]:
+    """
+    Invert the cells of a set of targets, for search_nearest_targets.
+    :param targets: For each target, the list of cell ids where it is reached
+    :return: Dictionary that maps each cell id to the indexes of the targets reached there
+    """
+    targets_at = {}
+    for target, cells in enumerate(targets):
+        for cell in cells:
+            targets_at.setdefault(cell, []).append(target)
+    return targets_at
+
+
+def search_nearest_targets(
+    graph: RoadGraph,
+    source: (int, int),
+    targets_at: Dict[int, List[int]],
+    limit: int,
+    profiler=None,
+) -> Dict[int, List[str]]:
+    """
+    Find the routes from a cell to its nearest targets, with a BFS that stops as soon as it has
+    reached the given number of targets, instead of labeling the whole graph like NearestTargets.
+    :param graph: The road graph
+    :param source: Cell where the routes start
+    :param targets_at: Indexes of the targets reached at each cell id
+    :param limit: Number of targets to find
+    :param profiler: StepProfiler that counts the search, or None
+    :return: Dictionary that maps the index of each target found to its route, from the nearest
+    """
+    routes = {}
+    search = GraphSearch(graph, graph.cell_id(source))
+    for cell in search:
+        for target in targets_at.get(cell, ()):
+            if target not in routes:
+                routes[target] = search.route(cell)
+        if len(routes) >= limit:
+            break
+
+    if profiler:
+        profiler.count_search("nearest_passenger", search.expanded)
+    return routes
+
+
+class RoutingTable:
+    def __init__(self, graph: RoadGraph):
+        """
+        Compile the all-pairs routing table of the road graph. Distances are stored as unsigned
+        16 bit integers and next hops as the index of the direction in Directions, both in flat
+        arrays of size cells * cells.
+        :param graph: The road graph
+        """
+        self.graph = graph
+        self.n_cells = graph.n_cells
+        self.distances = array("H", [TABLE_UNREACHABLE]) * (self.n_cells * self.n_cells)
+        self.next_hops = array("b", [NO_DIRECTION]) * (self.n_cells * self.n_cells)
+        for source in range(self.n_cells):
+            self.fill_row(source)
+
+    def fill_row(self, source: int):
+        """
+        Run a BFS from the source cell and store the distance and the first direction of the
+        route to every other cell in the row of the source.
+        :param source: Id of the source cell
+        """
+        offsets, targets, directions = self.graph.offsets, self.graph.targets, self.graph.directions
+        row = source * self.n_cells
+        self.distances[row + source] = 0
+        q = deque([source])
+        while q:
+            cell = q.popleft()
+            distance = self.distances[row + cell] + 1
+            first_hop = self.next_hops[row + cell]
+            for edge in range(offsets[cell], offsets[cell + 1]):
+                next_cell = targets[edge]
+                if self.distances[row + next_cell] == TABLE_UNREACHABLE:
+                    self.distances[row + next_cell] = distance
+                    self.next_hops[row + next_cell] = (
+                        directions[edge] if cell == source else first_hop
+                    )
+                    q.append(next_cell)
+
+    def distance(self, source: (int, int), target: (int, int)) -> Optional[int]:
+        """
+        Obtain the number of movements of the shortest route between two cells.
+        :return: The distance, or None if the target can not be reached
+        """
+        source_id, target_id = self.graph.cell_id(source), self.graph.cell_id(target)
+        if source_id == NO_CELL or target_id == NO_CELL:
+            return None
+
+        distance = self.distances[source_id * self.n_cells + target_id]
+        return None if distance == TABLE_UNREACHABLE else distance
+
+    def route(self, source: (int, int), target: (int, int)) -> Optional[List[str]]:
+        """
+        Rebuild the shortest route between two cells by following the next hops of the table.
+        :return: List of directions in the route, or None if the target can not be reached
+        """
+        if self.distance(source, target) is None:
+            return None
+
+        route = []
+        cell, target_id = self.graph.cell_id(source), self.graph.cell_id(target)
+        while cell != target_id:
+            hop = self.next_hops[cell * self.n_cells + target_id]
+            disp = DISPLACEMENTS[hop]
+            x, y = self.graph.position(cell)
+            cell = self.graph.cell_id((x + disp[0], y + disp[1]))
+            route.append(DIRECTION_NAMES[hop])
+
+        return route
+
+    def nearest(self, source: (int, int), targets: List[int]) -> Optional[(int, int)]:
+        """
+        Obtain the target cell that is nearest to the source cell.
+        :param targets: List of cell ids
+        :return: The position of the nearest target, or None if none of them can be reached
+        """
+        source_id = self.graph.cell_id(source)
+        if source_id == NO_CELL:
+            return None
+
+        row = source_id * self.n_cells
+        nearest_target, nearest_distance = NO_CELL, TABLE_UNREACHABLE
+        for target in targets:
+            distance = self.distances[row + target]
+            if distance < nearest_distance:
+                nearest_target, nearest_distance = target, distance
+
+        return None if nearest_target == NO_CELL else self.graph.position(nearest_target)
+
+    def nearest_distance(self, source: (int, int), targets: List[int]) -> int:
+        """
+        Obtain the distance from the source cell to the nearest of the target cells.
+        :param targets: List of cell ids
+        :return: The distance, or UNREACHABLE if none of them can be reached
+        """
+        source_id = self.graph.cell_id(source)
+        if source_id == NO_CELL:
+            return UNREACHABLE
+
+        row = source_id * self.n_cells
+        distance = min(
+            (self.distances[row + target] for target in targets), default=TABLE_UNREACHABLE
+        )
+        return UNREACHABLE if distance == TABLE_UNREACHABLE else distance
+
+
+class Route:
+    __slots__ = ("path", "start")
+
+    def __init__(self, path: tuple = (), start: int = 0):
+        """
+        Directions that a car has left to follow: the suffix of a path from a position. The path is
+        shared with the route cache and the other cars on it, and is never modified, so the car
+        moves along it by advancing the start, and a blocked car simply does not advance.
+        :param path: Tuple of directions, e.g. ("UP", "UP", "LF")
+        :param start: Index of the next direction in the path
+        """
+        self.path = path
+        self.start = start
+
+    def __len__(self):
+        return len(self.path) - self.start
+
+    def __bool__(self):
+        return self.start < len(self.path)
+
+    def __iter__(self) -> Iterator[str]:
+        return islice(self.path, self.start, None)
+
+    def next_direction(self) -> str:
+        return self.path[self.start]
+
+    def advance(self):
+        """Consume the next direction, once the car moved in it"""
+        self.start += 1
+
+
+class RouteCache:
+    def __init__(self, max_size: int = ROUTE_CACHE_SIZE):
+        """
+        LRU cache of routes keyed by (source cell, target cell). A route is stored once as a tuple,
+        and every cell along it points to its suffix, so other cars that are already on the way
+        to the same target, or that repair their route towards it from any cell along it, reuse
+        it without copying.
+        :param max_size: Maximum number of (source, target) entries
+        """
+        self.max_size = max_size
+        self.routes = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key: ((int, int), (int, int))) -> bool:
+        """Whether the route of a (source, target) key is cached, without counting a hit or miss"""
+        return key in self.routes
+
+    def get(self, source: (int, int), target: (int, int)) -> Optional[Route]:
+        """
+        Obtain a cached route.
+        :return: A new Route over the shared path, or None if it is not cached
+        """
+        entry = self.routes.get((source, target))
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.routes.move_to_end((source, target))
+        return Route(*entry)
+
+    def put(self, source: (int, int), target: (int, int), route: Sequence[str]) -> Route:
+        """
+        Store a route, along with all of its suffixes.
+        :param source: Cell where the route starts
+        :param target: Cell the route leads to
+        :param route: Directions in the route
+        :return: A Route over the stored path
+        """
+        route = tuple(route)
+        curr_tile = source
+        for start, direction in enumerate(route):
+            self.store((curr_tile, target), (route, start))
+            disp = Directions[direction].value
+            curr_tile = curr_tile[0] + disp[0], curr_tile[1] + disp[1]
+        self.store((curr_tile, target), (route, len(route)))
+        return Route(route)
+
+    def store(self, key: ((int, int), (int, int)), entry: (tuple, int)):
+        """Insert an entry as the most recently used, and evict the least recently used ones"""
+        self.routes[key] = entry
+        self.routes.move_to_end(key)
+        while len(self.routes) > self.max_size:
+            self.routes.popitem(last=False)
+
+    def clear(self):
+        """Invalidate all of the routes, e.g. when the cost of the road network changes"""
+        self.routes.clear()
+
+
+def build_routing_table(graph: RoadGraph) -> Optional[RoutingTable]:
+    """
+    Build the routing table of the road graph, as long as it fits in the cell limit. Larger maps
+    return None, and the cars fall back to searching the graph.
+    :return: The routing table or None
+    """
+    if graph.n_cells > MAX_TABLE_CELLS:
+        return None
+
+    return RoutingTable(graph)
+
+
+def find_routes(
+    graph: RoadGraph,
+    table: Optional[RoutingTable],
+    cache: RouteCache,
+    source: (int, int),
+    points: List[(int, int)],
+    profiler=None,
+    congestion: Optional[CongestionCosts] = None,
+    planned: Optional[PlannedSearch] = None,
+) -> List[(int, Route)]:
+    """
+    Find the optimal routes from the source to the cells next to each of the points. The routes
+    that were already found are reused from the cache, and the rest are looked up in the routing
+    table, or found by a single BFS if the map is too large for the table, and stored in the
+    cache.
+    :param graph: The road graph
+    :param table: The routing table, or None
+    :param cache: The route cache
+    :param source: Cell where the routes start
+    :param points: Positions that the routes must reach, such as sidewalks
+    :param profiler: StepProfiler that counts the searches, or None
+    :param congestion: Costs of the congestion router, to find the fastest routes instead of the
+    shortest ones, or None
+    :param planned: Routes searched in advance by a RoutePlanner, used instead of searching them
+    again if they include every point that is not cached
+    :return: List of tuples (index of the point, Route)
+    """
+    routes = []
+    missing = []
+    for index, point in enumerate(points):
+        route = cache.get(source, point)
+        if route is None:
+            missing.append(index)
+        else:
+            routes.append((index, route))
+
+    if missing:
+        if planned is not None and planned.indexes.issuperset(missing):
+            if profiler and planned.expanded is not None:
+                profiler.count_search("route", planned.expanded)
+            found_routes = [(index, route) for index, route in planned.routes if index in missing]
+        elif congestion:
+            found_routes = search_routes(
+                graph, source, points, missing, profiler, congestion.costs
+            )
+        elif table:
+            found_routes = lookup_routes(graph, table, source, points, missing)
+        else:
+            found_routes = search_routes(graph, source, points, missing, profiler)
+
+        found_routes = [
+            (index, cache.put(source, points[index], route)) for index, route in found_routes
+        ]
+        # Keep the order of the points, so the result does not depend on the state of the cache
+        routes = sorted(routes + found_routes, key=lambda item: item[0])
+
+    return routes
+
+
+def search_routes(
+    graph: RoadGraph,
+    source: (int, int),
+    points: List[(int, int)],
+    indexes: List[int],
+    profiler=None,
+    costs: Optional[array] = None,
+) -> List[(int, List[str])]:
+    """
+    Find the optimal routes to the cells next to a set of points by using a BFS, or Dijkstra's
+    algorithm over the congestion costs. Note that a single search is used to find all the
+    objectives, reducing the complexity.
+    :param costs: Cost of leaving each cell (see CongestionCosts), or None to use a BFS
+    :return: List of tuples (index of the point, ["UP", "DW", "LF"])
+    """
+    routes = []
+    indexes = list(indexes)
+    if costs is not None:
+        search = WeightedSearch(graph, costs, graph.cell_id(source))
+    else:
+        search = GraphSearch(graph, graph.cell_id(source))
+    for cell in search:
+        curr_tile = graph.position(cell)
+
+        for index in list(indexes):
+            for disp in DISPLACEMENTS:
+                trial_cell = curr_tile[0] + disp[0], curr_tile[1] + disp[1]
+
+                if trial_cell == points[index]:
+                    routes.append((index, search.route(cell)))
+                    indexes.remove(index)
+                    break
+
+        if not indexes:
+            break
+
+    if profiler:
+        profiler.count_search("route", search.expanded)
+    return routes
+
+
+def lookup_routes(
+    graph: RoadGraph,
+    table: RoutingTable,
+    source: (int, int),
+    points: List[(int, int)],
+    indexes: List[int],
+) -> List[(int, List[str])]:
+    """
+    Same as search_routes, but the distances and routes to the cells next to each point are
+    looked up in the routing table.
+    :return: List of tuples (index of the point, ["UP", "DW", "LF"])
+    """
+    routes = []
+    for index in indexes:
+        nearest_cell = table.nearest(source, graph.adjacent_cells(points[index]))
+        if nearest_cell:
+            routes.append((index, table.route(source, nearest_cell)))
+
+    return routes
+
+
+def find_route(
+    graph: RoadGraph,
+    table: Optional[RoutingTable],
+    cache: RouteCache,
+    source: (int, int),
+    target: (int, int),
+    profiler=None,
+    congestion: Optional[CongestionCosts] = None,
+) -> Optional[Route]:
+    """
+    Find the optimal route between two cells, reusing it from the cache when it was already
+    found. With the congestion costs, the route is found with A*.
+    :return: The route, or None if the target can not be reached
+    """
+    route = cache.get(source, target)
+    if route is not None:
+        return route
+
+    if table and not congestion:
+        route = table.route(source, target)
+
+    else:
+        target_id = graph.cell_id(target)
+        if congestion:
+            search = WeightedSearch(graph, congestion.costs, graph.cell_id(source), target)
+        else:
+            search = GraphSearch(graph, graph.cell_id(source))
+        for cell in search:
+            if cell == target_id:
+                route = search.route(cell)
+                break
+
+        if profiler:
+            profiler.count_search("route", search.expanded)
+
+    if route is not None:
+        route = cache.put(source, target, route)
+    return route
@@ -0,0 +1,110 @@
+"""
+Configuration and models of the sessions, shared by the Flask server (server) and its
+asynchronous variant (async_server), which read the same environment variables: the engine, the
+map, profiling, snapshots, planning workers, the size of the session pool and the port. See server
+for their meaning.
+"""
+import os
+import re
+from typing import Optional
+
+from citymap import load_map
+from engine import ArrayCarpoolModel
+from environment import ENVIRONMENT
+from model import CarpoolModel
+from snapshot import load_snapshot, save_snapshot
+
+ENGINES = {"mesa": CarpoolModel, "array": ArrayCarpoolModel}
+Engine = ENGINES[os.getenv("CARPOOL_ENGINE", "mesa")]
+PROFILE = os.getenv("CARPOOL_PROFILE") == "1"
+CITY = load_map(os.environ["CARPOOL_MAP"]) if os.getenv("CARPOOL_MAP") else ENVIRONMENT
+SNAPSHOT = os.getenv("CARPOOL_SNAPSHOT")
+SNAPSHOT_EVERY = int(os.getenv("CARPOOL_SNAPSHOT_EVERY", 0))
+PLANNING_WORKERS = int(os.getenv("CARPOOL_PLANNING_WORKERS", 0))
+MAX_SESSIONS = int(os.getenv("CARPOOL_MAX_SESSIONS", 64))
+SESSION_TTL = float(os.getenv("CARPOOL_SESSION_TTL", 600))
+port = int(os.getenv("PORT", 8585))
+DEFAULT_SESSION = "default"
+SESSION_ID = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+# Parameters of the model of a new session, and of the /prueba1 to /prueba3 routes
+SCENARIOS = {
+    DEFAULT_SESSION: dict(
+        passenger_limit=0,
+        passenger_inst_limit=10,
+        passenger_delay=1,
+        car_limit=100,
+        car_inst_limit=25,
+        car_delay=2,
+    ),
+    "prueba1": dict(
+        passenger_limit=0,
+        passenger_inst_limit=0,
+        passenger_delay=1,
+        car_limit=100,
+        car_inst_limit=25,
+        car_delay=2,
+    ),
+    "prueba2": dict(
+        passenger_limit=10,
+        passenger_inst_limit=10,
+        passenger_delay=1,
+        car_limit=5,
+        car_inst_limit=5,
+        car_delay=2,
+    ),
+    "prueba3": dict(
+        passenger_limit=85,
+        passenger_inst_limit=86,
+        passenger_delay=1,
+        car_limit=15,
+        car_inst_limit=16,
+        car_delay=2,
+    ),
+}
+
+
+def create_model(scenario: str):
+    return Engine(
+        environment=CITY,
+        profile=PROFILE,
+        planning_workers=PLANNING_WORKERS,
+        **SCENARIOS[scenario],
+    )
+
+
+def snapshot_path(session_id: str) -> Optional[str]:
+    """Path of the snapshot file of a session, or None if snapshots are disabled"""
+    if not SNAPSHOT or Engine is not CarpoolModel:
+        return None
+
+    if session_id == DEFAULT_SESSION:
+        return SNAPSHOT
+    root, extension = os.path.splitext(SNAPSHOT)
+    return f"{root}.{session_id}{extension}"
+
+
+def start_session(session_id: str):
+    """Create the model of a new session, from its snapshot file if it exists"""
+    path = snapshot_path(session_id)
+    if path and os.path.exists(path):
+        model = load_snapshot(path, PLANNING_WORKERS)
+        if PROFILE:
+            model.enable_profiling()
+        return model
+
+    return create_model(DEFAULT_SESSION)
+
+
+def close_model(model):
+    """Shut down the planning workers of a model that is discarded"""
+    model.close()
+
+
+def step_model(session):
+    """Advance the model of a session, and save its snapshot if it is time to"""
+    model = session.model
+    model.step()
+    path = snapshot_path(session.id)
+    if path and SNAPSHOT_EVERY and model.schedule.steps % SNAPSHOT_EVERY == 0:
+        save_snapshot(model, path)
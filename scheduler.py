@@ -0,0 +1,58 @@
+"""
+Scheduler of the model. It works like the StagedActivation of Mesa, but each stage is only
+dispatched to the agents that implement it, so the passive agents do not cost any call per tick.
+Stages that work on all the agents at once, like the resolution of the movements of the cars, are
+implemented by the model and run once per tick in their place of the stage list.
+"""
+from mesa import Agent, Model
+from mesa.time import StagedActivation
+
+from profiling import NULL_SECTION
+
+
+class StageDispatcher(StagedActivation):
+    def __init__(self, model: Model, stage_list: list, model_stages: tuple = ()):
+        """
+        Create an empty schedule. Agents are activated in the order they were added, and they must
+        list the stages they implement in their stages attribute.
+        :param model: Model object associated with the schedule
+        :param stage_list: List of the names of the stages to run, in order
+        :param model_stages: Names of the stages of the list that are methods of the model
+        """
+        super().__init__(model, stage_list)
+        self.model_stages = set(model_stages)
+        self.stage_agents = {stage: {} for stage in self.stage_list}
+
+    def add(self, agent: Agent):
+        """Add an agent to the schedule, and to each of the stages it implements"""
+        super().add(agent)
+        for stage in agent.stages:
+            self.stage_agents[stage][agent.unique_id] = agent
+
+    def remove(self, agent: Agent):
+        """Remove an agent from the schedule and from its stages"""
+        super().remove(agent)
+        for stage in agent.stages:
+            del self.stage_agents[stage][agent.unique_id]
+
+    def step(self):
+        """
+        Execute all the stages, each one only for the agents that implement it. If the model has a
+        profiler, the time of each stage is recorded with one call per agent.
+        """
+        profiler = getattr(self.model, "profiler", None)
+        stage_agents = {stage: list(agents.values()) for stage, agents in self.stage_agents.items()}
+        for stage in self.stage_list:
+            if stage in self.model_stages:
+                with profiler.section(stage) if profiler else NULL_SECTION:
+                    getattr(self.model, stage)()
+                self.time += self.stage_time
+                continue
+
+            agents = stage_agents[stage]
+            with profiler.section(stage, len(agents)) if profiler else NULL_SECTION:
+                for agent in agents:
+                    getattr(agent, stage)()
+            self.time += self.stage_time
+
+        self.steps += 1
@@ -1,99 +1,203 @@
 """
 Simulation that uses a Flask server. It sends the state of the vehicles, passengers, and traffic
 lights at every tick of the system via an HTTP response-request. Designed to interact with the 3D
-Unity visualization of the model.
+Unity visualization of the model. Set CARPOOL_ENGINE=array to serve the array backed engine instead
+of the Mesa agent engine, and CARPOOL_PROFILE=1 to expose the time of each stage of the tick in
+the /metrics endpoint. CARPOOL_MAP can be set to the path of a binary map file (see citymap) to
+use it instead of ENVIRONMENT, and CARPOOL_PLANNING_WORKERS to the number of processes that plan
+the routes of the cars of each model (see planning), which only pays off on large maps.
+
+Every client has its own model, identified by the session query parameter or the X-Session-Id
+header of its requests (the default session when it sends none), so several visualizations can
+be served at the same time. The models are kept in a SessionPool of CARPOOL_MAX_SESSIONS sessions,
+and the sessions that are not used in CARPOOL_SESSION_TTL seconds are evicted.
+
+With CARPOOL_SNAPSHOT set to a path, the Mesa agent engine starts each session from its snapshot
+file if it exists (see snapshot), the model of a session is saved with a POST to /snapshot, and
+also every CARPOOL_SNAPSHOT_EVERY ticks if that variable is set, so a restart of the server
+continues the simulations from the last saved tick. The default session uses the path itself,
+and the other sessions add their id before the extension.
+
+The /tick endpoint advances the model and returns everything the client needs to draw the tick in
+a single response: the changes since the tick sent in the ack query parameter (see delta), or the
+whole state if the client sends no ack or the tick is too old. With format=binary the delta is
+encoded in the compact binary format instead of JSON.
+
+In streaming mode, /stream advances the model of the session on its own thread at the rate given
+by the rate query parameter (CARPOOL_STREAM_RATE ticks per second by default), and pushes the delta
+of every tick as server-sent events in the JSON format of /tick. A client that reads slowly gets
+one delta for all the ticks it missed. The loop stops when its last client disconnects, and the
+other routes keep working, e.g. to restart the model with /prueba1.
 """
 import json
 import os
 
-from flask import Flask, jsonify
+from flask import Flask, Response, abort, jsonify, request
+
+from delta import FrameHistory
+from profiling import to_prometheus
+from scenarios import (
+    DEFAULT_SESSION,
+    MAX_SESSIONS,
+    SESSION_ID,
+    SESSION_TTL,
+    close_model,
+    create_model,
+    port,
+    snapshot_path,
+    start_session,
+    step_model,
+)
+from sessions import PoolFullError, SessionPool
+from snapshot import save_snapshot
+from streaming import LoopError, start_loop
 
-from model import CarpoolModel
-from environment import ENVIRONMENT
+STREAM_RATE = float(os.getenv("CARPOOL_STREAM_RATE", 10))
+MAX_STREAM_RATE = 100
 
 app = Flask(__name__, static_url_path="")
-model = CarpoolModel(
-    environment=ENVIRONMENT,
-    passenger_limit=0,
-    passenger_inst_limit=10,
-    passenger_delay=1,
-    car_limit=100,
-    car_inst_limit=25,
-    car_delay=2,
+pool = SessionPool(
+    start_session, max_sessions=MAX_SESSIONS, idle_seconds=SESSION_TTL, close=close_model
 )
-port = int(os.getenv("PORT", 8585))
+
+
+def session_id() -> str:
+    """Id of the session of the current request"""
+    session = request.args.get("session") or request.headers.get("X-Session-Id", DEFAULT_SESSION)
+    if not SESSION_ID.fullmatch(session):
+        abort(400, "The session id must have 1 to 64 letters, digits, dashes or underscores")
+    return session
+
+
+@app.errorhandler(PoolFullError)
+def pool_full(error):
+    return jsonify([{"message": str(error)}]), 503
+
+
+def start_scenario(scenario: str, message: str):
+    with pool.use(session_id(), create=False) as session:
+        session.reset(create_model(scenario))
+    return jsonify([{"message": message}])
 
 
 @app.route("/prueba1")
 def prueba_uno():
-    global model
-    model = CarpoolModel(
-        environment=ENVIRONMENT,
-        passenger_limit=0,
-        passenger_inst_limit=0,
-        passenger_delay=1,
-        car_limit=100,
-        car_inst_limit=25,
-        car_delay=2,
-    )
-    return jsonify([{"message": "Prueba 1"}])
+    return start_scenario("prueba1", "Prueba 1")
 
 
 @app.route("/prueba2")
 def prueba_dos():
-    global model
-    model = CarpoolModel(
-        environment=ENVIRONMENT,
-        passenger_limit=10,
-        passenger_inst_limit=10,
-        passenger_delay=1,
-        car_limit=5,
-        car_inst_limit=5,
-        car_delay=2,
-    )
-    return jsonify([{"message": "Prueba 2"}])
+    return start_scenario("prueba2", "Prueba 2")
 
 
 @app.route("/prueba3")
 def prueba_tres():
-    global model
-    model = CarpoolModel(
-        environment=ENVIRONMENT,
-        passenger_limit=85,
-        passenger_inst_limit=86,
-        passenger_delay=1,
-        car_limit=15,
-        car_inst_limit=16,
-        car_delay=2,
-    )
-    return jsonify([{"message": "Prueba 3"}])
+    return start_scenario("prueba3", "Prueba 3")
 
 
 @app.route("/new_cars", methods=["GET"])
 def new_cars():
-    model.instantiate_agents()
-    cars_data = model.get_new_car_data()
+    with pool.use(session_id()) as session:
+        session.model.instantiate_agents()
+        cars_data = session.model.get_new_car_data()
     return json.dumps(cars_data)
 
 
 @app.route("/traffic_lights", methods=["GET"])
 def traffic_lights():
-    traffic_data = model.get_traffic_lights_data()
+    with pool.use(session_id()) as session:
+        traffic_data = session.model.get_traffic_lights_data()
     return json.dumps(traffic_data)
 
 
 @app.route("/directions", methods=["GET"])
 def direction():
-    model.step()
-    direction_data = model.get_cars_data()
+    with pool.use(session_id()) as session:
+        step_model(session)
+        direction_data = session.model.get_cars_data()
     return json.dumps(direction_data)
 
 
+@app.route("/tick", methods=["GET"])
+def tick():
+    acknowledged = request.args.get("ack", type=int)
+    with pool.use(session_id()) as session:
+        step_model(session)
+        # The new cars are sent in the delta, so they are not kept for /new_cars
+        session.model.get_new_car_data()
+        frames = session.state.setdefault("frames", FrameHistory())
+        frames.add(session.model.get_frame())
+        delta = frames.delta(acknowledged)
+
+    if request.args.get("format") == "binary":
+        return Response(delta.to_bytes(), mimetype="application/octet-stream")
+    text = json.dumps(delta.to_dict(), separators=(",", ":"))
+    return Response(text, mimetype="application/json")
+
+
 @app.route("/passengers", methods=["GET"])
 def passengers():
-    passenger_data = model.get_passenger_data()
+    with pool.use(session_id()) as session:
+        passenger_data = session.model.get_passenger_data()
     return json.dumps(passenger_data)
 
 
+@app.route("/stream", methods=["GET"])
+def stream():
+    rate = request.args.get("rate", STREAM_RATE, type=float)
+    if not 0 < rate <= MAX_STREAM_RATE:
+        abort(400, f"The rate must be between 0 and {MAX_STREAM_RATE} ticks per second")
+    loop = start_loop(pool, session_id(), rate, step_model)
+
+    def events():
+        try:
+            for delta in loop.deltas():
+                if delta is None:
+                    yield ": keepalive\n\n"
+                    continue
+                data = json.dumps(delta.to_dict(), separators=(",", ":"))
+                yield f"id: {delta.frame.tick}\nevent: tick\ndata: {data}\n\n"
+        except LoopError as error:
+            # The last event, a new request to /stream starts a new loop
+            yield f"event: error\ndata: {json.dumps({'message': str(error)})}\n\n"
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    response = Response(events(), mimetype="text/event-stream", headers=headers)
+    # Called when the client disconnects, even before the first event
+    response.call_on_close(loop.unsubscribe)
+    return response
+
+
+@app.route("/snapshot", methods=["POST"])
+def snapshot():
+    with pool.use(session_id()) as session:
+        path = snapshot_path(session.id)
+        if not path:
+            message = "Snapshots require CARPOOL_SNAPSHOT and the mesa engine"
+            return jsonify([{"message": message}]), 400
+        save_snapshot(session.model, path)
+        steps = session.model.schedule.steps
+    return jsonify([{"message": f"Saved tick {steps} in {path}"}])
+
+
+@app.route("/session", methods=["DELETE"])
+def close_session():
+    if not pool.remove(session_id()):
+        return jsonify([{"message": "Unknown session"}]), 404
+    return jsonify([{"message": "Session closed"}])
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    with pool.use(session_id()) as session:
+        profile = session.model.get_profile()
+        route_cache = session.model.route_cache
+    if profile is None:
+        text = "# Profiling is disabled, set CARPOOL_PROFILE=1 to enable it\n"
+    else:
+        text = to_prometheus(profile, route_cache)
+    return Response(text, mimetype="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=port, debug=True)
+    app.run(host="0.0.0.0", port=port, debug=os.getenv("FLASK_DEBUG") == "1", threaded=True)
@@ -0,0 +1,147 @@
+"""
+Pool of models of the Flask server, one per session of a client, so that several visualizations
+can be served by the same process without sharing their simulation. Every session has its own
+lock, held while a request uses its model, and the pool only locks itself to look up, create or
+evict sessions, never while a model is being created or stepped. The pool is bounded: sessions
+that have not been used for a while are evicted, and when it is full the least recently used
+session that is not in use makes room for the new one. The models that are discarded, evicted or
+replaced are closed with the close function of the pool, if any.
+"""
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+
+class PoolFullError(Exception):
+    """Every session of the pool is in use, so a new session can not be created"""
+
+
+class Session:
+    def __init__(self, session_id: str, close: Optional[Callable] = None):
+        """
+        Session of a client. Its model is created the first time it is used.
+        :param session_id: Id sent by the client
+        :param close: Function called with each model of the session that is discarded
+        """
+        self.id = session_id
+        self.close_model = close
+        self.model = None
+        # Data that the server keeps along with the model, e.g. the frames sent to the client
+        self.state = {}
+        # TickLoop that advances the model in streaming mode, see streaming
+        self.loop = None
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+        self.users = 0
+
+    def reset(self, model):
+        """Replace the model of the session, discarding the data kept along with the old one"""
+        self.close()
+        self.model = model
+        self.state = {}
+
+    def close(self):
+        """Close the model of the session, if any"""
+        if self.close_model and self.model is not None:
+            self.close_model(self.model)
+        self.model = None
+
+
+class SessionPool:
+    def __init__(
+        self,
+        factory: Callable,
+        max_sessions: int = 64,
+        idle_seconds: float = 600,
+        close: Optional[Callable] = None,
+    ):
+        """
+        :param factory: Function that creates the model of a new session, given the session id
+        :param max_sessions: Maximum number of sessions kept at the same time
+        :param idle_seconds: Time after which a session that is not used is evicted
+        :param close: Function called with each model that is replaced, or whose session is
+        evicted or removed, e.g. to release its resources
+        """
+        self.factory = factory
+        self.close = close
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        # Sessions from the least to the most recently used
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    @contextmanager
+    def use(self, session_id: str, create: bool = True):
+        """
+        Context manager that gives exclusive access to a session, creating it if it does not
+        exist. Requests of other sessions are not blocked while it is held.
+        :param session_id: Id sent by the client
+        :param create: Create the model of the session with the factory if it has none. When it
+        is False, the caller is expected to set the model.
+        :return: The session, with its model
+        """
+        session = self.acquire(session_id)
+        try:
+            with session.lock:
+                if create and session.model is None:
+                    session.model = self.factory(session_id)
+                yield session
+        finally:
+            self.release(session)
+
+    def acquire(self, session_id: str) -> Session:
+        """Find or create a session, and mark it as in use so that it is not evicted"""
+        with self.lock:
+            self.evict_idle()
+            session = self.sessions.get(session_id)
+            if session is None:
+                if len(self.sessions) >= self.max_sessions:
+                    self.evict_least_recently_used()
+                session = self.sessions[session_id] = Session(session_id, self.close)
+            self.sessions.move_to_end(session_id)
+            session.users += 1
+            return session
+
+    def release(self, session: Session):
+        with self.lock:
+            session.users -= 1
+            session.last_used = time.monotonic()
+            if not session.users and self.sessions.get(session.id) is not session:
+                # Removed while it was in use
+                session.close()
+
+    def evict_idle(self):
+        """Remove the sessions that are not in use and have been idle for too long"""
+        deadline = time.monotonic() - self.idle_seconds
+        for session_id, session in list(self.sessions.items()):
+            if not session.users and session.last_used < deadline:
+                self.discard(session_id)
+
+    def evict_least_recently_used(self):
+        for session_id, session in self.sessions.items():
+            if not session.users:
+                self.discard(session_id)
+                return
+
+        raise PoolFullError(f"All the {self.max_sessions} sessions are in use")
+
+    def remove(self, session_id: str) -> bool:
+        """
+        Close a session. A request that is using it keeps its model until it finishes.
+        :return: Whether the session existed
+        """
+        with self.lock:
+            if session_id not in self.sessions:
+                return False
+            self.discard(session_id)
+            return True
+
+    def discard(self, session_id: str):
+        session = self.sessions.pop(session_id)
+        if not session.users:
+            session.close()
@@ -0,0 +1,329 @@
+"""
+Snapshots of the whole state of a CarpoolModel between two ticks, to restore a simulation after a
+crash or a restart of the server. The state is stored as typed NumPy arrays in an uncompressed
+npz file, without pickling any object: the map, the counters and statistics of the model, the
+state of the random number generator, the phases of the traffic lights, the cars with their
+routes and passengers, the passengers, the order of the free cell indexes, which decides the
+cells drawn for the next agents, and the observations of the congestion router.
+"""
+import json
+import os
+
+import numpy as np
+
+from agents import Car, Passenger, Road, Sidewalk
+from delta import MOVEMENT_NAMES, NO_MOVEMENT, movement_code
+from engine import HOME
+from model import CarpoolModel
+from routing import DIRECTION_NAMES, Route, to_array
+
+VERSION = 3
+NO_PASSENGER = -1
+
+
+def encode_routes(routes: list) -> (np.ndarray, np.ndarray):
+    """
+    Flatten a list of routes.
+    :return: Direction indexes of all the routes, and the offsets of each route in them
+    """
+    offsets = np.cumsum([0] + [len(route) for route in routes], dtype=np.int64)
+    directions = [DIRECTION_NAMES.index(direction) for route in routes for direction in route]
+    return np.array(directions, dtype=np.int8), offsets
+
+
+def decode_route(directions: np.ndarray, offsets: np.ndarray, index: int) -> list:
+    """Rebuild the route at an index of a flattened list of routes"""
+    route = directions[offsets[index]:offsets[index + 1]]
+    return [DIRECTION_NAMES[direction] for direction in route]
+
+
+def take_snapshot(model: CarpoolModel) -> dict:
+    """
+    Capture the state of a model. It must be called between two ticks.
+    :param model: The model
+    :return: Dictionary of arrays
+    """
+    _, rng_state, gauss_next = model.random.getstate()
+    meta = {
+        "version": VERSION,
+        "passenger_limit": model.passenger_limit,
+        "passenger_inst_limit": model.inst_pass_limit,
+        "passenger_delay": model.passenger_creation_delay,
+        "car_limit": model.car_limit,
+        "car_inst_limit": model.inst_car_limit,
+        "car_delay": model.car_creation_delay,
+        "dispatcher": model.dispatcher,
+        "router": model.router,
+        "passenger_count": model.passenger_count,
+        "passenger_tick": model.passenger_tick,
+        "car_count": model.car_count,
+        "car_tick": model.car_tick,
+        "current_id": model.current_id,
+        "steps": model.schedule.steps,
+        "time": model.schedule.time,
+        "running": model.running,
+        "gauss_next": gauss_next,
+        "stats": model.stats.to_dict(),
+    }
+    congestion = model.congestion
+    if congestion:
+        meta["congestion_ticks"] = congestion.ticks
+        meta["congestion_epoch"] = congestion.epoch
+
+    intersections = model.intersections
+    lights = [
+        intersection.traffic_lights[direction].status
+        for intersection in intersections
+        for direction in intersection.directions_to_stop
+    ]
+
+    cars = list(model.cars.values())
+    passengers = model.passengers
+    car_route_directions, car_route_offsets = encode_routes([car.route for car in cars])
+    pickup_route_directions, pickup_route_offsets = encode_routes(
+        [car.pickup[1] if car.pickup else [] for car in cars]
+    )
+    car_passengers = [passenger.unique_id for car in cars for passenger in car.passengers]
+    car_drops = [passenger.unique_id for car in cars for passenger in car.drops]
+
+    def objective_id(car: Car) -> int:
+        if car.objective is None:
+            return NO_PASSENGER
+        return HOME if car.objective is car else car.objective.unique_id
+
+    def optional_tick(tick) -> int:
+        return -1 if tick is None else tick
+
+    return {
+        "meta": np.frombuffer(json.dumps(meta).encode(), dtype=np.uint8),
+        "cells": np.asarray(model.city.cells, dtype=np.uint8),
+        "rng_state": np.array(rng_state, dtype=np.uint32),
+        "intersection_lights": np.array(
+            [
+                (
+                    intersection.active_light,
+                    intersection.next_light,
+                    intersection.ticks_to_light_change,
+                )
+                for intersection in intersections
+            ],
+            dtype=np.int32,
+        ).reshape(-1, 3),
+        "light_status": np.array(lights, dtype=np.int8),
+        "car_ids": np.array([car.unique_id for car in cars], dtype=np.int64),
+        "car_positions": np.array([car.pos for car in cars], dtype=np.int32).reshape(-1, 2),
+        "car_destinations": np.array(
+            [car.destination for car in cars], dtype=np.int32
+        ).reshape(-1, 2),
+        "car_distances": np.array([car.distance for car in cars], dtype=np.int64),
+        "car_directions": np.array(
+            [DIRECTION_NAMES.index(car.direction) for car in cars], dtype=np.int8
+        ),
+        "car_movements": np.array(
+            [movement_code(car.real_movement) for car in cars], dtype=np.int8
+        ),
+        "car_route_directions": car_route_directions,
+        "car_route_offsets": car_route_offsets,
+        "car_route_epochs": np.array([car.route_epoch for car in cars], dtype=np.int64),
+        "car_pickups": np.array(
+            [car.pickup[0].unique_id if car.pickup else NO_PASSENGER for car in cars],
+            dtype=np.int64,
+        ),
+        "pickup_route_directions": pickup_route_directions,
+        "pickup_route_offsets": pickup_route_offsets,
+        "car_objectives": np.array([objective_id(car) for car in cars], dtype=np.int64),
+        "car_passengers": np.array(car_passengers, dtype=np.int64),
+        "car_passenger_counts": np.array([len(car.passengers) for car in cars], dtype=np.int64),
+        "car_drops": np.array(car_drops, dtype=np.int64),
+        "car_drop_counts": np.array([len(car.drops) for car in cars], dtype=np.int64),
+        "new_car_ids": np.array(
+            [unique_id for unique_id in model.new_cars if unique_id in model.cars], dtype=np.int64
+        ),
+        "passenger_ids": np.array([p.unique_id for p in passengers], dtype=np.int64),
+        "passenger_positions": np.array(
+            [p.pos for p in passengers], dtype=np.int32
+        ).reshape(-1, 2),
+        "passenger_destinations": np.array(
+            [p.destination for p in passengers], dtype=np.int32
+        ).reshape(-1, 2),
+        "passenger_flags": np.array(
+            [(p.is_traveling, p.has_arrived, p.is_waiting) for p in passengers], dtype=bool
+        ).reshape(-1, 3),
+        "passenger_ticks": np.array(
+            [
+                (p.spawn_tick, optional_tick(p.pickup_tick), optional_tick(p.arrival_tick))
+                for p in passengers
+            ],
+            dtype=np.int64,
+        ).reshape(-1, 3),
+        "free_sidewalks": np.array(model.free_cells[Sidewalk].free, dtype=np.int32).reshape(-1, 2),
+        "free_roads": np.array(model.free_cells[Road].free, dtype=np.int32).reshape(-1, 2),
+        "label_positions": np.array(list(model.labels), dtype=np.int32).reshape(-1, 2),
+        "label_texts": np.array([int(text) for text in model.labels.values()], dtype=np.int64),
+        "congestion_delays": congestion.delays if congestion else np.zeros(0),
+        "congestion_waits": congestion.waits if congestion else np.zeros(0, dtype=np.int64),
+        "congestion_departures": (
+            congestion.departures if congestion else np.zeros(0, dtype=np.int64)
+        ),
+    }
+
+
+def restore_snapshot(arrays: dict, planning_workers: int = 0) -> CarpoolModel:
+    """
+    Create a model in the state captured by take_snapshot. The model continues exactly as the
+    original one would have.
+    :param arrays: Dictionary of arrays returned by take_snapshot
+    :param planning_workers: Number of planning workers of the model, which is not part of the
+    state
+    :return: The model
+    """
+    meta = json.loads(arrays["meta"].tobytes())
+    if meta["version"] != VERSION:
+        raise ValueError(f"Unsupported snapshot version {meta['version']}, expected {VERSION}")
+
+    model = CarpoolModel(
+        environment=np.array(arrays["cells"]),
+        passenger_limit=meta["passenger_limit"],
+        passenger_inst_limit=meta["passenger_inst_limit"],
+        passenger_delay=meta["passenger_delay"],
+        car_limit=meta["car_limit"],
+        car_inst_limit=meta["car_inst_limit"],
+        car_delay=meta["car_delay"],
+        dispatcher=meta["dispatcher"],
+        router=meta["router"],
+        planning_workers=planning_workers,
+    )
+    model.random.setstate((3, tuple(arrays["rng_state"].tolist()), meta["gauss_next"]))
+
+    statuses = iter(arrays["light_status"].tolist())
+    for intersection, phase in zip(model.intersections, arrays["intersection_lights"].tolist()):
+        (
+            intersection.active_light,
+            intersection.next_light,
+            intersection.ticks_to_light_change,
+        ) = phase
+        for direction in intersection.directions_to_stop:
+            intersection.traffic_lights[direction].status = next(statuses)
+
+    # Create the agents in the order of their ids, which is the order of the schedule
+    agents = {}
+    for unique_id, pos, destination in zip(
+        arrays["car_ids"].tolist(),
+        arrays["car_positions"].tolist(),
+        arrays["car_destinations"].tolist(),
+    ):
+        agents[unique_id] = (Car, tuple(pos), tuple(destination))
+    for unique_id, pos, destination in zip(
+        arrays["passenger_ids"].tolist(),
+        arrays["passenger_positions"].tolist(),
+        arrays["passenger_destinations"].tolist(),
+    ):
+        agents[unique_id] = (Passenger, tuple(pos), tuple(destination))
+
+    for unique_id in sorted(agents):
+        agent_class, pos, destination = agents[unique_id]
+        agent = agent_class(unique_id, model, pos, destination)
+        model.schedule.add(agent)
+        agents[unique_id] = agent
+        if agent_class == Car:
+            model.cars[unique_id] = agent
+        else:
+            model.passengers.append(agent)
+
+    for passenger, flags, ticks in zip(
+        model.passengers, arrays["passenger_flags"].tolist(), arrays["passenger_ticks"].tolist()
+    ):
+        passenger.is_traveling, passenger.has_arrived, passenger.is_waiting = flags
+        passenger.spawn_tick = ticks[0]
+        passenger.pickup_tick = None if ticks[1] < 0 else ticks[1]
+        passenger.arrival_tick = None if ticks[2] < 0 else ticks[2]
+        if passenger.is_traveling or passenger.has_arrived:
+            model.waiting.pick_up(passenger)
+        elif passenger.is_waiting:
+            model.waiting.confirm(passenger)
+
+    passenger_ids = iter(arrays["car_passengers"].tolist())
+    drop_ids = iter(arrays["car_drops"].tolist())
+    for index, car in enumerate(model.cars.values()):
+        car.direction = DIRECTION_NAMES[arrays["car_directions"][index]]
+        car.distance = int(arrays["car_distances"][index])
+        car.route_epoch = int(arrays["car_route_epochs"][index])
+        movement = arrays["car_movements"][index]
+        car.real_movement = None if movement == NO_MOVEMENT else MOVEMENT_NAMES[movement]
+        car.route = Route(
+            tuple(decode_route(arrays["car_route_directions"], arrays["car_route_offsets"], index))
+        )
+        car.passengers = [
+            agents[next(passenger_ids)] for _ in range(arrays["car_passenger_counts"][index])
+        ]
+        car.drops = [agents[next(drop_ids)] for _ in range(arrays["car_drop_counts"][index])]
+
+        pickup = arrays["car_pickups"][index]
+        if pickup != NO_PASSENGER:
+            route = decode_route(
+                arrays["pickup_route_directions"], arrays["pickup_route_offsets"], index
+            )
+            car.pickup = (agents[pickup], route)
+
+        objective = arrays["car_objectives"][index]
+        if objective == HOME:
+            car.objective = car
+        elif objective != NO_PASSENGER:
+            car.objective = agents[objective]
+
+    model.new_cars = {
+        unique_id: model.cars[unique_id] for unique_id in arrays["new_car_ids"].tolist()
+    }
+    model.labels = {
+        tuple(pos): str(text)
+        for pos, text in zip(arrays["label_positions"].tolist(), arrays["label_texts"].tolist())
+    }
+    for lookup_class, name in [(Sidewalk, "free_sidewalks"), (Road, "free_roads")]:
+        index = model.free_cells[lookup_class]
+        index.free = [tuple(cell) for cell in arrays[name].tolist()]
+        index.slots = {cell: slot for slot, cell in enumerate(index.free)}
+
+    model.passenger_count = meta["passenger_count"]
+    model.passenger_tick = meta["passenger_tick"]
+    model.car_count = meta["car_count"]
+    model.car_tick = meta["car_tick"]
+    model.current_id = meta["current_id"]
+    model.schedule.steps = meta["steps"]
+    model.schedule.time = meta["time"]
+    model.running = meta["running"]
+    for name, value in meta["stats"].items():
+        setattr(model.stats, name, value)
+
+    congestion = model.congestion
+    if congestion:
+        congestion.ticks = meta["congestion_ticks"]
+        congestion.epoch = meta["congestion_epoch"]
+        congestion.delays = np.array(arrays["congestion_delays"])
+        congestion.waits = np.array(arrays["congestion_waits"])
+        congestion.departures = np.array(arrays["congestion_departures"])
+        congestion.costs = to_array("d", 1 + congestion.delays)
+    return model
+
+
+def save_snapshot(model: CarpoolModel, path: str):
+    """
+    Write a snapshot of a model to a file. The file is replaced atomically, so a crash while
+    writing keeps the previous snapshot.
+    :param model: The model, between two ticks
+    :param path: Path of the file
+    """
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as file:
+        np.savez(file, **take_snapshot(model))
+    os.replace(temp_path, path)
+
+
+def load_snapshot(path: str, planning_workers: int = 0) -> CarpoolModel:
+    """
+    Restore a model from a file written by save_snapshot.
+    :param path: Path of the file
+    :param planning_workers: Number of planning workers of the model, see restore_snapshot
+    :return: The model
+    """
+    with np.load(path, allow_pickle=False) as data:
+        return restore_snapshot({name: data[name] for name in data.files}, planning_workers)
@@ -0,0 +1,102 @@
+"""
+Indexes of the cells where new cars and passengers can be instantiated. A cell is free while no car
+or passenger is on it, and the free cells of each type are kept in a list that is updated as the
+agents move, so a random free cell is drawn directly instead of by rejection sampling.
+"""
+from __future__ import annotations
+from random import Random
+from typing import List, Optional
+
+from mesa import Agent
+from mesa.space import MultiGrid
+
+
+class FreeCellIndex:
+    def __init__(self, cells: List[(int, int)]):
+        """
+        Initialize the index with all the cells of a type, e.g. every sidewalk, as free cells.
+        :param cells: List of (x, y) tuples
+        """
+        self.free = list(cells)
+        self.slots = {cell: slot for slot, cell in enumerate(self.free)}
+        self.counts = {cell: 0 for cell in self.free}
+
+    def occupy(self, cell: (int, int)):
+        """Register an agent in a cell. Cells of other types are ignored"""
+        if cell not in self.counts:
+            return
+
+        self.counts[cell] += 1
+        if self.counts[cell] == 1:
+            slot = self.slots.pop(cell)
+            last = self.free.pop()
+            if last != cell:
+                self.free[slot] = last
+                self.slots[last] = slot
+
+    def release(self, cell: (int, int)):
+        """Unregister an agent from a cell. Cells of other types are ignored"""
+        if cell not in self.counts:
+            return
+
+        self.counts[cell] -= 1
+        if not self.counts[cell]:
+            self.slots[cell] = len(self.free)
+            self.free.append(cell)
+
+    def sample(self, rng: Random, exclude: Optional[(int, int)] = None) -> Optional[(int, int)]:
+        """
+        Draw a random free cell.
+        :param rng: The random number generator of the model
+        :param exclude: A cell that must not be drawn, even if it is free
+        :return: The cell, or None if there is no free cell left
+        """
+        n_cells = len(self.free)
+        skip = self.slots.get(exclude)
+        if skip is not None:
+            n_cells -= 1
+
+        if n_cells <= 0:
+            return None
+
+        slot = rng.randrange(n_cells)
+        if skip is not None and slot >= skip:
+            slot += 1
+        return self.free[slot]
+
+
+class SpawnGrid(MultiGrid):
+    def __init__(self, width: int, height: int, torus: bool, indexes: list, tracked: tuple):
+        """
+        MultiGrid that keeps free cell indexes up to date when the tracked agents are placed,
+        moved or removed.
+        :param indexes: List of FreeCellIndex
+        :param tracked: Agent classes that occupy a cell, i.e. cars and passengers
+        """
+        super().__init__(width, height, torus)
+        self.indexes = indexes
+        self.tracked = tracked
+
+    def place_agent(self, agent: Agent, pos: (int, int)):
+        super().place_agent(agent, pos)
+        if isinstance(agent, self.tracked):
+            self.occupy(pos)
+
+    def move_agent(self, agent: Agent, pos: (int, int)):
+        if isinstance(agent, self.tracked):
+            self.release(agent.pos)
+            self.occupy(pos)
+        super().move_agent(agent, pos)
+
+    def remove_agent(self, agent: Agent):
+        if isinstance(agent, self.tracked):
+            self.release(agent.pos)
+        super().remove_agent(agent)
+
+    def occupy(self, pos: (int, int)):
+        for index in self.indexes:
+            index.occupy(pos)
+
+    def release(self, pos: (int, int)):
+        for index in self.indexes:
+            index.release(pos)
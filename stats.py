@@ -0,0 +1,23 @@
+"""
+Statistics of a simulation. Every model owns its counters, so several models can run in the same
+process, e.g. in threads or in the sessions of a server, without sharing them. The counters of
+each car and passenger are kept by the agents themselves (see Car.distance and
+Passenger.wait_ticks), and only updated when something happens to them.
+"""
+
+
+class SimulationStats:
+    def __init__(self):
+        """Create the counters of a model, all of them in zero"""
+        self.movements = 0
+        self.moving_cars = 0
+        self.passengers_without_ride = 0
+        self.passengers_arrived = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "movements": self.movements,
+            "moving_cars": self.moving_cars,
+            "passengers_without_ride": self.passengers_without_ride,
+            "passengers_arrived": self.passengers_arrived,
+        }
@@ -0,0 +1,147 @@
+"""
+Streaming mode of the Flask server. Instead of advancing the model when a client asks for the next
+tick, a TickLoop thread advances the model of a session at a target rate, and every client that
+subscribed to the session receives the changes of each tick as server-sent events. A client that
+reads slower than the model advances is not queued any frames: when it is ready for the next
+event it receives a single delta from the last frame it got to the latest one, so the frames in
+between are dropped, and the loop never waits for the clients. If a tick raises an exception, the
+loop stops and its subscribers receive the error, so the next subscriber starts a new loop.
+"""
+import threading
+import time
+from typing import Callable, Iterator, Optional
+
+from delta import Delta, Frame
+from sessions import Session, SessionPool
+
+KEEPALIVE_SECONDS = 15
+
+
+class LoopError(Exception):
+    """The tick loop stopped because advancing the model raised an exception"""
+
+
+class TickLoop(threading.Thread):
+    def __init__(self, pool: SessionPool, session: Session, rate: float, step: Callable):
+        """
+        Thread that advances the model of a session while it has subscribers. The session is
+        marked as in use while the loop runs, so that the pool does not evict it.
+        :param pool: Pool of the session
+        :param session: The session, with its model
+        :param rate: Target number of ticks per second
+        :param step: Function that advances the model of a session
+        """
+        super().__init__(name=f"tick-loop-{session.id}", daemon=True)
+        self.pool = pool
+        self.session = session
+        self.period = 1 / rate
+        self.step = step
+        self.condition = threading.Condition()
+        self.subscribers = 0
+        self.stopped = False
+        # Message of the exception that stopped the loop, if any
+        self.error: Optional[str] = None
+        # Latest frame, and a counter of the models of the session, which changes when the
+        # model is replaced so that the subscribers do not compare frames of different models
+        self.frame = None
+        self.generation = 0
+        self.model = None
+
+    def run(self):
+        deadline = time.monotonic()
+        try:
+            while not self.stopped:
+                with self.session.lock:
+                    model = self.session.model
+                    self.step(self.session)
+                    # The new cars are sent in the deltas, so they are not kept for /new_cars
+                    model.get_new_car_data()
+                    frame = model.get_frame()
+                self.publish(model, frame)
+
+                deadline = max(deadline + self.period, time.monotonic())
+                with self.condition:
+                    self.condition.wait_for(lambda: self.stopped, deadline - time.monotonic())
+        except Exception as error:
+            with self.condition:
+                self.error = f"{type(error).__name__}: {error}"
+                self.stopped = True
+                self.condition.notify_all()
+            # Let the thread report the traceback
+            raise
+        finally:
+            self.pool.release(self.session)
+
+    def publish(self, model, frame: Frame):
+        with self.condition:
+            if model is not self.model:
+                self.model = model
+                self.generation += 1
+            self.frame = frame
+            self.condition.notify_all()
+
+    def subscribe(self) -> bool:
+        """
+        Register a subscriber.
+        :return: False if the loop already stopped, and a new one must be started
+        """
+        with self.condition:
+            if self.stopped:
+                return False
+            self.subscribers += 1
+            return True
+
+    def unsubscribe(self):
+        """Unregister a subscriber, and stop the loop if it was the last one"""
+        with self.condition:
+            self.subscribers -= 1
+            if not self.subscribers:
+                self.stopped = True
+                self.condition.notify_all()
+
+    def deltas(self) -> Iterator[Optional[Delta]]:
+        """
+        Changes of the model for a subscriber, from the whole state of the first frame. Each
+        delta goes from the last frame sent to the latest one, skipping the frames that were
+        published while the subscriber was busy. None is yielded when no tick happens in
+        KEEPALIVE_SECONDS, to check that the subscriber is still connected.
+        :raises LoopError: If the loop stopped because a tick raised an exception
+        """
+        last_frame, generation = None, None
+        while True:
+            with self.condition:
+                ready = self.condition.wait_for(
+                    lambda: self.stopped or self.frame not in (None, last_frame), KEEPALIVE_SECONDS
+                )
+                if self.error:
+                    raise LoopError(self.error)
+                if self.stopped:
+                    return
+                frame, new_generation = self.frame, self.generation
+
+            if not ready:
+                yield None
+                continue
+
+            if new_generation != generation:
+                last_frame = None
+            yield Delta(last_frame, frame)
+            last_frame, generation = frame, new_generation
+
+
+def start_loop(pool: SessionPool, session_id: str, rate: float, step: Callable) -> TickLoop:
+    """
+    Subscribe to the tick loop of a session, starting it if the session has none.
+    :return: The loop, with the new subscriber registered
+    """
+    with pool.use(session_id) as session:
+        loop = session.loop
+        if loop is not None and loop.subscribe():
+            return loop
+
+        # The loop keeps the session in use until it stops
+        pool.acquire(session_id)
+        loop = session.loop = TickLoop(pool, session, rate, step)
+        loop.subscribe()
+        loop.start()
+        return loop
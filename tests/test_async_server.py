@@ -0,0 +1,65 @@
+"""
+Tests of the asynchronous server, with a tick that blocks until the test lets it finish.
+"""
+import json
+import threading
+
+from tornado.testing import AsyncHTTPTestCase, gen_test
+
+import async_server
+
+
+class AsyncServerTest(AsyncHTTPTestCase):
+    def get_app(self):
+        return async_server.make_app()
+
+    def setUp(self):
+        super().setUp()
+        self.release = threading.Event()
+        self.stepping = threading.Event()
+        step_model = async_server.step_model
+
+        def slow_step(session):
+            self.stepping.set()
+            self.release.wait(10)
+            step_model(session)
+
+        async_server.step_model = slow_step
+        self.addCleanup(setattr, async_server, "step_model", step_model)
+        self.addCleanup(self.release.set)
+
+    def tearDown(self):
+        for session_id in list(async_server.pool.sessions):
+            async_server.pool.remove(session_id)
+        super().tearDown()
+
+    @gen_test
+    async def test_reads_answer_while_a_tick_is_in_flight(self):
+        tick = self.http_client.fetch(self.get_url("/tick?session=reads"))
+        assert await self.io_loop.run_in_executor(None, self.stepping.wait, 10)
+
+        response = await self.http_client.fetch(self.get_url("/traffic_lights?session=reads"))
+        assert isinstance(json.loads(response.body), list)
+        assert not tick.done()
+
+        self.release.set()
+        response = await tick
+        assert json.loads(response.body)["tick"] == 1
+
+    @gen_test
+    async def test_deleting_a_session_shuts_down_its_worker(self):
+        await self.http_client.fetch(self.get_url("/passengers?session=closed"))
+        worker = async_server.pool.sessions["closed"].model
+        closed = threading.Event()
+        close_model = worker.session.close_model
+        worker.session.close_model = lambda model: (close_model(model), closed.set())
+
+        response = await self.http_client.fetch(
+            self.get_url("/session?session=closed"), method="DELETE"
+        )
+        assert json.loads(response.body) == [{"message": "Session closed"}]
+        assert "closed" not in async_server.pool.sessions
+        assert await self.io_loop.run_in_executor(None, closed.wait, 10)
+        assert worker.session.model is None
+        with self.assertRaises(RuntimeError):
+            worker.executor.submit(int)
@@ -0,0 +1,81 @@
+"""
+Tests of the compact city map and its binary files.
+"""
+import numpy as np
+import pytest
+
+from citymap import HEADER, MAGIC, VERSION, CityMap, load_map, save_map
+from enums import RawDirections
+from environment import ENVIRONMENT
+from mapgen import generate_city
+from routing import DIRECTION_NAMES
+
+
+def parse_environment(environment: list) -> (list, list, list):
+    """
+    Intersections, roads and sidewalks of a matrix of cells, walking it like the model did before
+    the compact maps.
+    """
+    possible_directions = [direction.name for direction in RawDirections]
+    intersections, roads, sidewalks = [], [], []
+    n_rows = len(environment)
+    for row, cells in enumerate(environment):
+        for col, cell in enumerate(cells):
+            position = (col, n_rows - row - 1)
+            if cell == "IN":
+                directions_to_go, directions_to_stop = set(), set()
+                for direction in RawDirections:
+                    try:
+                        neighbor = environment[row + direction.value[0]][col + direction.value[1]]
+                    except IndexError:
+                        continue
+                    if neighbor == direction.name:
+                        directions_to_go.add(neighbor)
+                    elif neighbor in possible_directions:
+                        directions_to_stop.add(neighbor)
+                intersections.append(
+                    {
+                        "x": position[0],
+                        "y": position[1],
+                        "directions_to_go": sorted(directions_to_go),
+                        "directions_to_stop": sorted(directions_to_stop),
+                    }
+                )
+            elif cell in DIRECTION_NAMES:
+                roads.append((position, cell))
+            elif cell == "SW":
+                sidewalks.append(position)
+    return intersections, roads, sidewalks
+
+
+def test_map_matches_the_environment_matrix():
+    city = CityMap.from_environment(ENVIRONMENT)
+    intersections, roads, sidewalks = parse_environment(ENVIRONMENT)
+
+    assert city.intersection_data() == intersections
+    road_directions = [DIRECTION_NAMES[direction] for direction in city.road_directions]
+    assert list(zip(city.road_cells(), road_directions)) == roads
+    assert city.sidewalk_cells() == sidewalks
+
+
+def test_saved_maps_load_the_same(tmp_path):
+    for environment in (ENVIRONMENT, generate_city(7, 3, block_size=2, seed=0, compact=True)):
+        path = str(tmp_path / "city.map")
+        save_map(path, environment)
+        city, loaded = CityMap.from_environment(environment), load_map(path)
+
+        assert np.array_equal(loaded.cells, city.cells)
+        assert loaded.intersection_data() == city.intersection_data()
+        assert loaded.road_cells() == city.road_cells()
+        assert loaded.sidewalk_cells() == city.sidewalk_cells()
+
+
+def test_bad_files_are_rejected(tmp_path):
+    path = tmp_path / "bad.map"
+    path.write_bytes(HEADER.pack(b"NOTAMAP\x00", VERSION, 1, 1) + b"\x00")
+    with pytest.raises(ValueError, match="is not a map file"):
+        load_map(str(path))
+
+    path.write_bytes(HEADER.pack(MAGIC, VERSION + 1, 1, 1) + b"\x00")
+    with pytest.raises(ValueError, match="Unsupported map version"):
+        load_map(str(path))
@@ -0,0 +1,114 @@
+"""
+Tests of the congestion router: the weighted searches, the refresh of the costs and a whole run.
+"""
+from array import array
+
+import numpy as np
+
+from citymap import CityMap
+from environment import ENVIRONMENT
+from model import CarpoolModel
+from routing import CONGESTION, DIRECTION_NAMES, CongestionCosts, RoadGraph, WeightedSearch
+
+GRAPH = RoadGraph(CityMap.from_environment(ENVIRONMENT))
+
+
+def cheapest_costs(graph: RoadGraph, costs: np.ndarray, source: int) -> np.ndarray:
+    """Cost of the cheapest route from a cell to every cell, with the Bellman-Ford algorithm"""
+    sources = np.repeat(np.arange(graph.n_cells), np.diff(np.array(graph.offsets)))
+    targets = np.array(graph.targets)
+    distances = np.full(graph.n_cells, np.inf)
+    distances[source] = 0
+    while True:
+        reached = np.full(graph.n_cells, np.inf)
+        np.minimum.at(reached, targets, distances[sources] + costs[sources])
+        new_distances = np.minimum(distances, reached)
+        if np.array_equal(new_distances, distances):
+            return distances
+        distances = new_distances
+
+
+def route_cost(graph: RoadGraph, costs: np.ndarray, source: int, route: list) -> (float, int):
+    """Follow a route along the edges of the graph, returning its cost and the cell it ends at"""
+    cell, total = source, 0.0
+    for name in route:
+        total += costs[cell]
+        moves = {direction: next_cell for next_cell, direction in graph.successors(cell)}
+        cell = moves[DIRECTION_NAMES.index(name)]
+    return total, cell
+
+
+def test_weighted_search_finds_the_cheapest_routes():
+    rng = np.random.default_rng(0)
+    for _ in range(5):
+        costs = 1 + 4 * rng.random(GRAPH.n_cells)
+        source = int(rng.integers(GRAPH.n_cells))
+        expected = cheapest_costs(GRAPH, costs, source)
+
+        search = WeightedSearch(GRAPH, array("d", costs), source)
+        visited = list(search)
+        assert len(visited) == np.isfinite(expected).sum()
+        # Dijkstra's order, and every route is one of the cheapest
+        assert np.all(np.diff(expected[visited]) >= -1e-9)
+        for cell in visited[::7]:
+            total, end = route_cost(GRAPH, costs, source, search.route(cell))
+            assert end == cell
+            assert np.isclose(total, expected[cell])
+
+        # A* towards a single cell
+        for target in rng.choice(visited, 10):
+            search = WeightedSearch(GRAPH, array("d", costs), source, GRAPH.position(target))
+            for cell in search:
+                if cell == target:
+                    break
+            total, end = route_cost(GRAPH, costs, source, search.route(target))
+            assert end == target
+            assert np.isclose(total, expected[target])
+
+
+def test_costs_are_refreshed_as_a_moving_average():
+    congestion = CongestionCosts(GRAPH, refresh_ticks=3, smoothing=0.5)
+    busy = GRAPH.position(0)
+    free = GRAPH.position(1)
+    for _ in range(2):
+        for _ in range(4):
+            congestion.wait(busy)
+        congestion.depart(busy)
+        congestion.depart(free)
+        assert not congestion.tick()
+    assert congestion.tick()
+
+    # 8 waits for 2 departures, averaged with the initial delay of 0
+    assert congestion.costs[0] == 1 + 0.5 * 4
+    assert congestion.costs[1] == 1
+    assert congestion.epoch == 1
+
+    # Without traffic, the delay decays towards the free flow cost
+    for _ in range(3):
+        congestion.tick()
+    assert congestion.costs[0] == 1 + 0.25 * 4
+
+
+def test_route_cache_is_cleared_when_the_costs_change():
+    model = CarpoolModel(ENVIRONMENT, 85, 86, 1, 15, 16, 2, seed=0, router=CONGESTION)
+    clears = []
+    clear = model.route_cache.clear
+    model.route_cache.clear = lambda: (clears.append(model.schedule.steps), clear())
+
+    refresh = model.congestion.refresh_ticks
+    for _ in range(2 * refresh + 1):
+        model.step()
+    # The tick of the schedule is counted before the costs are refreshed
+    assert clears == [refresh, 2 * refresh]
+    assert model.congestion.epoch == 2
+
+
+def test_congestion_router_finishes_a_scenario():
+    model = CarpoolModel(ENVIRONMENT, 85, 86, 1, 15, 16, 2, seed=0, router=CONGESTION)
+    for _ in range(2000):
+        if not model.running:
+            break
+        model.step()
+    assert not model.running
+    assert all(passenger.has_arrived for passenger in model.passengers)
+    assert not model.cars
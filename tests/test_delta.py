@@ -0,0 +1,179 @@
+"""
+Tests of the deltas of the /tick endpoint: the binary format against the JSON one, the fallback to
+the whole state, and a client that applies the deltas to rebuild what the serializers return.
+"""
+import numpy as np
+
+from delta import (
+    COUNT,
+    FULL,
+    HEADER,
+    MAGIC,
+    MOVEMENT_NAMES,
+    NO_MOVEMENT,
+    PASSENGER_STATES,
+    VERSION,
+    FrameHistory,
+)
+from environment import ENVIRONMENT
+from model import CarpoolModel
+
+
+def decode(data: bytes) -> dict:
+    """Decode a delta in the binary format into the dictionary of Delta.to_dict"""
+    offset = 0
+
+    def read(dtype: str, count: int) -> list:
+        nonlocal offset
+        values = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+        offset += values.nbytes
+        return values.tolist()
+
+    def read_count() -> int:
+        nonlocal offset
+        (count,) = COUNT.unpack_from(data, offset)
+        offset += COUNT.size
+        return count
+
+    magic, version, flags, tick, base = HEADER.unpack_from(data)
+    assert (magic, version) == (MAGIC, VERSION)
+    offset = HEADER.size
+    full = flags == FULL
+
+    n_cars = read_count()
+    cars = {"id": read("<i4", n_cars), "x": read("<i4", n_cars), "z": read("<i4", n_cars)}
+    cars["direction"] = [
+        None if movement == NO_MOVEMENT else MOVEMENT_NAMES[movement]
+        for movement in read("i1", n_cars)
+    ]
+    removed_cars = read("<i4", read_count())
+    n_lights = read_count()
+    traffic_lights = {"index": read("<u4", n_lights), "state": read("i1", n_lights)}
+    n_passengers = read_count()
+    passengers = {
+        "id": read("<i4", n_passengers),
+        "x": read("<i4", n_passengers),
+        "z": read("<i4", n_passengers),
+        "state": [PASSENGER_STATES[state] for state in read("i1", n_passengers)],
+    }
+    decoded = {
+        "tick": tick,
+        "base": None if full else base,
+        "full": full,
+        "cars": cars,
+        "removed_cars": removed_cars,
+        "traffic_lights": traffic_lights,
+        "passengers": passengers,
+    }
+    if full:
+        length = read_count()
+        decoded["traffic_light_ids"] = data[offset : offset + length].decode().split("\n")
+        offset += length
+    assert offset == len(data)
+    return decoded
+
+
+class Client:
+    def __init__(self):
+        """State that a client rebuilds from the deltas it receives"""
+        self.tick = None
+        self.cars = {}
+        self.new_cars = set()
+        self.light_ids = []
+        self.lights = []
+        self.passengers = {}
+
+    def apply(self, delta: dict):
+        if delta["full"]:
+            self.cars = {}
+            self.passengers = {}
+            self.light_ids = delta["traffic_light_ids"]
+            self.lights = [None] * len(self.light_ids)
+        else:
+            assert delta["base"] == self.tick
+
+        cars = delta["cars"]
+        self.new_cars = set(cars["id"]) - set(self.cars)
+        for car_id, x, z, direction in zip(cars["id"], cars["x"], cars["z"], cars["direction"]):
+            self.cars[car_id] = (x, z, direction)
+        for car_id in delta["removed_cars"]:
+            del self.cars[car_id]
+        lights = delta["traffic_lights"]
+        for index, state in zip(lights["index"], lights["state"]):
+            self.lights[index] = state
+        passengers = delta["passengers"]
+        for passenger_id, x, z, state in zip(
+            passengers["id"], passengers["x"], passengers["z"], passengers["state"]
+        ):
+            self.passengers[passenger_id] = (x, z, state)
+        self.tick = delta["tick"]
+
+    def cars_data(self) -> list:
+        """Same as get_cars_data, for the cars that were already known before the last delta"""
+        return [
+            {"next_direction": direction}
+            for car_id, (_, _, direction) in sorted(self.cars.items())
+            if car_id not in self.new_cars
+        ]
+
+    def traffic_lights_data(self) -> list:
+        return [{"state": state, "id": id} for id, state in zip(self.light_ids, self.lights)]
+
+    def passenger_data(self) -> list:
+        return [
+            {"x": x, "y": 0, "z": z, "arrived": state == "arrived"}
+            for _, (x, z, state) in sorted(self.passengers.items())
+            if state != "traveling"
+        ]
+
+
+def test_binary_format_matches_json():
+    model = CarpoolModel(ENVIRONMENT, 85, 86, 1, 15, 16, 2, seed=0)
+    history = FrameHistory()
+    acknowledged = None
+    for _ in range(40):
+        model.step()
+        history.add(model.get_frame())
+        delta = history.delta(acknowledged)
+        assert decode(delta.to_bytes()) == delta.to_dict()
+        acknowledged = delta.frame.tick
+
+
+def test_applied_deltas_match_the_serializers():
+    model = CarpoolModel(ENVIRONMENT, 85, 86, 1, 15, 16, 2, seed=1)
+    history = FrameHistory()
+    client = Client()
+    # The client asks for some ticks after several steps, so their deltas merge those steps
+    for steps in [1, 2, 1, 3] * 25:
+        for _ in range(steps):
+            model.step()
+            history.add(model.get_frame())
+        client.apply(history.delta(client.tick).to_dict())
+
+        assert client.tick == model.schedule.steps
+        assert client.cars_data() == model.get_cars_data()
+        assert client.traffic_lights_data() == model.get_traffic_lights_data()
+        assert client.passenger_data() == model.get_passenger_data()
+        model.get_new_car_data()
+        if not model.running:
+            break
+
+
+def test_whole_state_without_a_known_tick():
+    model = CarpoolModel(ENVIRONMENT, 85, 86, 1, 15, 16, 2, seed=2)
+    history = FrameHistory(size=3)
+    for _ in range(5):
+        model.step()
+        history.add(model.get_frame())
+    last = model.schedule.steps
+
+    assert history.delta(None).full
+    # Not acknowledged yet, and too old to be kept
+    assert history.delta(last + 1).full
+    assert history.delta(last - 3).full
+
+    delta = history.delta(last - 1)
+    assert not delta.full
+    assert delta.to_dict()["base"] == last - 1
+    # The frames before the acknowledged one are discarded
+    assert list(history.frames) == [last - 1, last]
@@ -0,0 +1,48 @@
+"""
+Tests of the dispatchers that assign cars to passengers.
+"""
+import random
+
+from dispatch import greedy_assignment, hungarian_assignment, nearest_candidates
+from routing import UNREACHABLE
+
+
+def best_assignment(candidates: list, car: int = 0, taken: frozenset = frozenset()) -> (int, int):
+    """Negated number of assigned cars and total distance of the best assignment, by brute force"""
+    if car == len(candidates):
+        return 0, 0
+
+    best = best_assignment(candidates, car + 1, taken)
+    for passenger, distance in candidates[car].items():
+        if passenger not in taken:
+            assigned, total = best_assignment(candidates, car + 1, taken | {passenger})
+            best = min(best, (assigned - 1, total + distance))
+    return best
+
+
+def test_hungarian_assignment_is_optimal():
+    rng = random.Random(0)
+    for _ in range(500):
+        n_passengers = rng.randint(1, 6)
+        candidates = [
+            {
+                passenger: rng.randint(0, 20)
+                for passenger in rng.sample(range(n_passengers), rng.randint(0, n_passengers))
+            }
+            for _ in range(rng.randint(1, 6))
+        ]
+        assignment = hungarian_assignment(candidates)
+        assert len(set(assignment.values())) == len(assignment)
+        total = sum(candidates[car][passenger] for car, passenger in assignment.items())
+        assert (-len(assignment), total) == best_assignment(candidates)
+
+
+def test_greedy_assignment_takes_nearest_pairs_first():
+    candidates = [{0: 1, 1: 2}, {0: 3}]
+    assert greedy_assignment(candidates) == {0: 0}
+    assert hungarian_assignment(candidates) == {0: 1, 1: 0}
+
+
+def test_nearest_candidates():
+    distances = [5, UNREACHABLE, 2, 5, 1]
+    assert nearest_candidates(distances, 3) == {4: 1, 2: 2, 0: 5}
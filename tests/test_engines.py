@@ -0,0 +1,48 @@
+"""
+Tests that CarpoolModel and ArrayCarpoolModel simulate the same cars and passengers.
+"""
+from engine import ArrayCarpoolModel
+from environment import ENVIRONMENT
+from model import CarpoolModel
+from routing import ROUTERS
+
+MAX_TICKS = 2000
+
+
+def create_model(engine, *limits, seed: int, **kwargs):
+    """Create a model of either engine with the limits and delays of CarpoolModel"""
+    return engine(ENVIRONMENT, *limits, seed=seed, **kwargs)
+
+
+def run(model) -> (int, int):
+    """
+    Step a model until it finishes.
+    :return: Tuple (ticks, total car movements)
+    """
+    ticks = 0
+    while model.running and ticks < MAX_TICKS:
+        model.step()
+        ticks += 1
+    assert not model.running, "The simulation did not finish"
+    return ticks, model.stats.movements
+
+
+def test_cars_wait_without_route():
+    # Many passengers for few cars, so cars end their routes at their destination or heading
+    # home while passengers still wait, and cars heading home confirm pickups
+    for seed in range(3):
+        results = [
+            run(create_model(engine, 60, 5, 2, 30, 3, 1, seed=seed))
+            for engine in (CarpoolModel, ArrayCarpoolModel)
+        ]
+        assert results[0] == results[1]
+
+
+def test_same_simulation_with_both_routers():
+    for router in ROUTERS:
+        for seed in range(3):
+            results = [
+                run(create_model(engine, 40, 10, 1, 12, 4, 2, seed=seed, router=router))
+                for engine in (CarpoolModel, ArrayCarpoolModel)
+            ]
+            assert results[0] == results[1], (router, seed)
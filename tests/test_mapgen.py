@@ -0,0 +1,66 @@
+"""
+Tests of the procedural generator of city maps.
+"""
+import itertools
+from collections import deque
+
+import pytest
+
+from citymap import CityMap
+from environment import ENVIRONMENT
+from mapgen import HORIZONTAL, VERTICAL, build_cells, corner_errors, generate_city
+from routing import RoadGraph
+
+
+def reaches_every_cell(graph: RoadGraph, neighbors) -> bool:
+    """Whether a BFS from the first cell, following the given neighbors, visits every cell"""
+    visited = {0}
+    q = deque([0])
+    while q:
+        for cell, _ in neighbors(q.popleft()):
+            if cell not in visited:
+                visited.add(cell)
+                q.append(cell)
+    return len(visited) == graph.n_cells
+
+
+def strongly_connected(cells) -> bool:
+    graph = RoadGraph(CityMap.from_environment(cells))
+    return reaches_every_cell(graph, graph.successors) and reaches_every_cell(
+        graph, graph.predecessors
+    )
+
+
+def test_default_city_is_the_environment():
+    assert generate_city(5, 5) == ENVIRONMENT
+
+
+def test_bad_layouts_are_rejected():
+    # The alternating border streets of an even number of blocks do not form a cycle
+    with pytest.raises(ValueError, match="not strongly connected"):
+        generate_city(4, 5)
+    with pytest.raises(ValueError, match="not strongly connected"):
+        generate_city(5, 2)
+    with pytest.raises(ValueError, match="not strongly connected"):
+        generate_city(3, 3, horizontal=["LF"], vertical=["DW"])
+    with pytest.raises(ValueError, match="Horizontal streets"):
+        generate_city(3, 3, horizontal=["UP"])
+    with pytest.raises(ValueError, match="at least one block"):
+        generate_city(0, 3)
+
+
+def test_corner_errors_match_the_connectivity():
+    for rows in itertools.product(HORIZONTAL, repeat=3):
+        for cols in itertools.product(VERTICAL, repeat=3):
+            cells = build_cells(list(rows), list(cols), block_size=2)
+            assert (not corner_errors(list(rows), list(cols))) == strongly_connected(cells)
+
+
+def test_random_layouts_are_strongly_connected():
+    for seed in range(5):
+        cells = generate_city(6, 4, block_size=3, seed=seed, compact=True)
+        assert cells.shape == (4 * 4 + 1, 6 * 4 + 1)
+        assert strongly_connected(cells)
+    # The same seed gives the same layout
+    first = generate_city(6, 4, seed=1, compact=True)
+    assert (first == generate_city(6, 4, seed=1, compact=True)).all()
@@ -0,0 +1,48 @@
+"""
+Tests that planning the routes on worker processes does not change the simulation.
+"""
+import planning
+from environment import ENVIRONMENT
+from model import CarpoolModel
+from routing import ROUTERS
+
+TICKS = 60
+
+
+def simulate(planning_workers: int, router: str) -> (dict, list, int):
+    """
+    Run a scenario with many cars for some ticks.
+    :return: Tuple (statistics, positions of the cars, number of chunks sent to the workers)
+    """
+    model = CarpoolModel(
+        ENVIRONMENT, 40, 10, 1, 60, 20, 2, seed=0, router=router, planning_workers=planning_workers
+    )
+    chunks = 0
+    try:
+        if model.planner:
+            map_chunks = model.planner.executor.map
+
+            def count_chunks(function, chunk_list, *args):
+                nonlocal chunks
+                chunk_list = list(chunk_list)
+                chunks += len(chunk_list)
+                return map_chunks(function, chunk_list, *args)
+
+            model.planner.executor.map = count_chunks
+        for _ in range(TICKS):
+            model.step()
+        positions = [(car_id, car.pos) for car_id, car in model.cars.items()]
+        return model.stats.to_dict(), positions, chunks
+    finally:
+        model.close()
+
+
+def test_planning_workers_do_not_change_the_run(monkeypatch):
+    # Send the searches of every tick to the workers, however few they are
+    monkeypatch.setattr(planning, "MIN_PARALLEL_REQUESTS", 1)
+    for router in ROUTERS:
+        stats, positions, _ = simulate(0, router)
+        parallel_stats, parallel_positions, chunks = simulate(2, router)
+        assert chunks > 0
+        assert parallel_stats == stats, router
+        assert parallel_positions == positions, router
@@ -0,0 +1,69 @@
+"""
+Tests of the reservation table that resolves the moves of the cars in a tick.
+"""
+import random
+
+import numpy as np
+
+from reservations import ReservationTable
+
+WIDTH = HEIGHT = 6
+
+
+def resolve(requests: list, stopped: list = ()) -> dict:
+    """
+    Resolve some requests against the cells blocked by their cars.
+    :param requests: List of tuples (agent, priority, source, target, reserve, blocking)
+    :param stopped: Cells blocked by cars that do not request a move
+    :return: Dictionary that maps each agent to whether it moves
+    """
+    table = ReservationTable(HEIGHT)
+    blockers = np.zeros((WIDTH, HEIGHT), dtype=np.int32)
+    for cell in stopped:
+        blockers[cell] += 1
+    for agent, priority, source, target, reserve, blocking in requests:
+        table.request(agent, priority, source, target, reserve, blocking)
+        blockers[source] += blocking
+    results = table.resolve(blockers)
+    assert len(table) == 0
+    return dict(results)
+
+
+def test_queue_advances_and_oldest_car_wins():
+    moves = resolve(
+        [
+            # A queue towards (3, 0), where car c also wants to go
+            ("a", 0, (2, 0), (3, 0), True, True),
+            ("b", 1, (1, 0), (2, 0), True, True),
+            ("c", 2, (3, 1), (3, 0), True, True),
+            # A queue behind a stopped car
+            ("d", 3, (5, 4), (5, 5), True, True),
+            ("e", 4, (5, 3), (5, 4), True, True),
+            # Intersections can always be entered
+            ("f", 5, (0, 4), (0, 5), False, True),
+        ],
+        stopped=[(5, 5), (0, 5)],
+    )
+    assert moves == {"a": True, "b": True, "c": False, "d": False, "e": False, "f": True}
+
+
+def test_result_does_not_depend_on_the_order_of_the_cars():
+    rng = random.Random(0)
+    cells = [(x, y) for x in range(WIDTH) for y in range(HEIGHT)]
+    for _ in range(300):
+        sources = rng.sample(cells, rng.randint(1, 20))
+        requests = []
+        for agent, source in enumerate(sources):
+            target = rng.choice(
+                [
+                    (source[0] + dx, source[1] + dy)
+                    for dx, dy in ((0, 0), (1, 0), (-1, 0), (0, 1), (0, -1))
+                    if (source[0] + dx, source[1] + dy) in cells
+                ]
+            )
+            reserve = rng.random() < 0.9
+            blocking = rng.random() < 0.9
+            requests.append((agent, agent, source, target, reserve, blocking))
+        expected = resolve(requests)
+        rng.shuffle(requests)
+        assert resolve(requests) == expected
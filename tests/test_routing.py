@@ -0,0 +1,179 @@
+"""
+Tests of the road graph, the searches and the routes of routing.
+"""
+import random
+from collections import deque
+
+import numpy as np
+
+from agents import Intersection, Road
+from citymap import CityMap
+from enums import Directions
+from environment import ENVIRONMENT
+from mapgen import CELL_CODES
+from model import CarpoolModel
+from routing import (
+    DIRECTION_NAMES,
+    NO_CELL,
+    UNREACHABLE,
+    NearestTargets,
+    RoadGraph,
+    Route,
+    RouteCache,
+)
+
+# A model without cars or passengers, with Road and Intersection agents on the grid
+MODEL = CarpoolModel(ENVIRONMENT, 0, 0, 1, 0, 0, 1, static_agents=True)
+GRAPH = MODEL.graph
+
+
+def grid_successors(coords: (int, int)) -> set:
+    """
+    Cells reachable from a position and the direction to each one, found with the agents of the
+    grid like the cars did before the road graph.
+    :return: Set of ((x, y), direction) tuples
+    """
+    directions = []
+    for agent in MODEL.grid.get_cell_list_contents([coords]):
+        if isinstance(agent, Road):
+            directions.append(agent.direction)
+        elif isinstance(agent, Intersection):
+            directions += agent.directions_to_go
+    successors = set()
+    for direction in directions:
+        disp = Directions[direction].value
+        successors.add(((coords[0] + disp[0], coords[1] + disp[1]), direction))
+    return successors
+
+
+def road_cells() -> list:
+    """Positions of the Road and Intersection agents of the grid"""
+    return [
+        (x, y)
+        for contents, x, y in MODEL.grid.coord_iter()
+        if any(isinstance(agent, (Road, Intersection)) for agent in contents)
+    ]
+
+
+def grid_distance(source: (int, int), targets: set) -> int:
+    """Length of the shortest route from a position to any of the target positions, with a BFS"""
+    q = deque([(source, 0)])
+    visited = {source}
+    while q:
+        coords, distance = q.popleft()
+        if coords in targets:
+            return distance
+        for next_coords, _ in grid_successors(coords):
+            if next_coords not in visited:
+                visited.add(next_coords)
+                q.append((next_coords, distance + 1))
+    return UNREACHABLE
+
+
+def test_graph_matches_the_grid():
+    cells = road_cells()
+    assert len(cells) == GRAPH.n_cells
+    for coords in cells:
+        cell = GRAPH.cell_id(coords)
+        assert GRAPH.position(cell) == coords
+        successors = {
+            (GRAPH.position(next_cell), DIRECTION_NAMES[direction])
+            for next_cell, direction in GRAPH.successors(cell)
+        }
+        assert successors == grid_successors(coords), coords
+        for next_cell, direction in GRAPH.successors(cell):
+            assert (cell, direction) in set(GRAPH.predecessors(next_cell))
+
+    for coords in MODEL.city.sidewalk_cells():
+        assert GRAPH.cell_id(coords) == NO_CELL
+
+
+def test_nearest_targets_beyond_16_bit_distances():
+    # A single road of 70000 cells towards the right
+    length = 70000
+    graph = RoadGraph(CityMap(np.full((1, length), CELL_CODES["RH"], dtype=np.uint8)))
+    field = NearestTargets(graph, [[graph.cell_id((length - 1, 0))]])
+
+    assert field.distance((0, 0)) == length - 1
+    assert field.nearest((0, 0)) == 0
+    assert field.route((0, 0)) == ["RH"] * (length - 1)
+    assert field.expanded == length
+
+    # Cells after the target can not reach it
+    field = NearestTargets(graph, [[graph.cell_id((10, 0))]])
+    assert field.distance((11, 0)) == UNREACHABLE
+    assert field.nearest((11, 0)) is None
+
+
+def test_nearest_targets_match_a_search_from_each_car():
+    rng = random.Random(0)
+    sidewalks = rng.sample(MODEL.city.sidewalk_cells(), 6)
+    targets = [GRAPH.adjacent_cells(coords) for coords in sidewalks]
+    field = NearestTargets(GRAPH, targets)
+    target_positions = {GRAPH.position(cell) for cells in targets for cell in cells}
+
+    for coords in road_cells():
+        distance = grid_distance(coords, target_positions)
+        assert field.distance(coords) == distance, coords
+        route = field.route(coords)
+        assert len(route) == distance
+        # The route ends next to the nearest target, which may be any of the tied ones
+        x, y = coords
+        for direction in route:
+            disp = Directions[direction].value
+            assert ((x + disp[0], y + disp[1]), direction) in grid_successors((x, y))
+            x, y = x + disp[0], y + disp[1]
+        assert GRAPH.cell_id((x, y)) in targets[field.nearest(coords)]
+
+
+def test_route_cache_stores_every_suffix():
+    cache = RouteCache(max_size=5)
+    target = (9, 9)
+    route = cache.put((0, 0), target, ["UP", "UP", "RH"])
+    assert list(route) == ["UP", "UP", "RH"]
+    suffixes = {
+        (0, 0): ["UP", "UP", "RH"],
+        (0, 1): ["UP", "RH"],
+        (0, 2): ["RH"],
+        (1, 2): [],
+    }
+    for source, suffix in suffixes.items():
+        assert list(cache.get(source, target)) == suffix
+    assert cache.get((0, 0), (8, 8)) is None
+    assert (cache.hits, cache.misses) == (4, 1)
+
+
+def test_route_cache_evicts_the_least_recently_used():
+    cache = RouteCache(max_size=3)
+    cache.put((0, 0), (5, 5), ["RH"])
+    cache.put((0, 1), (5, 5), [])
+    # (0, 0) becomes more recently used than (1, 0) and (0, 1)
+    assert cache.get((0, 0), (5, 5))
+    cache.put((3, 3), (5, 5), [])
+
+    assert ((1, 0), (5, 5)) not in cache
+    assert ((0, 0), (5, 5)) in cache
+    assert ((0, 1), (5, 5)) in cache
+    assert ((3, 3), (5, 5)) in cache
+
+    cache.put((4, 4), (5, 5), ["DW"])
+    assert list(cache.routes) == [((3, 3), (5, 5)), ((4, 4), (5, 5)), ((4, 3), (5, 5))]
+
+
+def test_routes_do_not_change_the_shared_path():
+    cache = RouteCache()
+    cache.put((0, 0), (9, 9), ["UP", "RH", "RH"])
+    first, second = cache.get((0, 0), (9, 9)), cache.get((0, 0), (9, 9))
+    assert first.path is second.path
+
+    first.advance()
+    assert first.next_direction() == "RH"
+    assert list(first) == ["RH", "RH"]
+    first.advance()
+    first.advance()
+    assert not first and len(first) == 0
+
+    assert first.path == ("UP", "RH", "RH")
+    assert list(second) == ["UP", "RH", "RH"] and len(second) == 3
+    assert list(cache.get((0, 0), (9, 9))) == ["UP", "RH", "RH"]
+    assert list(Route(first.path, 1)) == ["RH", "RH"]
@@ -0,0 +1,77 @@
+"""
+Tests of the pool of sessions of the Flask server, with a factory of fake models.
+"""
+import time
+
+import pytest
+
+from sessions import PoolFullError, SessionPool
+
+IDLE_SECONDS = 0.05
+
+
+class Pool(SessionPool):
+    def __init__(self, **kwargs):
+        """Pool that creates the name of the session as its model, and keeps the closed ones"""
+        self.closed = []
+        super().__init__(
+            lambda session_id: f"model {session_id}", close=self.closed.append, **kwargs
+        )
+
+
+def test_sessions_keep_their_model():
+    pool = Pool()
+    with pool.use("a") as session:
+        assert session.model == "model a"
+        session.model = "changed"
+    with pool.use("a") as session:
+        assert session.model == "changed"
+    with pool.use("b") as session:
+        assert session.model == "model b"
+    assert len(pool) == 2
+    assert pool.closed == []
+
+
+def test_idle_sessions_are_evicted():
+    pool = Pool(idle_seconds=IDLE_SECONDS)
+    with pool.use("idle"):
+        pass
+    held = pool.acquire("held")
+    time.sleep(2 * IDLE_SECONDS)
+
+    with pool.use("new"):
+        pass
+    assert list(pool.sessions) == ["held", "new"]
+    assert pool.closed == ["model idle"]
+    pool.release(held)
+
+
+def test_full_pool_evicts_the_least_recently_used_session():
+    pool = Pool(max_sessions=2)
+    with pool.use("first"), pool.use("second"):
+        with pytest.raises(PoolFullError):
+            pool.acquire("third")
+
+    with pool.use("first"):
+        pass
+    with pool.use("third"):
+        pass
+    assert list(pool.sessions) == ["first", "third"]
+    assert pool.closed == ["model second"]
+
+
+def test_removed_and_replaced_models_are_closed():
+    pool = Pool()
+    with pool.use("a") as session:
+        session.reset("new model a")
+    assert pool.closed == ["model a"]
+
+    assert pool.remove("a")
+    assert not pool.remove("a")
+    assert pool.closed == ["model a", "new model a"]
+
+    # A session removed while in use is closed when it is released
+    with pool.use("b"):
+        assert pool.remove("b")
+        assert pool.closed == ["model a", "new model a"]
+    assert pool.closed == ["model a", "new model a", "model b"]
@@ -0,0 +1,31 @@
+"""
+Tests that a model restored from a snapshot continues the simulation of the model that was saved.
+"""
+from environment import ENVIRONMENT
+from model import CarpoolModel
+from routing import ROUTERS
+from snapshot import load_snapshot, save_snapshot
+
+MAX_TICKS = 2000
+
+
+def finish(model) -> (int, dict, list):
+    """
+    Step a model until it finishes.
+    :return: Tuple (ticks, statistics, data of the cars)
+    """
+    while model.running and model.schedule.steps < MAX_TICKS:
+        model.step()
+    assert not model.running, "The simulation did not finish"
+    return model.schedule.steps, model.stats.to_dict(), model.get_cars_data()
+
+
+def test_restored_model_reaches_the_same_end(tmp_path):
+    path = str(tmp_path / "snapshot.npz")
+    for router in ROUTERS:
+        for seed in range(2):
+            model = CarpoolModel(ENVIRONMENT, 40, 10, 1, 12, 4, 2, seed=seed, router=router)
+            for _ in range(30):
+                model.step()
+            save_snapshot(model, path)
+            assert finish(load_snapshot(path)) == finish(model), (router, seed)
@@ -0,0 +1,92 @@
+"""
+Tests of the indexes of free cells where the agents are instantiated.
+"""
+import random
+
+from spawn import FreeCellIndex
+
+CELLS = [(x, 0) for x in range(6)]
+
+
+class FixedRandom:
+    def __init__(self, value: int):
+        """Random number generator that always draws the same number"""
+        self.value = value
+
+    def randrange(self, stop: int) -> int:
+        assert 0 <= self.value < stop
+        return self.value
+
+
+def check_consistent(index: FreeCellIndex):
+    """The free list, its slots and the counts of agents describe the same cells"""
+    assert sorted(index.free) == sorted(cell for cell, count in index.counts.items() if not count)
+    assert len(index.slots) == len(index.free)
+    for cell, slot in index.slots.items():
+        assert index.free[slot] == cell
+
+
+def all_samples(index: FreeCellIndex, exclude=None) -> list:
+    """Cells drawn for every number that the random number generator can draw"""
+    n_cells = len(index.free) - (exclude in index.slots)
+    return [index.sample(FixedRandom(value), exclude) for value in range(n_cells)]
+
+
+def test_cells_are_free_until_every_agent_leaves():
+    index = FreeCellIndex(CELLS)
+    index.occupy((2, 0))
+    index.occupy((2, 0))
+    index.release((2, 0))
+    assert (2, 0) not in index.free
+    check_consistent(index)
+
+    index.release((2, 0))
+    assert (2, 0) in index.free
+    check_consistent(index)
+
+    # Cells of other types are ignored
+    index.occupy((9, 9))
+    index.release((9, 9))
+    check_consistent(index)
+
+
+def test_random_occupations_keep_the_index_consistent():
+    rng = random.Random(0)
+    index = FreeCellIndex(CELLS)
+    agents = []
+    for _ in range(1000):
+        if agents and rng.random() < 0.5:
+            index.release(agents.pop(rng.randrange(len(agents))))
+        else:
+            cell = rng.choice(CELLS)
+            agents.append(cell)
+            index.occupy(cell)
+        check_consistent(index)
+        assert set(index.free) == set(CELLS) - set(agents)
+
+
+def test_sample_skips_the_excluded_cell():
+    index = FreeCellIndex(CELLS)
+    index.occupy((1, 0))
+    free = set(index.free)
+
+    assert sorted(all_samples(index)) == sorted(free)
+    for exclude in index.free:
+        samples = all_samples(index, exclude)
+        assert sorted(samples) == sorted(free - {exclude})
+    # The last slot, whose cell is never reached by the skip
+    assert index.free[-1] not in all_samples(index, index.free[-1])
+    # An occupied cell does not need to be skipped
+    assert sorted(all_samples(index, (1, 0))) == sorted(free)
+
+
+def test_sample_without_free_cells():
+    index = FreeCellIndex(CELLS)
+    for cell in CELLS[1:]:
+        index.occupy(cell)
+    assert index.sample(random.Random(0), exclude=CELLS[0]) is None
+    assert index.sample(random.Random(0)) == CELLS[0]
+
+    index.occupy(CELLS[0])
+    assert index.sample(random.Random(0)) is None
+    assert FreeCellIndex([]).sample(random.Random(0)) is None
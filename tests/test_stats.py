@@ -0,0 +1,36 @@
+"""
+Tests that the statistics of a simulation belong to its model.
+"""
+from environment import ENVIRONMENT
+from model import CarpoolModel
+
+TICKS = 60
+
+
+def create_models() -> (CarpoolModel, CarpoolModel):
+    """Two different scenarios on the same city"""
+    return (
+        CarpoolModel(ENVIRONMENT, 30, 5, 2, 20, 5, 3, seed=0),
+        CarpoolModel(ENVIRONMENT, 10, 2, 4, 40, 10, 1, seed=1),
+    )
+
+
+def test_models_count_their_own_statistics():
+    alone = []
+    for model in create_models():
+        for _ in range(TICKS):
+            model.step()
+        alone.append(model.stats.to_dict())
+    assert alone[0] != alone[1]
+
+    # Stepping both models in turns must not mix their counters
+    first, second = create_models()
+    for _ in range(TICKS):
+        first.step()
+        second.step()
+    assert first.stats.to_dict() == alone[0]
+    assert second.stats.to_dict() == alone[1]
+
+    # A new model starts from zero after the others ran
+    fresh = CarpoolModel(ENVIRONMENT, 1, 1, 1, 1, 1, 1)
+    assert all(value == 0 for value in fresh.stats.to_dict().values())
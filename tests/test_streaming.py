@@ -0,0 +1,107 @@
+"""
+Tests of the tick loop of the streaming mode, with a fake model that advances at a high rate.
+"""
+import time
+
+import numpy as np
+import pytest
+
+from delta import Frame
+from sessions import SessionPool
+from streaming import LoopError, start_loop
+
+RATE = 1000
+
+
+class FakeModel:
+    def __init__(self):
+        """Model with a single car that moves one cell per tick"""
+        self.ticks = 0
+
+    def get_new_car_data(self):
+        return []
+
+    def get_frame(self) -> Frame:
+        return Frame(
+            tick=self.ticks,
+            car_ids=np.array([0], dtype=np.int64),
+            cars=np.array([[self.ticks, 0, -1]], dtype=np.int32),
+            light_ids=[],
+            light_status=np.zeros(0, dtype=np.int8),
+            passenger_ids=np.zeros(0, dtype=np.int64),
+            passengers=np.zeros((0, 3), dtype=np.int32),
+        )
+
+
+def step(session):
+    session.model.ticks += 1
+
+
+def failing_step(session):
+    if session.model.ticks == 5:
+        raise RuntimeError("broken tick")
+    step(session)
+
+
+def create_pool() -> SessionPool:
+    return SessionPool(lambda session_id: FakeModel())
+
+
+def test_slow_subscriber_gets_one_merged_delta():
+    pool = create_pool()
+    loop = start_loop(pool, "a", RATE, step)
+    deltas = loop.deltas()
+
+    first = next(deltas)
+    assert first.full
+    time.sleep(0.05)
+    second = next(deltas)
+    assert not second.full
+    assert second.base == first.frame.tick
+    # Several ticks happened while the subscriber was busy, and only one delta covers them
+    assert second.frame.tick > first.frame.tick + 1
+    assert second.to_dict()["cars"]["x"] == [second.frame.tick]
+
+    loop.unsubscribe()
+    loop.join(1)
+
+
+def test_loop_stops_when_the_last_subscriber_leaves():
+    pool = create_pool()
+    loop = start_loop(pool, "a", RATE, step)
+    assert start_loop(pool, "a", RATE, step) is loop
+
+    loop.unsubscribe()
+    time.sleep(0.01)
+    assert loop.is_alive()
+
+    loop.unsubscribe()
+    loop.join(1)
+    assert not loop.is_alive()
+    assert list(loop.deltas()) == []
+    # The session is no longer in use, and a new subscriber starts a new loop
+    assert pool.sessions["a"].users == 0
+    new_loop = start_loop(pool, "a", RATE, step)
+    assert new_loop is not loop
+    new_loop.unsubscribe()
+    new_loop.join(1)
+
+
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_failing_tick_reaches_the_subscribers():
+    pool = create_pool()
+    loop = start_loop(pool, "a", RATE, failing_step)
+
+    with pytest.raises(LoopError, match="RuntimeError: broken tick"):
+        for _ in loop.deltas():
+            pass
+    loop.join(1)
+    assert loop.stopped
+    assert pool.sessions["a"].users == 0
+
+    # Later subscribers do not attach to the stopped loop
+    new_loop = start_loop(pool, "a", RATE, step)
+    assert new_loop is not loop
+    assert next(new_loop.deltas()).full
+    new_loop.unsubscribe()
+    new_loop.join(1)
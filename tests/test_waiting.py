@@ -0,0 +1,54 @@
+"""
+Tests that the index of waiting passengers agrees with a scan of the passengers of the model.
+"""
+from agents import Passenger
+from citymap import CityMap
+from dispatch import DISPATCHERS
+from environment import ENVIRONMENT
+from model import CarpoolModel
+
+TICKS = 150
+CITY = CityMap.from_environment(ENVIRONMENT)
+ROAD_CELLS = CITY.road_cells() + [
+    (intersection["x"], intersection["y"]) for intersection in CITY.intersection_data()
+]
+
+
+def adjacent_passengers(model: CarpoolModel, coords: (int, int)) -> set:
+    """Passengers on the sidewalks next to a cell, found with the neighbors of the grid"""
+    return {
+        agent
+        for agent in model.grid.get_neighbors(pos=coords, moore=False, include_center=False)
+        if isinstance(agent, Passenger) and not (agent.is_traveling or agent.has_arrived)
+    }
+
+
+def test_index_matches_the_passengers():
+    for dispatcher in DISPATCHERS:
+        model = CarpoolModel(ENVIRONMENT, 30, 5, 2, 20, 5, 3, seed=0, dispatcher=dispatcher)
+        picked_up = []
+        pick_up = model.waiting.pick_up
+
+        def record_pick_up(passenger: Passenger):
+            assert passenger.is_waiting
+            picked_up.append(passenger)
+            pick_up(passenger)
+
+        model.waiting.pick_up = record_pick_up
+        for _ in range(TICKS):
+            model.step()
+            needing_ride = [passenger for passenger in model.passengers if passenger.needs_ride()]
+            assert model.waiting.needing_ride() == needing_ride, dispatcher
+            for coords in ROAD_CELLS:
+                assert set(model.waiting.next_to(coords)) == adjacent_passengers(model, coords)
+            for passenger in picked_up:
+                assert passenger.is_traveling or passenger.has_arrived
+                assert passenger not in model.waiting.cells
+            if not model.running:
+                break
+
+        assert picked_up, dispatcher
+        assert len(set(picked_up)) == len(picked_up)
+        # Cells that are not roads have no passengers next to them
+        assert model.waiting.next_to(CITY.sidewalk_cells()[0]) == []
+
@@ -0,0 +1,65 @@
+"""
+Index of the passengers that wait on the sidewalks, by the Road/Intersection cells next to them.
+It is updated when a passenger spawns, confirms a car and is picked up, so the model does not
+filter all of its passengers at every tick to find the ones that need a ride, and a car checks
+whether its passenger is next to it with a lookup instead of a scan of the neighbors in the grid.
+"""
+from __future__ import annotations
+from typing import TYPE_CHECKING, Dict, List
+
+from routing import NO_CELL, RoadGraph
+
+if TYPE_CHECKING:
+    from agents import Passenger
+
+
+class WaitingIndex:
+    def __init__(self, graph: RoadGraph):
+        """
+        :param graph: The road graph, whose cell ids are the keys of the index
+        """
+        self.graph = graph
+        # Passengers that need a ride, in the order they spawned, and the cells next to each one
+        self.unconfirmed: Dict[Passenger, List[int]] = {}
+        # Passengers on a sidewalk next to each cell that have not been picked up
+        self.by_cell: Dict[int, List[Passenger]] = {}
+        self.cells: Dict[Passenger, List[int]] = {}
+
+    def add(self, passenger: Passenger):
+        """Register a passenger that just spawned and needs a ride"""
+        cells = self.graph.adjacent_cells(passenger.pos)
+        self.unconfirmed[passenger] = cells
+        self.cells[passenger] = cells
+        for cell in cells:
+            self.by_cell.setdefault(cell, []).append(passenger)
+
+    def confirm(self, passenger: Passenger):
+        """A passenger confirmed a car, so it no longer needs a ride but still waits"""
+        self.unconfirmed.pop(passenger, None)
+
+    def pick_up(self, passenger: Passenger):
+        """A passenger left the sidewalk"""
+        self.confirm(passenger)
+        for cell in self.cells.pop(passenger, []):
+            waiting = self.by_cell[cell]
+            waiting.remove(passenger)
+            if not waiting:
+                del self.by_cell[cell]
+
+    def needing_ride(self) -> List[Passenger]:
+        """Passengers that need a ride, in the order they spawned"""
+        return list(self.unconfirmed)
+
+    def targets(self) -> List[List[int]]:
+        """Cells next to each of the passengers of needing_ride, in the same order"""
+        return list(self.unconfirmed.values())
+
+    def next_to(self, coords: (int, int)) -> List[Passenger]:
+        """
+        Obtain the passengers that wait next to a cell.
+        :return: List of passengers, empty if the position is not a Road/Intersection cell
+        """
+        cell = self.graph.cell_id(coords)
+        if cell == NO_CELL:
+            return []
+        return self.by_cell.get(cell, [])